@@ -0,0 +1,85 @@
+'''
+This script benchmarks the request signature verification path of the API gateway
+(``sign_request()``) for the legacy and modern API versions,
+with and without the derived signing key cache.
+'''
+
+import asyncio
+from collections import UserDict
+from datetime import datetime
+import time
+
+import click
+from dateutil.tz import tzutc
+from tabulate import tabulate
+
+from ai.backend.gateway.auth import SigningKeyCache, sign_request
+
+
+def make_request(api_version: str, body: bytes) -> UserDict:
+    # UserDict allows attribute assignment while working like aiohttp's request mapping.
+    now = datetime.now(tzutc())
+    request = UserDict()
+    request.method = 'POST'
+    request.raw_path = '/session'
+    request.host = 'api.example.com'
+    request.content_type = 'application/json'
+    request.can_read_body = bool(body)
+    request.headers = {'X-BackendAI-Version': api_version}
+    request['date'] = now
+    request['raw_date'] = now.isoformat()
+
+    async def read():
+        return body
+
+    request.read = read
+    return request
+
+
+async def bench(request, hash_type: str, cached: bool, num_iterations: int) -> float:
+    cache = SigningKeyCache() if cached else None
+    sign_method = f'HMAC-{hash_type.upper()}'
+    begin = time.perf_counter()
+    for _ in range(num_iterations):
+        await sign_request(
+            sign_method, request, 'dummy-secret-key',
+            access_key='AKIADUMMYACCESSKEY',
+            signing_key_cache=cache,
+        )
+    return time.perf_counter() - begin
+
+
+@click.command()
+@click.option('-n', '--iterations', 'num_iterations', type=int, default=100000,
+              help='The number of signatures to compute per case. [default: 100000]')
+@click.option('--hash-type', type=str, default='sha256',
+              help='The hash algorithm of the signing method. [default: sha256]')
+@click.option('--body-size', type=int, default=4096,
+              help='The request body size for the legacy API versions. [default: 4096]')
+def main(num_iterations, hash_type, body_size) -> None:
+    '''
+    Measure the per-request cost of sign_request() for each API version.
+    '''
+    body = b'x' * body_size
+    cases = [
+        ('v5.20191215', b''),
+        ('v4.20181215', b''),
+        ('v4.20180915', body),  # legacy: the body is included in the signature
+    ]
+    results = []
+    for api_version, req_body in cases:
+        for cached in (False, True):
+            request = make_request(api_version, req_body)
+            elapsed = asyncio.run(bench(request, hash_type, cached, num_iterations))
+            results.append({
+                'api_version': api_version,
+                'body_size': len(req_body),
+                'signing_key_cache': cached,
+                'usec/req': f'{elapsed / num_iterations * 1e6:.2f}',
+                'req/sec': f'{num_iterations / elapsed:,.0f}',
+            })
+    print(tabulate(results, headers='keys'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''
+This script benchmarks the scheduler plugins by replaying
+synthetic agent and session populations through them,
+without the database, Redis and agents.
+'''
+
+import asyncio
+import sys
+
+import click
+from tabulate import tabulate
+
+from ai.backend.manager.scheduler.simulation import (
+    SimulationConfig,
+    run_simulation,
+)
+
+
+@click.command()
+@click.option('-s', '--scheduler', 'scheduler_names', type=str, multiple=True,
+              default=['fifo', 'lifo', 'drf'],
+              help='The scheduler(s) to benchmark. [default: fifo, lifo, drf]')
+@click.option('-a', '--agents', 'num_agents', type=int, default=1000,
+              help='The number of agents. [default: 1000]')
+@click.option('-n', '--sessions', 'num_sessions', type=int, default=10000,
+              help='The number of queued sessions. [default: 10000]')
+@click.option('-u', '--users', 'num_users', type=int, default=200,
+              help='The number of users (keypairs) owning the sessions. [default: 200]')
+@click.option('--multi-node-ratio', type=float, default=0.05,
+              help='The ratio of multi-node cluster sessions. [default: 0.05]')
+@click.option('--max-cluster-size', type=int, default=4,
+              help='The maximum number of kernels in a cluster session. [default: 4]')
+@click.option('--max-session-ticks', type=int, default=10,
+              help='The maximum lifetime of started sessions in ticks. [default: 10]')
+@click.option('--max-concurrent-sessions', type=int, default=30,
+              help='The per-keypair concurrency limit. [default: 30]')
+@click.option('-t', '--ticks', 'max_ticks', type=int, default=100,
+              help='The maximum number of scheduling ticks to simulate. [default: 100]')
+@click.option('--agent-selection', type=str, default=None,
+              help='Override the agent selection strategy of the schedulers '
+                   '(most-available, best-fit, worst-fit).')
+@click.option('--backfill', is_flag=True, default=False,
+              help='Let the schedulers backfill the sessions behind a blocked one.')
+@click.option('--seed', type=int, default=0,
+              help='The random seed to generate the populations. [default: 0]')
+def main(scheduler_names, num_agents, num_sessions, num_users,
+         multi_node_ratio, max_cluster_size, max_session_ticks, max_concurrent_sessions,
+         max_ticks, agent_selection, backfill, seed) -> None:
+    '''
+    Replay the same synthetic population through each scheduler and report
+    the per-tick latency, throughput and placement quality.
+    '''
+    config = SimulationConfig(
+        num_agents=num_agents,
+        num_sessions=num_sessions,
+        num_users=num_users,
+        multi_node_ratio=multi_node_ratio,
+        max_cluster_size=max_cluster_size,
+        max_session_ticks=max_session_ticks,
+        max_concurrent_sessions=max_concurrent_sessions,
+        max_ticks=max_ticks,
+        seed=seed,
+    )
+    scheduler_config = {}
+    if agent_selection is not None:
+        scheduler_config['agent-selection'] = agent_selection
+    if backfill:
+        scheduler_config['backfill'] = True
+    results = []
+    for scheduler_name in scheduler_names:
+        print(f'simulating {scheduler_name} ...', file=sys.stderr)
+        result = asyncio.run(run_simulation(
+            scheduler_name, config, scheduler_config=scheduler_config,
+        ))
+        results.append(result.summary())
+    print(tabulate(results, headers='keys'))
+
+
+if __name__ == '__main__':
+    main()
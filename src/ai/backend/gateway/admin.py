@@ -20,7 +20,7 @@ from ai.backend.common import validators as tx
 
 from .manager import GQLMutationUnfrozenRequiredMiddleware
 from .exceptions import GraphQLError as BackendGQLError
-from .auth import auth_required
+from .auth import auth_required, invalidate_auth_cache
 from .types import CORSOptions, WebMiddleware
 from .utils import check_api_params
 from ..manager.models.base import DataLoaderManager
@@ -33,6 +33,14 @@ log = BraceStyleAdapter(logging.getLogger('ai.backend.gateway.admin'))
 
 _rx_qname = re.compile(r'{\s*(\w+)\b')
 
+# The mutations that may change the cached authentication rows of keypairs.
+AUTH_CACHE_INVALIDATING_MUTATIONS = frozenset([
+    'modify_domain', 'delete_domain', 'purge_domain',
+    'modify_user', 'delete_user', 'purge_user',
+    'modify_keypair', 'delete_keypair',
+    'modify_keypair_resource_policy', 'delete_keypair_resource_policy',
+])
+
 
 class GQLLoggingMiddleware:
 
@@ -46,6 +54,17 @@ class GQLLoggingMiddleware:
         return next(root, info, **args)
 
 
+class GQLAuthCacheInvalidationMiddleware:
+
+    def resolve(self, next, root, info, **args):
+        if (
+            info.operation.operation == 'mutation' and len(info.path) == 1 and
+            info.field_name in AUTH_CACHE_INVALIDATING_MUTATIONS
+        ):
+            info.context['invalidate_auth_cache'] = True
+        return next(root, info, **args)
+
+
 @atomic
 @auth_required
 @check_api_params(
@@ -62,6 +81,7 @@ async def handle_gql(request: web.Request, params: Any) -> web.Response:
     context = {
         'config': request.app['config'],
         'config_server': request.app['config_server'],
+        'metadata_cache': request.app['metadata_cache'],
         'etcd': request.app['config_server'].etcd,
         'user': request['user'],
         'access_key': request['keypair']['access_key'],
@@ -72,22 +92,27 @@ async def handle_gql(request: web.Request, params: Any) -> web.Response:
         'background_task_manager': request.app['background_task_manager'],
     }
     dlmanager = DataLoaderManager(context)
+    context_value = {
+        'dlmgr': dlmanager,
+        **context,
+    }
     result = schema.execute(
         params['query'], executor,
         variable_values=params['variables'],
         operation_name=params['operation_name'],
-        context_value={
-            'dlmgr': dlmanager,
-            **context,
-        },
+        context_value=context_value,
         middleware=[
             GQLLoggingMiddleware(),
             GQLMutationUnfrozenRequiredMiddleware(),
             GQLMutationPrivilegeCheckMiddleware(),
+            GQLAuthCacheInvalidationMiddleware(),
         ],
         return_promise=True)
     if inspect.isawaitable(result):
         result = await result
+    if context_value.get('invalidate_auth_cache', False):
+        # Invalidate even on errors since some mutations may have been applied.
+        await invalidate_auth_cache(request.app)
     if result.errors:
         errors = []
         for e in result.errors:
@@ -1,18 +1,28 @@
-from collections import ChainMap
+from __future__ import annotations
+
+import asyncio
+from collections import ChainMap, OrderedDict
 from datetime import datetime, timedelta
 import functools
 import hashlib, hmac
 import logging
 import secrets
+import time
 from typing import (
     Any, Final,
+    Dict,
     Iterable,
+    Mapping,
+    Optional,
     Tuple,
 )
 
 from aiohttp import web
 import aiohttp_cors
 from aiojobs.aiohttp import atomic
+from aiopg.sa.engine import Engine as SAEngine
+import aiotools
+from aiotools import apartial
 import click
 from dateutil.tz import tzutc
 from dateutil.parser import parse as dtparse
@@ -42,11 +52,17 @@ from ..manager.models import (
 from ..manager.models.user import UserRole, UserStatus, INACTIVE_USER_STATUSES, check_credential
 from ..manager.models.keypair import generate_keypair as _gen_keypair, generate_ssh_keypair
 from ..manager.models.group import association_groups_users, groups
+from ..manager.models.utils import execute_bulk_update
 from .types import CORSOptions, WebMiddleware
 from .utils import check_api_params, set_handler_attr, get_handler_attr
 
 log: Final = BraceStyleAdapter(logging.getLogger('ai.backend.gateway.auth'))
 
+AUTH_CACHE_SIZE: Final = 4096
+AUTH_CACHE_TTL: Final = 30.0  # seconds
+KEYPAIR_USAGE_FLUSH_INTERVAL: Final = 5.0  # seconds
+SIGNING_KEY_CACHE_SIZE: Final = 4096
+
 whois_timezone_info: Final = {
     "A": 1 * 3600,
     "ACDT": 10.5 * 3600,
@@ -278,6 +294,141 @@ whois_timezone_info: Final = {
 }
 
 
+class AuthCache:
+    """
+    A LRU cache of the authentication rows (the joined keypair, user, and keypair resource
+    policy) keyed by the access key.
+
+    The entries expire after *ttl* seconds, and are dropped earlier by the
+    ``auth_cache_invalidated`` events whenever the keypairs, users, or resource policies
+    are modified.
+    """
+
+    __slots__ = ('maxsize', 'ttl', 'generation', '_data')
+
+    maxsize: int
+    ttl: float
+    generation: int
+    _data: OrderedDict[str, Tuple[float, Mapping[str, Any]]]
+
+    def __init__(self, maxsize: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Bumped on every invalidation so that a row fetched before the invalidation
+        # is not stored afterwards.
+        self.generation = 0
+        self._data = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, access_key: str) -> Optional[Mapping[str, Any]]:
+        entry = self._data.get(access_key)
+        if entry is None:
+            return None
+        expires_at, row = entry
+        if expires_at <= time.monotonic():
+            del self._data[access_key]
+            return None
+        self._data.move_to_end(access_key)
+        return row
+
+    def put(self, access_key: str, row: Mapping[str, Any], generation: int) -> None:
+        if generation != self.generation:
+            return
+        self._data[access_key] = (time.monotonic() + self.ttl, row)
+        self._data.move_to_end(access_key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, access_keys: Optional[Iterable[str]] = None) -> None:
+        """
+        Drop the given access keys, or all entries if *access_keys* is None.
+        """
+        self.generation += 1
+        if access_keys is None:
+            self._data.clear()
+        else:
+            for access_key in access_keys:
+                self._data.pop(access_key, None)
+
+
+class KeypairUsageRecorder:
+    """
+    Aggregates the last-used timestamps and the query counts of the keypairs in memory
+    so that they are written to the database in batches instead of for every request.
+    """
+
+    __slots__ = ('_usage',)
+
+    _usage: Dict[str, Tuple[datetime, int]]
+
+    def __init__(self) -> None:
+        self._usage = {}
+
+    def __len__(self) -> int:
+        return len(self._usage)
+
+    def record(self, access_key: str, now: Optional[datetime] = None) -> None:
+        if now is None:
+            now = datetime.now(tzutc())
+        prev_usage = self._usage.get(access_key)
+        if prev_usage is None:
+            self._usage[access_key] = (now, 1)
+        else:
+            self._usage[access_key] = (max(prev_usage[0], now), prev_usage[1] + 1)
+
+    def _merge(self, usage: Mapping[str, Tuple[datetime, int]]) -> None:
+        for access_key, (last_used, num_queries) in usage.items():
+            prev_usage = self._usage.get(access_key)
+            if prev_usage is not None:
+                last_used = max(prev_usage[0], last_used)
+                num_queries += prev_usage[1]
+            self._usage[access_key] = (last_used, num_queries)
+
+    async def flush(self, dbpool: SAEngine) -> int:
+        """
+        Write the aggregated usage to the keypairs table and return the number of
+        updated keypairs.  If it fails, the usage is kept for the next flush.
+        """
+        if not self._usage:
+            return 0
+        usage, self._usage = self._usage, {}
+        updates = {
+            access_key: {'last_used': last_used, 'num_queries': num_queries}
+            for access_key, (last_used, num_queries) in usage.items()
+        }
+        try:
+            async with dbpool.acquire() as conn, conn.begin():
+                # Lock the rows in the key order to avoid deadlocks with other transactions.
+                query = (
+                    sa.select([keypairs.c.access_key], for_update=True)
+                    .select_from(keypairs)
+                    .where(keypairs.c.access_key.in_(sorted(updates.keys())))
+                    .order_by(keypairs.c.access_key)
+                )
+                await conn.execute(query)
+                return await execute_bulk_update(
+                    conn, keypairs, keypairs.c.access_key, updates,
+                    increments=('num_queries',),
+                )
+        except BaseException:
+            self._merge(usage)
+            raise
+
+
+async def invalidate_auth_cache(
+    app: web.Application,
+    access_keys: Optional[Iterable[str]] = None,
+) -> None:
+    """
+    Let all manager processes drop the cached authentication rows of the given access keys,
+    or all of them if *access_keys* is None.
+    """
+    args = () if access_keys is None else (list(access_keys),)
+    await app['event_dispatcher'].produce_event('auth_cache_invalidated', args)
+
+
 def _extract_auth_params(request):
     """
     HTTP Authorization header must be formatted as:
@@ -334,7 +485,74 @@ def check_date(request) -> bool:
     return True
 
 
-async def sign_request(sign_method, request, secret_key) -> str:
+def _derive_signing_key(secret_key: str, date: str, host: str, hash_type: str) -> bytes:
+    sign_key = hmac.new(secret_key.encode(), date.encode(), hash_type).digest()
+    return hmac.new(sign_key, host.encode(), hash_type).digest()
+
+
+@functools.lru_cache(maxsize=None)
+def _empty_body_hash(hash_type: str) -> str:
+    return hashlib.new(hash_type, b'').hexdigest()
+
+
+class SigningKeyCache:
+    """
+    A LRU cache of the derived request signing keys, keyed by the access key,
+    the request date, the host, and the hash type.
+
+    As the signing keys are derived from the request date, the entries of the past dates
+    are purged as a whole when a new date appears.
+    """
+
+    __slots__ = ('maxsize', '_data')
+
+    maxsize: int
+    _data: Dict[str, OrderedDict[Tuple[str, str, str], Tuple[str, bytes]]]
+
+    def __init__(self, maxsize: int = SIGNING_KEY_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self._data = {}
+
+    def __len__(self) -> int:
+        return sum(len(per_date) for per_date in self._data.values())
+
+    def get(
+        self,
+        access_key: str,
+        secret_key: str,
+        date: str,
+        host: str,
+        hash_type: str,
+    ) -> bytes:
+        """
+        Return the signing key, deriving it only if it is not cached yet.
+        """
+        per_date = self._data.get(date)
+        if per_date is None:
+            per_date = self._data[date] = OrderedDict()
+            # Keep the previous date as well for the requests around the midnight.
+            for old_date in sorted(self._data.keys())[:-2]:
+                del self._data[old_date]
+        key = (access_key, host, hash_type)
+        entry = per_date.get(key)
+        if entry is not None and entry[0] == secret_key:
+            per_date.move_to_end(key)
+            return entry[1]
+        sign_key = _derive_signing_key(secret_key, date, host, hash_type)
+        per_date[key] = (secret_key, sign_key)
+        while len(per_date) > self.maxsize:
+            per_date.popitem(last=False)
+        return sign_key
+
+
+async def sign_request(
+    sign_method,
+    request,
+    secret_key,
+    *,
+    access_key: Optional[str] = None,
+    signing_key_cache: Optional[SigningKeyCache] = None,
+) -> str:
     try:
         mac_type, hash_type = map(lambda s: s.lower(), sign_method.split('-'))
         assert mac_type == 'hmac', 'Unsupported request signing method (MAC type)'
@@ -351,7 +569,10 @@ async def sign_request(sign_method, request, secret_key) -> str:
                 request.content_type != 'multipart/form-data'):
                 # read the whole body if neither streaming nor bodyless
                 body = await request.read()
-        body_hash = hashlib.new(hash_type, body).hexdigest()
+        if body:
+            body_hash = hashlib.new(hash_type, body).hexdigest()
+        else:
+            body_hash = _empty_body_hash(hash_type)
 
         sign_bytes = ('{0}\n{1}\n{2}\nhost:{3}\ncontent-type:{4}\n'
                       'x-{name}-version:{5}\n{6}').format(
@@ -360,10 +581,11 @@ async def sign_request(sign_method, request, secret_key) -> str:
             body_hash,
             name='backendai' if new_api_version is not None else 'sorna'
         ).encode()
-        sign_key = hmac.new(secret_key.encode(),
-                            request['date'].strftime('%Y%m%d').encode(),
-                            hash_type).digest()
-        sign_key = hmac.new(sign_key, request.host.encode(), hash_type).digest()
+        date = request['date'].strftime('%Y%m%d')
+        if signing_key_cache is not None and access_key is not None:
+            sign_key = signing_key_cache.get(access_key, secret_key, date, request.host, hash_type)
+        else:
+            sign_key = _derive_signing_key(secret_key, date, request.host, hash_type)
         return hmac.new(sign_key, sign_bytes, hash_type).hexdigest()
     except ValueError:
         raise AuthorizationFailed('Invalid signature')
@@ -372,7 +594,7 @@ async def sign_request(sign_method, request, secret_key) -> str:
 
 
 @web.middleware
-async def auth_middleware(request, handler):
+async def auth_middleware(app: web.Application, request: web.Request, handler) -> web.StreamResponse:
     '''
     Fetches user information and sets up keypair, uesr, and is_authorized
     attributes.
@@ -390,47 +612,54 @@ async def auth_middleware(request, handler):
     params = _extract_auth_params(request)
     if params:
         sign_method, access_key, signature = params
-        async with request.app['dbpool'].acquire() as conn, conn.begin():
-            j = (keypairs.join(users, keypairs.c.user == users.c.uuid)
-                         .join(keypair_resource_policies,
-                               keypairs.c.resource_policy == keypair_resource_policies.c.name))
-            query = (sa.select([users, keypairs, keypair_resource_policies], use_labels=True)
-                       .select_from(j)
-                       .where((keypairs.c.access_key == access_key) &
-                              (keypairs.c.is_active.is_(True))))
-            result = await conn.execute(query)
-            row = await result.first()
+        auth_cache: AuthCache = app['auth_cache']
+        row = auth_cache.get(access_key)
+        if row is None:
+            generation = auth_cache.generation
+            async with app['dbpool'].acquire() as conn:
+                j = (keypairs.join(users, keypairs.c.user == users.c.uuid)
+                             .join(keypair_resource_policies,
+                                   keypairs.c.resource_policy == keypair_resource_policies.c.name))
+                query = (sa.select([users, keypairs, keypair_resource_policies], use_labels=True)
+                           .select_from(j)
+                           .where((keypairs.c.access_key == access_key) &
+                                  (keypairs.c.is_active.is_(True))))
+                result = await conn.execute(query)
+                row = await result.first()
             if row is None:
                 raise AuthorizationFailed('Access key not found')
-            my_signature = \
-                await sign_request(sign_method, request, row['keypairs_secret_key'])
-            if secrets.compare_digest(my_signature, signature):
-                query = (keypairs.update()
-                                 .values(last_used=datetime.now(tzutc()),
-                                         num_queries=keypairs.c.num_queries + 1)
-                                 .where(keypairs.c.access_key == access_key))
-                await conn.execute(query)
-                request['is_authorized'] = True
-                request['keypair'] = {
-                    col.name: row[f'keypairs_{col.name}']
-                    for col in keypairs.c
-                    if col.name != 'secret_key'
-                }
-                request['keypair']['resource_policy'] = {
-                    col.name: row[f'keypair_resource_policies_{col.name}']
-                    for col in keypair_resource_policies.c
-                }
-                request['user'] = {
-                    col.name: row[f'users_{col.name}']
-                    for col in users.c
-                    if col.name not in ('password', 'description', 'created_at')
-                }
-                request['user']['id'] = row['keypairs_user_id']  # legacy
-                # if request['role'] in ['admin', 'superadmin']:
-                if row['keypairs_is_admin']:
-                    request['is_admin'] = True
-                if request['user']['role'] == 'superadmin':
-                    request['is_superadmin'] = True
+            row = dict(row)
+            auth_cache.put(access_key, row, generation)
+        my_signature = \
+            await sign_request(
+                sign_method, request, row['keypairs_secret_key'],
+                access_key=access_key,
+                signing_key_cache=app['signing_key_cache'],
+            )
+        if secrets.compare_digest(my_signature, signature):
+            app['keypair_usage_recorder'].record(access_key)
+            request['is_authorized'] = True
+            # Build new dicts for each request since the handlers may modify them.
+            request['keypair'] = {
+                col.name: row[f'keypairs_{col.name}']
+                for col in keypairs.c
+                if col.name != 'secret_key'
+            }
+            request['keypair']['resource_policy'] = {
+                col.name: row[f'keypair_resource_policies_{col.name}']
+                for col in keypair_resource_policies.c
+            }
+            request['user'] = {
+                col.name: row[f'users_{col.name}']
+                for col in users.c
+                if col.name not in ('password', 'description', 'created_at')
+            }
+            request['user']['id'] = row['keypairs_user_id']  # legacy
+            # if request['role'] in ['admin', 'superadmin']:
+            if row['keypairs_is_admin']:
+                request['is_admin'] = True
+            if request['user']['role'] == 'superadmin':
+                request['is_superadmin'] = True
 
     # No matter if authenticated or not, pass-through to the handler.
     # (if it's required, auth_required decorator will handle the situation.)
@@ -735,8 +964,11 @@ async def signout(request: web.Request, params: Any) -> web.Response:
         # Inactivate every keypairs of the user.
         query = (keypairs.update()
                          .values(is_active=False)
-                         .where(keypairs.c.user_id == params['email']))
-        await conn.execute(query)
+                         .where(keypairs.c.user_id == params['email'])
+                         .returning(keypairs.c.access_key))
+        result = await conn.execute(query)
+        access_keys = [row['access_key'] async for row in result]
+    await invalidate_auth_cache(request.app, access_keys)
     return web.json_response({})
 
 
@@ -786,6 +1018,8 @@ async def update_password(request: web.Request, params: Any) -> web.Response:
         }
         query = (users.update().values(data).where(users.c.email == email))
         await conn.execute(query)
+    # The user may have multiple keypairs.
+    await invalidate_auth_cache(request.app)
     return web.json_response({}, status=200)
 
 
@@ -825,13 +1059,54 @@ async def refresh_ssh_keypair(request: web.Request) -> web.Response:
                          .values(data)
                          .where(keypairs.c.access_key == access_key))
         await conn.execute(query)
+    await invalidate_auth_cache(request.app, [access_key])
     return web.json_response(data, status=200)
 
 
+async def handle_auth_cache_invalidation(
+    app: web.Application, agent_id: str, event_name: str,
+    access_keys: Optional[Iterable[str]] = None,
+) -> None:
+    app['auth_cache'].invalidate(access_keys)
+
+
+async def flush_keypair_usage(app: web.Application, interval: float) -> None:
+    try:
+        await app['keypair_usage_recorder'].flush(app['dbpool'])
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        log.exception('flush_keypair_usage(): error while updating the keypair usage')
+
+
+async def init(app: web.Application) -> None:
+    # The event dispatcher may be missing in a minimal setup (e.g., tests),
+    # where the cached rows just expire after AUTH_CACHE_TTL.
+    if 'event_dispatcher' in app:
+        app['event_dispatcher'].subscribe(
+            'auth_cache_invalidated', app, handle_auth_cache_invalidation)
+    app['keypair_usage_flusher'] = aiotools.create_timer(
+        functools.partial(flush_keypair_usage, app), KEYPAIR_USAGE_FLUSH_INTERVAL)
+
+
+async def shutdown(app: web.Application) -> None:
+    app['keypair_usage_flusher'].cancel()
+    await app['keypair_usage_flusher']
+    try:
+        await app['keypair_usage_recorder'].flush(app['dbpool'])
+    except Exception:
+        log.exception('error while updating the keypair usage during shutdown')
+
+
 def create_app(default_cors_options: CORSOptions) -> Tuple[web.Application, Iterable[WebMiddleware]]:
     app = web.Application()
     app['prefix'] = 'auth'  # slashed to distinguish with "/vN/authorize"
     app['api_versions'] = (1, 2, 3, 4)
+    app['auth_cache'] = AuthCache()
+    app['keypair_usage_recorder'] = KeypairUsageRecorder()
+    app['signing_key_cache'] = SigningKeyCache()
+    app.on_startup.append(init)
+    app.on_shutdown.append(shutdown)
     cors = aiohttp_cors.setup(app, defaults=default_cors_options)
     root_resource = cors.add(app.router.add_resource(r''))
     cors.add(root_resource.add_route('GET', test))
@@ -846,7 +1121,8 @@ def create_app(default_cors_options: CORSOptions) -> Tuple[web.Application, Iter
     cors.add(app.router.add_route('POST', '/update-password', update_password))
     cors.add(app.router.add_route('GET', '/ssh-keypair', get_ssh_keypair))
     cors.add(app.router.add_route('PATCH', '/ssh-keypair', refresh_ssh_keypair))
-    return app, [auth_middleware]
+    # middleware must be wrapped by web.middleware at the outermost level.
+    return app, [web.middleware(apartial(auth_middleware, app))]
 
 
 @click.group()
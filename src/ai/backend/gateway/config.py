@@ -49,6 +49,14 @@ manager_local_config_iv = t.Dict({
         t.Key('hide-agents', default=False): t.Bool,
         t.Key('importer-image', default='lablup/importer:manylinux2010'): t.String,
         t.Key('max-wsmsg-size', default=16 * (2**20)): t.ToInt,  # default: 16 MiB
+        t.Key('scheduler-incremental', default=False): t.ToBool,
+        t.Key('resource-usage-check-interval', default=300.0): t.Float[1.0:],  # type: ignore
+        t.Key('event-transport', default='redis-list'): t.Enum('redis-list', 'redis-stream'),
+        t.Key('rate-limit-mode', default='exact'): t.Enum('exact', 'approximate'),
+        t.Key('cluster-ssh-keypair-pool-size', default=8): t.Int[0:],
+        t.Key('session-start-concurrency', default=32): t.Int[1:],
+        t.Key('session-start-concurrency-per-agent', default=4): t.Int[1:],
+        t.Key('metadata-cache-ttl', default=60.0): t.Float[0:],  # type: ignore
     }).allow_extra('*'),
     t.Key('docker-registry'): t.Dict({
         t.Key('ssl-verify', default=True): t.ToBool,
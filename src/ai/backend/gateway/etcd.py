@@ -161,8 +161,9 @@ from decimal import Decimal
 import logging
 import json
 from pathlib import Path
+import time
 from typing import (
-    Any, Optional, Union,
+    Any, Final, Optional, Union,
     AsyncGenerator,
     Iterable,
     Mapping, DefaultDict,
@@ -175,6 +176,7 @@ import aiohttp_cors
 import aiojobs
 from aiojobs.aiohttp import atomic
 import aiotools
+import attr
 import trafaret as t
 import yaml
 import yarl
@@ -220,6 +222,25 @@ config_defaults = {
 
 current_vfolder_types: ContextVar[List[str]] = ContextVar('current_vfolder_types')
 
+# The etcd prefixes whose changes invalidate the image catalog.
+# The known registries also affect the parsing of image references.
+IMAGE_CATALOG_WATCH_PREFIXES: Final = ('images', 'config/docker/registry')
+# The maximum age of the image catalog even without watched changes,
+# as the etcd watch may miss the changes made while reconnecting.
+IMAGE_CATALOG_MAX_AGE: Final = 300.0  # seconds
+
+
+@attr.s(auto_attribs=True, slots=True, frozen=True)
+class ImageCatalog:
+    '''
+    A compiled snapshot of the image metadata stored in etcd,
+    except the installation status which changes as the agents pull images.
+    '''
+    version: int
+    built_at: float
+    refs: Sequence[ImageRef]
+    items: Sequence[Mapping[str, Any]]
+
 
 class ConfigServer:
 
@@ -242,8 +263,16 @@ class ConfigServer:
             # TODO: provide a way to specify other scope prefixes
         }
         self.etcd = AsyncEtcd(etcd_addr, namespace, scope_prefix_map, credentials=credentials)
+        self._image_catalog: Optional[ImageCatalog] = None
+        self._image_catalog_version = 0
+        self._image_catalog_build: Optional[Tuple[int, asyncio.Task]] = None
+        self._image_catalog_watchers: List[Tuple[asyncio.Task, asyncio.Event]] = []
 
     async def close(self) -> None:
+        for task, _ in self._image_catalog_watchers:
+            task.cancel()
+            await task
+        self._image_catalog_watchers.clear()
         await self.etcd.close()
 
     async def get(self, key: str, allow_null: bool = True) -> Optional[str]:
@@ -278,6 +307,7 @@ class ConfigServer:
             target = item[1]
             await self.etcd.put(f'images/_aliases/{etcd_quote(alias)}', target)
             print(f'{alias} -> {target}')
+        self.invalidate_image_catalog()
         log.info('Done.')
 
     async def _scan_reverse_aliases(self) -> Mapping[str, List[str]]:
@@ -287,12 +317,43 @@ class ConfigServer:
             result[value].append(etcd_unquote(key))
         return dict(result)
 
+    async def get_image_installation(self, image_ref: ImageRef) -> Mapping[str, Any]:
+        '''
+        Returns the installation status of the image, which changes more often than
+        the other image metadata as the agents pull or remove images.
+        '''
+        installations = await self.get_image_installations([image_ref])
+        return installations[0]
+
+    async def get_image_installations(
+        self,
+        image_refs: Sequence[ImageRef],
+    ) -> Sequence[Mapping[str, Any]]:
+        '''
+        Returns the installation status of the images with a single pipelined Redis call.
+        '''
+        if not image_refs:
+            return []
+        pipe = self.context['redis_image'].pipeline()
+        for image_ref in image_refs:
+            pipe.smembers(image_ref.canonical)
+        results = await pipe.execute()
+        return [
+            {
+                'installed': len(installed_agents) > 0,
+                'installed_agents': installed_agents,
+            }
+            for installed_agents in results
+        ]
+
     async def _parse_image(self, image_ref, item, reverse_aliases):
-        installed = (
-            await self.context['redis_image'].scard(image_ref.canonical)
-        ) > 0
-        installed_agents = await self.context['redis_image'].smembers(image_ref.canonical)
+        installation = await self.get_image_installation(image_ref)
+        return {
+            **self._parse_image_info(image_ref, item, reverse_aliases),
+            **installation,
+        }
 
+    def _parse_image_info(self, image_ref, item, reverse_aliases):
         res_limits = []
         for slot_key, slot_range in item['resource'].items():
             min_value = slot_range.get('min')
@@ -324,8 +385,6 @@ class ConfigServer:
             'size_bytes': item.get('size_bytes', 0),
             'resource_limits': res_limits,
             'supported_accelerators': accels,
-            'installed': installed,
-            'installed_agents': installed_agents,
         }
 
     async def _check_image(self, reference: str) -> ImageRef:
@@ -353,12 +412,71 @@ class ConfigServer:
         else:
             ref = reference
         await self.etcd.delete_prefix(ref.tag_path)
+        self.invalidate_image_catalog()
 
-    async def list_images(self) -> Sequence[Mapping[str, Any]]:
+    def start_image_catalog_watcher(self) -> None:
+        '''
+        Start watching the changes of the images in etcd, so that the image catalog is
+        kept in memory and rebuilt only when changed.
+        Without the watcher, the image catalog is rebuilt for every :meth:`list_images()` call.
+        '''
+        if self._image_catalog_watchers:
+            return
+        for prefix in IMAGE_CATALOG_WATCH_PREFIXES:
+            ready_event = asyncio.Event()
+            task = asyncio.create_task(self._watch_image_changes(prefix, ready_event))
+            self._image_catalog_watchers.append((task, ready_event))
+
+    async def _watch_image_changes(self, prefix: str, ready_event: asyncio.Event) -> None:
+        try:
+            async with aiotools.aclosing(
+                self.etcd.watch_prefix(prefix, ready_event=ready_event),
+            ) as agen:
+                async for ev in agen:
+                    self.invalidate_image_catalog()
+        except asyncio.CancelledError:
+            pass
+
+    def invalidate_image_catalog(self) -> None:
+        self._image_catalog_version += 1
+
+    async def get_image_catalog(self) -> ImageCatalog:
+        '''
+        Returns the image catalog, rebuilding it only if the images have changed since
+        the last build.  Concurrent calls share a single rebuild.
+        '''
+        watching = bool(self._image_catalog_watchers) and all(
+            ready_event.is_set() and not task.done()
+            for task, ready_event in self._image_catalog_watchers
+        )
+        version = self._image_catalog_version
+        if not watching:
+            return await self._build_image_catalog(version)
+        catalog = self._image_catalog
+        if (
+            catalog is not None and catalog.version == version and
+            time.monotonic() - catalog.built_at < IMAGE_CATALOG_MAX_AGE
+        ):
+            return catalog
+        if self._image_catalog_build is None or self._image_catalog_build[0] != version:
+            task = asyncio.ensure_future(self._build_image_catalog(version))
+            self._image_catalog_build = (version, task)
+        build = self._image_catalog_build
+        try:
+            new_catalog = await asyncio.shield(build[1])
+        finally:
+            if build[1].done() and self._image_catalog_build is build:
+                self._image_catalog_build = None
+        if self._image_catalog is None or self._image_catalog.version <= new_catalog.version:
+            self._image_catalog = new_catalog
+        return new_catalog
+
+    async def _build_image_catalog(self, version: int) -> ImageCatalog:
         known_registries = await get_known_registries(self.etcd)
         reverse_aliases = await self._scan_reverse_aliases()
         data = await self.etcd.get_prefix('images')
-        coros = []
+        refs = []
+        items = []
         for registry, images in data.items():
             if registry == '_aliases':
                 continue
@@ -372,9 +490,18 @@ class ConfigServer:
                         continue
                     raw_ref = f'{etcd_unquote(registry)}/{etcd_unquote(image)}:{tag}'
                     ref = ImageRef(raw_ref, known_registries)
-                    coros.append(self._parse_image(ref, image_info, reverse_aliases))
-        result = await asyncio.gather(*coros)
-        return result
+                    refs.append(ref)
+                    items.append(self._parse_image_info(ref, image_info, reverse_aliases))
+        log.debug('built the image catalog (version:{}, images:{})', version, len(items))
+        return ImageCatalog(version, time.monotonic(), refs, items)
+
+    async def list_images(self) -> Sequence[Mapping[str, Any]]:
+        catalog = await self.get_image_catalog()
+        installations = await self.get_image_installations(catalog.refs)
+        return [
+            {**item, **installation}
+            for item, installation in zip(catalog.items, installations)
+        ]
 
     async def set_image_resource_limit(self, reference: str, slot_type: str,
                                        value_range: Tuple[Optional[Decimal], Optional[Decimal]]):
@@ -383,6 +510,7 @@ class ConfigServer:
             await self.etcd.put(f'{ref.tag_path}/resource/{slot_type}/min', str(value_range[0]))
         if value_range[1] is not None:
             await self.etcd.put(f'{ref.tag_path}/resource/{slot_type}/max', str(value_range[1]))
+        self.invalidate_image_catalog()
 
     async def _rescan_images_single_registry(
         self,
@@ -671,13 +799,16 @@ class ConfigServer:
                 continue
             coros.append(self._rescan_images_single_registry(registry, registry_info, reporter))
         await asyncio.gather(*coros)
+        self.invalidate_image_catalog()
         # TODO: delete images removed from registry?
 
     async def alias(self, alias: str, target: str) -> None:
         await self.etcd.put(f'images/_aliases/{etcd_quote(alias)}', target)
+        self.invalidate_image_catalog()
 
     async def dealias(self, alias: str) -> None:
         await self.etcd.delete(f'images/_aliases/{etcd_quote(alias)}')
+        self.invalidate_image_catalog()
 
     async def update_volumes_from_file(self, file: Path) -> None:
         log.info('Updating network volumes from "{0}"', file)
@@ -865,6 +996,25 @@ async def get_config(request: web.Request, params: Any) -> web.Response:
     return web.json_response({'result': value})
 
 
+# The etcd key prefixes whose changes should invalidate the metadata cache namespaces.
+# The known registries also affect the resolution of image references.
+_metadata_cache_prefixes: Sequence[Tuple[str, str]] = [
+    ('images', 'image'),
+    ('config/docker/registry', 'image'),
+    ('config/docker/registry', 'registry'),
+    ('config', 'config'),
+]
+
+
+async def _invalidate_metadata_cache(app: web.Application, key: str) -> None:
+    namespaces = {
+        namespace for prefix, namespace in _metadata_cache_prefixes
+        if key.startswith(prefix) or prefix.startswith(key)
+    }
+    for namespace in sorted(namespaces):
+        await app['metadata_cache'].broadcast_invalidation(namespace)
+
+
 @atomic
 @superadmin_required
 @check_api_params(
@@ -896,6 +1046,7 @@ async def set_config(request: web.Request, params: Any) -> web.Response:
         await etcd.put_dict(updates)
     else:
         await etcd.put(params['key'], params['value'])
+    await _invalidate_metadata_cache(request.app, params['key'])
     return web.json_response({'result': 'ok'})
 
 
@@ -914,6 +1065,7 @@ async def delete_config(request: web.Request, params: Any) -> web.Response:
         await etcd.delete_prefix(params['key'])
     else:
         await etcd.delete(params['key'])
+    await _invalidate_metadata_cache(request.app, params['key'])
     return web.json_response({'result': 'ok'})
 
 
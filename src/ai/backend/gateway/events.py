@@ -1,13 +1,18 @@
 from __future__ import annotations
 
 import asyncio
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 import functools
 import logging
 import json
+import socket
 from typing import (
     Any, Union, Final,
+    Deque, Dict,
     Iterable, AsyncIterator,
+    Hashable,
+    List,
+    Optional,
     Sequence, Tuple,
     Mapping, MutableMapping,
     Set,
@@ -46,6 +51,23 @@ log = BraceStyleAdapter(logging.getLogger('ai.backend.gateway.events'))
 
 sentinel: Final = Sentinel.token
 
+# The Redis stream and its consumer group used by the "redis-stream" event transport.
+EVENT_STREAM_KEY: Final = 'events.stream'
+EVENT_STREAM_GROUP: Final = 'manager'
+# The approximate maximum length of the event stream to keep for replays.
+EVENT_STREAM_MAXLEN: Final = 100_000
+# The maximum number of stream entries to write or read in a single round trip.
+EVENT_STREAM_BATCH_SIZE: Final = 256
+# The maximum time to block a stream read waiting for new entries (msec).
+EVENT_STREAM_BLOCK_TIMEOUT: Final = 5_000
+
+# The maximum number of pending events per session event stream.
+# Slow consumers get the pending events coalesced or dropped beyond this limit.
+SESSION_EVENT_QUEUE_SIZE: Final = 64
+
+# The maximum number of kernels and sessions whose metadata for event routing are cached.
+KERNEL_METADATA_CACHE_SIZE: Final = 4096
+
 
 class EventCallback(Protocol):
     async def __call__(self,
@@ -62,6 +84,24 @@ class EventHandler:
     callback: EventCallback
 
 
+@attr.s(auto_attribs=True, slots=True, frozen=True)
+class WaitedEvent:
+    event_name: str
+    agent_id: AgentId
+    args: Tuple[Any, ...]
+    data: Optional[Mapping[str, Any]]
+
+
+@attr.s(auto_attribs=True, slots=True, frozen=True, eq=False, order=False)
+class EventWaiter:
+    key: str
+    event_names: Tuple[str, ...]
+    queue: asyncio.Queue[WaitedEvent] = attr.Factory(asyncio.Queue)
+
+    async def get(self) -> WaitedEvent:
+        return await self.queue.get()
+
+
 class EventDispatcher(aobject):
     '''
     We have two types of event handlers: consumer and subscriber.
@@ -75,32 +115,67 @@ class EventDispatcher(aobject):
     receive the same event.
 
     Subscriber example: enqueuing events to the queues for event streaming API handlers
+
+    The events are transferred via a Redis list (consumers) and a pub/sub channel (subscribers)
+    by default.  If the "redis-stream" transport is configured, the events are appended to
+    a single Redis stream in batches instead.  The consumers read them as a consumer group
+    with acknowledgements, and the subscribers read them from the last seen entry so that
+    reconnections do not lose events.  The legacy list and channel are still listened to
+    for the event producers (e.g., agents) that have not switched the transport.
+
+    Waiters are a keyed variant of subscribers for the handlers waiting for the events of
+    a specific kernel or session.  They are indexed by the event name and the first event
+    argument (the kernel or session ID), so that an event wakes up only the interested waiters
+    regardless of the number of waiting handlers.
     '''
 
     loop: asyncio.AbstractEventLoop
     root_app: web.Application
     consumers: MutableMapping[str, Set[EventHandler]]
     subscribers: MutableMapping[str, Set[EventHandler]]
+    waiters: MutableMapping[Tuple[str, str], Set[EventWaiter]]
     redis_producer: aioredis.Redis
     redis_consumer: aioredis.Redis
     redis_subscriber: aioredis.Redis
+    # The stream readers use separate pools because the blocking reads would otherwise
+    # queue behind (or hold up) the BLPOP of the legacy list on the same connection.
+    redis_stream_consumer: Optional[aioredis.Redis]
+    redis_stream_subscriber: Optional[aioredis.Redis]
     consumer_task: asyncio.Task
     subscriber_task: asyncio.Task
+    stream_tasks: List[asyncio.Task]
     producer_lock: asyncio.Lock
+    transport: str
+    _pending_msgs: List[Tuple[bytes, asyncio.Future]]
+    _flush_task: Optional[asyncio.Task]
 
     def __init__(self, app: web.Application) -> None:
         self.loop = current_loop()
         self.root_app = app
         self.consumers = defaultdict(set)
         self.subscribers = defaultdict(set)
+        self.waiters = {}
+        self.transport = app['config']['manager']['event-transport']
+        self.stream_tasks = []
+        self.redis_stream_consumer = None
+        self.redis_stream_subscriber = None
+        self._pending_msgs = []
+        self._flush_task = None
 
     async def __ainit__(self) -> None:
         self.redis_producer = await self._create_redis()
         self.redis_consumer = await self._create_redis()
         self.redis_subscriber = await self._create_redis()
+        self.producer_lock = asyncio.Lock()
         self.consumer_task = self.loop.create_task(self._consume())
         self.subscriber_task = self.loop.create_task(self._subscribe())
-        self.producer_lock = asyncio.Lock()
+        if self.transport == 'redis-stream':
+            self.redis_stream_consumer = await self._create_redis()
+            self.redis_stream_subscriber = await self._create_redis()
+            self.stream_tasks = [
+                self.loop.create_task(self._consume_stream()),
+                self.loop.create_task(self._subscribe_stream()),
+            ]
 
     async def _create_redis(self):
         config = self.root_app['config']
@@ -113,6 +188,11 @@ class EventDispatcher(aobject):
         )
 
     async def close(self) -> None:
+        if self._flush_task is not None:
+            await self._flush_task
+        for task in self.stream_tasks:
+            task.cancel()
+            await task
         self.consumer_task.cancel()
         await self.consumer_task
         self.subscriber_task.cancel()
@@ -123,6 +203,10 @@ class EventDispatcher(aobject):
         await self.redis_producer.wait_closed()
         await self.redis_consumer.wait_closed()
         await self.redis_subscriber.wait_closed()
+        for pool in (self.redis_stream_consumer, self.redis_stream_subscriber):
+            if pool is not None:
+                pool.close()
+                await pool.wait_closed()
 
     def consume(self, event_name: str, context: Any, callback: EventCallback) -> EventHandler:
         handler = EventHandler(context, callback)
@@ -140,14 +224,46 @@ class EventDispatcher(aobject):
     def unsubscribe(self, event_name: str, handler: EventHandler) -> None:
         self.subscribers[event_name].discard(handler)
 
+    def add_waiter(self, key: str, event_names: Iterable[str]) -> EventWaiter:
+        """
+        Register a waiter that receives the given events whose first argument is *key*
+        via its queue, until it is removed by :meth:`remove_waiter()`.
+        """
+        waiter = EventWaiter(key, tuple(event_names))
+        for event_name in waiter.event_names:
+            self.waiters.setdefault((event_name, key), set()).add(waiter)
+        return waiter
+
+    def remove_waiter(self, waiter: EventWaiter) -> None:
+        for event_name in waiter.event_names:
+            waiters = self.waiters.get((event_name, waiter.key))
+            if waiters is None:
+                continue
+            waiters.discard(waiter)
+            if not waiters:
+                del self.waiters[(event_name, waiter.key)]
+
     async def produce_event(self, event_name: str,
                             args: Sequence[Any] = tuple(), *,
-                            agent_id: str = 'manager') -> None:
-        raw_msg = msgpack.packb({
+                            agent_id: str = 'manager',
+                            data: Optional[Mapping[str, Any]] = None) -> None:
+        """
+        Produce an event to both consumers and subscribers.
+
+        The optional *data* is delivered only to the waiters, so that they can get the results
+        of the event without querying the database again.
+        """
+        msg: MutableMapping[str, Any] = {
             'event_name': event_name,
             'agent_id': agent_id,
             'args': args,
-        })
+        }
+        if data is not None:
+            msg['data'] = data
+        raw_msg = msgpack.packb(msg)
+        if self.transport == 'redis-stream':
+            await self._produce_to_stream(raw_msg)
+            return
         async with self.producer_lock:
             def _pipe_builder():
                 pipe = self.redis_producer.pipeline()
@@ -156,6 +272,39 @@ class EventDispatcher(aobject):
                 return pipe
             await redis.execute_with_retries(_pipe_builder)
 
+    async def _produce_to_stream(self, raw_msg: bytes) -> None:
+        fut = self.loop.create_future()
+        self._pending_msgs.append((raw_msg, fut))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = self.loop.create_task(self._flush_to_stream())
+        await fut
+
+    async def _flush_to_stream(self) -> None:
+        # The events produced while the previous batch is being written are
+        # written together in the next batch as a single pipeline.
+        while self._pending_msgs:
+            batch = self._pending_msgs[:EVENT_STREAM_BATCH_SIZE]
+            del self._pending_msgs[:EVENT_STREAM_BATCH_SIZE]
+
+            def _pipe_builder():
+                pipe = self.redis_producer.pipeline()
+                for raw_msg, _ in batch:
+                    pipe.xadd(EVENT_STREAM_KEY, {b'msg': raw_msg}, max_len=EVENT_STREAM_MAXLEN)
+                return pipe
+
+            try:
+                await redis.execute_with_retries(_pipe_builder)
+            except BaseException as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+            else:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_result(None)
+
     async def dispatch_consumers(self, event_name: str, agent_id: AgentId,
                                  args: Tuple[Any, ...] = tuple()) -> None:
         log_fmt = 'DISPATCH_CONSUMERS(ev:{}, ag:{})'
@@ -178,12 +327,26 @@ class EventDispatcher(aobject):
             except Exception:
                 log.exception(log_fmt + ': unexpected-error', *log_args)
 
+    def dispatch_waiters(self, event_name: str, agent_id: AgentId,
+                         args: Tuple[Any, ...] = tuple(),
+                         data: Optional[Mapping[str, Any]] = None) -> None:
+        if not args:
+            return
+        waiters = self.waiters.get((event_name, str(args[0])))
+        if not waiters:
+            return
+        event = WaitedEvent(event_name, agent_id, tuple(args), data)
+        for waiter in waiters:
+            waiter.queue.put_nowait(event)
+
     async def dispatch_subscribers(self, event_name: str, agent_id: AgentId,
-                                   args: Tuple[Any, ...] = tuple()) -> None:
+                                   args: Tuple[Any, ...] = tuple(),
+                                   data: Optional[Mapping[str, Any]] = None) -> None:
         log_fmt = 'DISPATCH_SUBSCRIBERS(ev:{}, ag:{})'
         log_args = (event_name, agent_id)
         if self.root_app['config']['debug']['log-events']:
             log.debug(log_fmt, *log_args)
+        self.dispatch_waiters(event_name, agent_id, args, data)
         scheduler = get_scheduler_from_app(self.root_app)
         for subscriber in self.subscribers[event_name]:
             cb = subscriber.callback
@@ -222,7 +385,8 @@ class EventDispatcher(aobject):
                 msg = msgpack.unpackb(raw_msg)
                 await self.dispatch_subscribers(msg['event_name'],
                                                 msg['agent_id'],
-                                                msg['args'])
+                                                msg['args'],
+                                                msg.get('data'))
 
         while True:
             try:
@@ -232,6 +396,258 @@ class EventDispatcher(aobject):
             except Exception:
                 log.exception('EventDispatcher.subscribe(): unexpected-error')
 
+    async def _consume_stream(self) -> None:
+        redis_conn = self.redis_stream_consumer
+        assert redis_conn is not None
+        consumer_name = f"{socket.gethostname()}:{self.root_app['pidx']}"
+        # Start with replaying the entries delivered to this consumer
+        # but not acknowledged before the last shutdown, and then read the new entries.
+        last_id = b'0'
+        group_created = False
+        while True:
+            try:
+                if not group_created:
+                    try:
+                        await redis_conn.xgroup_create(
+                            EVENT_STREAM_KEY, EVENT_STREAM_GROUP, latest_id='$', mkstream=True)
+                    except aioredis.errors.ReplyError as e:
+                        if not str(e).startswith('BUSYGROUP'):
+                            raise
+                    group_created = True
+                entries = await redis.execute_with_retries(
+                    lambda: redis_conn.xread_group(
+                        EVENT_STREAM_GROUP, consumer_name, [EVENT_STREAM_KEY],
+                        timeout=EVENT_STREAM_BLOCK_TIMEOUT,
+                        count=EVENT_STREAM_BATCH_SIZE, latest_ids=[last_id],
+                    ))
+                if not entries:
+                    if last_id != b'>':
+                        last_id = b'>'
+                    continue
+                for _, entry_id, fields in entries:
+                    if last_id != b'>':
+                        last_id = entry_id
+                    msg = msgpack.unpackb(fields[b'msg'])
+                    await self.dispatch_consumers(msg['event_name'],
+                                                  msg['agent_id'],
+                                                  msg['args'])
+                await redis_conn.xack(
+                    EVENT_STREAM_KEY, EVENT_STREAM_GROUP,
+                    *(entry_id for _, entry_id, _ in entries),
+                )
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                log.exception('EventDispatcher.consume_stream(): unexpected-error')
+
+    async def _subscribe_stream(self) -> None:
+        redis_conn = self.redis_stream_subscriber
+        assert redis_conn is not None
+        # Keep the last seen entry ID across reconnections to avoid losing events.
+        last_id = b'$'
+        while True:
+            try:
+                entries = await redis.execute_with_retries(
+                    lambda: redis_conn.xread(
+                        [EVENT_STREAM_KEY],
+                        timeout=EVENT_STREAM_BLOCK_TIMEOUT,
+                        count=EVENT_STREAM_BATCH_SIZE, latest_ids=[last_id],
+                    ))
+                for _, entry_id, fields in entries:
+                    last_id = entry_id
+                    msg = msgpack.unpackb(fields[b'msg'])
+                    await self.dispatch_subscribers(msg['event_name'],
+                                                    msg['agent_id'],
+                                                    msg['args'],
+                                                    msg.get('data'))
+            except asyncio.CancelledError:
+                break
+            except Exception:
+                log.exception('EventDispatcher.subscribe_stream(): unexpected-error')
+
+
+class SessionEventQueue:
+    """
+    A bounded queue of the session events for an event stream client.
+
+    When the queue is full, a new event replaces the pending event of the same kernel
+    or session (coalescing into the latest status) if any, or otherwise the oldest
+    pending event is dropped, so that a slow client cannot make the queue grow unboundedly.
+    """
+
+    __slots__ = ('maxsize', 'num_dropped', '_items', '_readable')
+
+    maxsize: int
+    num_dropped: int
+    _items: Deque[Tuple[Hashable, Any]]
+    _readable: asyncio.Event
+
+    def __init__(self, maxsize: int = SESSION_EVENT_QUEUE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.num_dropped = 0
+        self._items = deque()
+        self._readable = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def put_nowait(self, item: Any, coalesce_key: Hashable = None) -> None:
+        if item is not sentinel and len(self._items) >= self.maxsize:
+            for idx, (key, _) in enumerate(self._items):
+                if coalesce_key is not None and key == coalesce_key:
+                    del self._items[idx]
+                    break
+            else:
+                self._items.popleft()
+            self.num_dropped += 1
+        self._items.append((coalesce_key, item))
+        self._readable.set()
+
+    async def get(self) -> Any:
+        while not self._items:
+            self._readable.clear()
+            await self._readable.wait()
+        _, item = self._items.popleft()
+        return item
+
+
+@attr.s(auto_attribs=True, slots=True, eq=False, order=False)
+class SessionEventSubscription:
+    """
+    The filter conditions of an event stream client.
+    The conditions set to None match any value.
+    """
+    queue: SessionEventQueue
+    scope: str = '*'
+    domain_name: Optional[str] = None
+    user_uuid: Optional[uuid.UUID] = None
+    group_id: Optional[uuid.UUID] = None
+    session_id: Optional[uuid.UUID] = None
+    access_key: Optional[str] = None
+    session_name: Optional[str] = None
+
+    @property
+    def index_key(self) -> Tuple[str, Hashable]:
+        # Index the subscription by its most selective condition.
+        if self.session_id is not None:
+            return ('session_id', self.session_id)
+        if self.session_name is not None:
+            return ('session_name', (self.access_key, self.session_name))
+        if self.user_uuid is not None:
+            return ('user_uuid', self.user_uuid)
+        if self.group_id is not None:
+            return ('group_id', self.group_id)
+        if self.domain_name is not None:
+            return ('domain_name', self.domain_name)
+        return ('*', None)
+
+    def matches(self, event_name: str, row: Mapping[str, Any]) -> bool:
+        if self.scope == 'session' and not event_name.startswith('session_'):
+            return False
+        if self.scope == 'kernel' and not event_name.startswith('kernel_'):
+            return False
+        if self.domain_name is not None and row['domain_name'] != self.domain_name:
+            return False
+        if self.user_uuid is not None and row['user_uuid'] != self.user_uuid:
+            return False
+        if self.group_id is not None and row['group_id'] != self.group_id:
+            return False
+        if self.session_id is not None and row['session_id'] != self.session_id:
+            return False
+        if self.session_name is not None and not (
+            row['session_name'] == self.session_name and
+            row['access_key'] == self.access_key
+        ):
+            return False
+        return True
+
+
+class SessionEventRouter:
+    """
+    An index of the event stream subscriptions by their filter conditions,
+    so that each session event is delivered only to the matching subscribers
+    without visiting all of them.
+    """
+
+    __slots__ = ('_index', '_size')
+
+    _index: Dict[Tuple[str, Hashable], Set[SessionEventSubscription]]
+    _size: int
+
+    def __init__(self) -> None:
+        self._index = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, subscription: SessionEventSubscription) -> None:
+        self._index.setdefault(subscription.index_key, set()).add(subscription)
+        self._size += 1
+
+    def remove(self, subscription: SessionEventSubscription) -> None:
+        key = subscription.index_key
+        subscriptions = self._index.get(key)
+        if subscriptions is None or subscription not in subscriptions:
+            return
+        subscriptions.remove(subscription)
+        if not subscriptions:
+            del self._index[key]
+        self._size -= 1
+
+    def route(
+        self,
+        event_name: str,
+        row: Mapping[str, Any],
+        reason: Optional[str],
+        coalesce_key: Hashable = None,
+    ) -> None:
+        candidate_keys = (
+            ('session_id', row['session_id']),
+            ('session_name', (row['access_key'], row['session_name'])),
+            ('user_uuid', row['user_uuid']),
+            ('group_id', row['group_id']),
+            ('domain_name', row['domain_name']),
+            ('*', None),
+        )
+        for key in candidate_keys:
+            for subscription in self._index.get(key, ()):
+                if subscription.matches(event_name, row):
+                    subscription.queue.put_nowait((event_name, row, reason), coalesce_key)
+
+    def close(self) -> None:
+        for subscriptions in self._index.values():
+            for subscription in subscriptions:
+                subscription.queue.put_nowait(sentinel)
+
+
+class KernelMetadataCache:
+    """
+    A LRU cache of the immutable kernel/session attributes used to route the session events,
+    to avoid querying the database for every event.
+    """
+
+    __slots__ = ('maxsize', '_data')
+
+    maxsize: int
+    _data: OrderedDict[Hashable, Mapping[str, Any]]
+
+    def __init__(self, maxsize: int = KERNEL_METADATA_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Mapping[str, Any]]:
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Mapping[str, Any]) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
 
 @server_status_required(READ_ALLOWED)
 @auth_required
@@ -263,11 +679,11 @@ async def push_session_events(
         if access_key != request['keypair']['access_key']:
             raise GenericForbidden
     group_name = params['group_name']
-    session_event_queues = app['session_event_queues']  # type: Set[asyncio.Queue]
-    my_queue = asyncio.Queue()  # type: asyncio.Queue[Union[Sentinel, Tuple[str, dict, str]]]
+    session_event_router: SessionEventRouter = app['session_event_router']
+    my_queue = SessionEventQueue()
     log.info('PUSH_SESSION_EVENTS (ak:{}, s:{}, g:{})', access_key, session_name, group_name)
     if group_name == '*':
-        group_id = '*'
+        group_id = None
     else:
         async with app['dbpool'].acquire() as conn, conn.begin():
             query = (
@@ -279,51 +695,44 @@ async def push_session_events(
             if row is None:
                 raise GroupNotFound
             group_id = row['id']
-    session_event_queues.add(my_queue)
-    defer(lambda: session_event_queues.remove(my_queue))
+    subscription = SessionEventSubscription(
+        my_queue,
+        scope=scope,
+        domain_name=(
+            request['user']['domain_name']
+            if user_role in (UserRole.USER, UserRole.ADMIN) else None
+        ),
+        user_uuid=user_uuid if user_role == UserRole.USER else None,
+        group_id=group_id,
+        session_id=session_id,
+        access_key=access_key,
+        session_name=(
+            session_name
+            if session_id is None and session_name != '*' else None
+        ),
+    )
+    session_event_router.add(subscription)
+    defer(lambda: session_event_router.remove(subscription))
     try:
         async with sse_response(request) as resp:
             while True:
                 evdata = await my_queue.get()
-                try:
-                    if evdata is sentinel:
-                        break
-                    event_name, row, reason = evdata
-                    if user_role in (UserRole.USER, UserRole.ADMIN):
-                        if row['domain_name'] != request['user']['domain_name']:
-                            continue
-                    if user_role == UserRole.USER:
-                        if row['user_uuid'] != user_uuid:
-                            continue
-                    if group_id != '*' and row['group_id'] != group_id:
-                        continue
-                    if scope == 'session' and not event_name.startswith('session_'):
-                        continue
-                    if scope == 'kernel' and not event_name.startswith('kernel_'):
-                        continue
-                    if session_id is not None:
-                        if row['session_id'] != session_id:
-                            continue
-                    else:
-                        if session_name != '*' and not (
-                            (row['session_name'] == session_name) and
-                            (row['access_key'] == access_key)):
-                            continue
-                    response_data = {
-                        'reason': reason,
-                        'sessionName': row['session_name'],
-                        'ownerAccessKey': row['access_key'],
-                        'sessionId': str(row['session_id']),
-                    }
-                    if kernel_id := row.get('id'):
-                        response_data['kernelId'] = str(kernel_id)
-                    if cluster_role := row.get('cluster_role'):
-                        response_data['clusterRole'] = cluster_role
-                    if cluster_idx := row.get('cluster_idx'):
-                        response_data['clusterIdx'] = cluster_idx
-                    await resp.send(json.dumps(response_data), event=event_name)
-                finally:
-                    my_queue.task_done()
+                if evdata is sentinel:
+                    break
+                event_name, row, reason = evdata
+                response_data = {
+                    'reason': reason,
+                    'sessionName': row['session_name'],
+                    'ownerAccessKey': row['access_key'],
+                    'sessionId': str(row['session_id']),
+                }
+                if kernel_id := row.get('id'):
+                    response_data['kernelId'] = str(kernel_id)
+                if cluster_role := row.get('cluster_role'):
+                    response_data['clusterRole'] = cluster_role
+                if cluster_idx := row.get('cluster_idx'):
+                    response_data['clusterIdx'] = cluster_idx
+                await resp.send(json.dumps(response_data), event=event_name)
     finally:
         return resp
 
@@ -400,17 +809,14 @@ async def push_background_task_events(
         return resp
 
 
-async def enqueue_kernel_status_update(
+async def _get_kernel_metadata(
     app: web.Application,
-    agent_id: AgentId,
-    event_name: str,
-    raw_kernel_id: str,
-    reason: str = None,
-    exit_code: int = None,
-) -> None:
-    if raw_kernel_id is None:
-        return
-    kernel_id = uuid.UUID(raw_kernel_id)
+    kernel_id: uuid.UUID,
+) -> Optional[Mapping[str, Any]]:
+    cache: KernelMetadataCache = app['kernel_metadata_cache']
+    row = cache.get(('kernel', kernel_id))
+    if row is not None:
+        return row
     async with app['dbpool'].acquire() as conn, conn.begin():
         query = (
             sa.select([
@@ -430,24 +836,22 @@ async def enqueue_kernel_status_update(
             )
         )
         result = await conn.execute(query)
-        row = await result.first()
-        if row is None:
-            return
-    for q in app['session_event_queues']:
-        q.put_nowait((event_name, row, reason))
+        raw_row = await result.first()
+        if raw_row is None:
+            return None
+    row = dict(raw_row)
+    cache.put(('kernel', kernel_id), row)
+    return row
 
 
-async def enqueue_session_status_update(
+async def _get_session_metadata(
     app: web.Application,
-    agent_id: AgentId,
-    event_name: str,
-    raw_session_id: str,
-    reason: str = None,
-    exit_code: int = None,
-) -> None:
-    if raw_session_id is None:
-        return
-    session_id = uuid.UUID(raw_session_id)
+    session_id: uuid.UUID,
+) -> Optional[Mapping[str, Any]]:
+    cache: KernelMetadataCache = app['kernel_metadata_cache']
+    row = cache.get(('session', session_id))
+    if row is not None:
+        return row
     async with app['dbpool'].acquire() as conn, conn.begin():
         query = (
             sa.select([
@@ -466,11 +870,53 @@ async def enqueue_session_status_update(
             .limit(1)
         )
         result = await conn.execute(query)
-        row = await result.first()
-        if row is None:
-            return
-    for q in app['session_event_queues']:
-        q.put_nowait((event_name, row, reason))
+        raw_row = await result.first()
+        if raw_row is None:
+            return None
+    row = dict(raw_row)
+    cache.put(('session', session_id), row)
+    return row
+
+
+async def enqueue_kernel_status_update(
+    app: web.Application,
+    agent_id: AgentId,
+    event_name: str,
+    raw_kernel_id: str,
+    reason: str = None,
+    exit_code: int = None,
+) -> None:
+    if raw_kernel_id is None:
+        return
+    session_event_router: SessionEventRouter = app['session_event_router']
+    if not session_event_router:
+        # Skip fetching the metadata if there are no event stream clients.
+        return
+    kernel_id = uuid.UUID(raw_kernel_id)
+    row = await _get_kernel_metadata(app, kernel_id)
+    if row is None:
+        return
+    session_event_router.route(event_name, row, reason, coalesce_key=('kernel', kernel_id))
+
+
+async def enqueue_session_status_update(
+    app: web.Application,
+    agent_id: AgentId,
+    event_name: str,
+    raw_session_id: str,
+    reason: str = None,
+    exit_code: int = None,
+) -> None:
+    if raw_session_id is None:
+        return
+    session_event_router: SessionEventRouter = app['session_event_router']
+    if not session_event_router:
+        return
+    session_id = uuid.UUID(raw_session_id)
+    row = await _get_session_metadata(app, session_id)
+    if row is None:
+        return
+    session_event_router.route(event_name, row, reason, coalesce_key=('session', session_id))
 
 
 async def enqueue_batch_task_result_update(
@@ -481,33 +927,22 @@ async def enqueue_batch_task_result_update(
     exit_code: int = None,
     exit_reason: str = None,
 ) -> None:
+    session_event_router: SessionEventRouter = app['session_event_router']
+    if not session_event_router:
+        return
     kernel_id = uuid.UUID(raw_kernel_id)
-    async with app['dbpool'].acquire() as conn, conn.begin():
-        query = (
-            sa.select([
-                kernels.c.id,
-                kernels.c.session_id,
-                kernels.c.session_name,
-                kernels.c.access_key,
-                kernels.c.domain_name,
-                kernels.c.group_id,
-                kernels.c.user_uuid,
-            ])
-            .select_from(kernels)
-            .where(
-                (kernels.c.id == kernel_id)
-            )
-        )
-        result = await conn.execute(query)
-        row = await result.first()
-        if row is None:
-            return
+    kernel_row = await _get_kernel_metadata(app, kernel_id)
+    if kernel_row is None:
+        return
+    row = {
+        k: v for k, v in kernel_row.items()
+        if k not in ('cluster_role', 'cluster_idx')
+    }
     if event_name == 'session_success':
         reason = 'task-success'
     else:
         reason = 'task-failure'
-    for q in app['session_event_queues']:
-        q.put_nowait((event_name, row, reason))
+    session_event_router.route(event_name, row, reason, coalesce_key=('batch', kernel_id))
 
 
 async def enqueue_task_status_update(
@@ -524,7 +959,8 @@ async def enqueue_task_status_update(
 
 
 async def events_app_ctx(app: web.Application) -> AsyncIterator[None]:
-    app['session_event_queues'] = set()
+    app['session_event_router'] = SessionEventRouter()
+    app['kernel_metadata_cache'] = KernelMetadataCache()
     app['task_update_queues'] = set()
     event_dispatcher = app['event_dispatcher']
     event_dispatcher.subscribe('session_enqueued', app, enqueue_kernel_status_update)
@@ -552,8 +988,7 @@ async def events_app_ctx(app: web.Application) -> AsyncIterator[None]:
 async def events_shutdown(app: web.Application) -> None:
     # shutdown handler is called before waiting for closing active connections.
     # We need to put sentinels here to ensure delivery of them to active SSE connections.
-    for q in app['session_event_queues']:
-        q.put_nowait(sentinel)
+    app['session_event_router'].close()
     for q in app['task_update_queues']:
         q.put_nowait(sentinel)
 
@@ -1,11 +1,17 @@
 from __future__ import annotations
 
+import asyncio
+from collections import defaultdict
 from decimal import Decimal
 import logging
 import time
 from typing import (
+    Any,
+    Dict,
     Iterable,
     Final,
+    Optional,
+    Sequence,
     Tuple,
 )
 
@@ -23,6 +29,8 @@ log = BraceStyleAdapter(logging.getLogger('ai.backend.gateway.ratelimit'))
 
 _time_prec: Final = Decimal('1e-3')  # msec
 _rlim_window: Final = 60 * 15
+_rlim_sub_window: Final = 60
+_rlim_sync_interval: Final = 1.0
 
 # We implement rate limiting using a rolling counter, which prevents
 # last-minute and first-minute bursts between the intervals.
@@ -44,6 +52,115 @@ return redis.call('ZCARD', access_key)
 '''
 
 
+class ApproximateRateLimiter:
+    """
+    Approximates the rolling window with fixed sub-window counters in Redis,
+    used when the "rate-limit-mode" config is "approximate".
+
+    Each worker counts the requests in memory and reconciles them with Redis in batches:
+    it adds the local counts to the shared counters of the current sub-window and
+    fetches the rolling counts, where the oldest sub-window is weighted by its overlap
+    with the rolling window.  Between the reconciliations, the requests are checked
+    against the last fetched rolling count plus the local count, so the requests across
+    multiple workers within a reconciliation interval may exceed the limit.
+    """
+
+    __slots__ = ('redis', 'window', 'sub_window', '_pending', '_totals')
+
+    redis: Any
+    window: int
+    sub_window: int
+    _pending: Dict[str, int]
+    _totals: Dict[str, int]
+
+    def __init__(
+        self,
+        rr: Any,
+        window: int = _rlim_window,
+        sub_window: int = _rlim_sub_window,
+    ) -> None:
+        self.redis = rr
+        self.window = window
+        self.sub_window = sub_window
+        self._pending = defaultdict(int)
+        self._totals = {}
+
+    def check(self, access_key: str) -> int:
+        """
+        Count a request and return the estimated rolling count including it.
+        """
+        self._pending[access_key] += 1
+        return self._totals.get(access_key, 0) + self._pending[access_key]
+
+    def _sub_window_keys(self, access_key: str, now: float) -> Sequence[str]:
+        current = int(now // self.sub_window)
+        num_sub_windows = self.window // self.sub_window
+        return [
+            f'{access_key}:{idx}'
+            for idx in range(current - num_sub_windows, current + 1)
+        ]
+
+    def _rolling_count(self, counts: Sequence[Optional[str]], now: float) -> int:
+        # The oldest sub-window is only partially covered by the rolling window.
+        overlap = 1.0 - (now % self.sub_window) / self.sub_window
+        oldest, *rest = (int(c) if c else 0 for c in counts)
+        return int(oldest * overlap) + sum(rest)
+
+    async def sync(self, now: Optional[float] = None) -> None:
+        """
+        Flush the local counts to Redis and refresh the rolling counts of
+        the recently seen access keys.
+        """
+        if now is None:
+            now = time.time()
+        pending, self._pending = self._pending, defaultdict(int)
+        access_keys = sorted(pending.keys() | self._totals.keys())
+        if not access_keys:
+            return
+        per_key_counter_keys = {
+            access_key: self._sub_window_keys(access_key, now)
+            for access_key in access_keys
+        }
+
+        def _pipe_builder():
+            pipe = self.redis.pipeline()
+            for access_key in access_keys:
+                counter_keys = per_key_counter_keys[access_key]
+                if access_key in pending:
+                    pipe.incrby(counter_keys[-1], pending[access_key])
+                    pipe.expire(counter_keys[-1], self.window + self.sub_window)
+                pipe.mget(*counter_keys)
+            return pipe
+
+        try:
+            results = await redis.execute_with_retries(_pipe_builder)
+        except BaseException:
+            # Keep the counts for the next reconciliation.
+            for access_key, count in pending.items():
+                self._pending[access_key] += count
+            raise
+        self._update_totals(access_keys, pending, results, now)
+
+    def _update_totals(
+        self,
+        access_keys: Sequence[str],
+        pending: Dict[str, int],
+        results: Sequence[Any],
+        now: float,
+    ) -> None:
+        result_iter = iter(results)
+        for access_key in access_keys:
+            if access_key in pending:
+                next(result_iter)  # INCRBY
+                next(result_iter)  # EXPIRE
+            rolling_count = self._rolling_count(next(result_iter), now)
+            if rolling_count == 0 and access_key not in self._pending:
+                # Forget the idle access keys.
+                self._totals.pop(access_key, None)
+            else:
+                self._totals[access_key] = rolling_count
+
+
 @web.middleware
 async def rlim_middleware(app: web.Application,
                           request: web.Request,
@@ -54,12 +171,16 @@ async def rlim_middleware(app: web.Application,
     if request['is_authorized']:
         rate_limit = request['keypair']['rate_limit']
         access_key = request['keypair']['access_key']
-        ret = await redis.execute_script(
-            rr, 'ratelimit', _rlim_script,
-            [access_key],
-            [str(now), str(_rlim_window)],
-        )
-        rolling_count = int(ret)
+        limiter: Optional[ApproximateRateLimiter] = app['rlim_limiter']
+        if limiter is not None:
+            rolling_count = limiter.check(access_key)
+        else:
+            ret = await redis.execute_script(
+                rr, 'ratelimit', _rlim_script,
+                [access_key],
+                [str(now), str(_rlim_window)],
+            )
+            rolling_count = int(ret)
         if rolling_count > rate_limit:
             raise RateLimitExceeded
         remaining = rate_limit - rolling_count
@@ -87,9 +208,32 @@ async def init(app: web.Application) -> None:
         db=REDIS_RLIM_DB)
     app['redis_rlim'] = rr
     app['redis_rlim_script'] = await rr.script_load(_rlim_script)
+    app['rlim_limiter'] = None
+    app['rlim_sync_task'] = None
+    if app['config']['manager']['rate-limit-mode'] == 'approximate':
+        app['rlim_limiter'] = ApproximateRateLimiter(rr)
+        app['rlim_sync_task'] = asyncio.create_task(sync_rate_limits(app))
+
+
+async def sync_rate_limits(app: web.Application) -> None:
+    limiter: ApproximateRateLimiter = app['rlim_limiter']
+    while True:
+        await asyncio.sleep(_rlim_sync_interval)
+        try:
+            await limiter.sync()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception('sync_rate_limits(): error while reconciling the rate limits')
 
 
 async def shutdown(app: web.Application) -> None:
+    if app['rlim_sync_task'] is not None:
+        app['rlim_sync_task'].cancel()
+        try:
+            await app['rlim_sync_task']
+        except asyncio.CancelledError:
+            pass
     try:
         await app['redis_rlim'].flushdb()
     except (ConnectionResetError, ConnectionRefusedError):
@@ -5,7 +5,7 @@ Resource preset APIs.
 import copy
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from decimal import Decimal
+from decimal import Decimal, ROUND_FLOOR
 import functools
 import json
 import logging
@@ -45,6 +45,7 @@ from ..manager.models import (
     AGENT_RESOURCE_OCCUPYING_KERNEL_STATUSES,
     RESOURCE_USAGE_KERNEL_STATUSES, LIVE_STATUS,
 )
+from ..manager.slots import SlotLayout
 from .types import CORSOptions, WebMiddleware
 from .utils import check_api_params
 
@@ -160,12 +161,14 @@ async def check_presets(request: web.Request, params: Any) -> web.Response:
 
         # Take minimum remaining resources. There's no need to merge limits and occupied.
         # To keep legacy, we just merge all remaining slots into `keypair_remainig`.
-        for slot in known_slot_types:
-            keypair_remaining[slot] = min(
-                keypair_remaining[slot],
-                group_remaining[slot],
-                domain_remaining[slot],
-            )
+        # The arithmetic over the agents and presets runs on the slot vectors of
+        # the known slot types, which are converted back only to build the response.
+        slot_layout = SlotLayout.of(known_slot_types.keys())
+        keypair_remaining_vec = slot_layout.vectorize(keypair_remaining, ROUND_FLOOR).minimum(
+            slot_layout.vectorize(group_remaining, ROUND_FLOOR),
+            slot_layout.vectorize(domain_remaining, ROUND_FLOOR),
+        )
+        keypair_remaining = keypair_remaining_vec.to_slots()
 
         # Prepare per scaling group resource.
         sgroups = await query_allowed_sgroups(conn, domain_name, group_id, access_key)
@@ -176,8 +179,8 @@ async def check_presets(request: web.Request, params: Any) -> web.Response:
             sgroup_names = [params['scaling_group']]
         per_sgroup = {
             sgname: {
-                'using': ResourceSlot({k: Decimal(0) for k in known_slot_types.keys()}),
-                'remaining': ResourceSlot({k: Decimal(0) for k in known_slot_types.keys()}),
+                'using': slot_layout.zeros(),
+                'remaining': slot_layout.zeros(),
             } for sgname in sgroup_names
         }
 
@@ -190,10 +193,10 @@ async def check_presets(request: web.Request, params: Any) -> web.Response:
                 (kernels.c.status.in_(AGENT_RESOURCE_OCCUPYING_KERNEL_STATUSES)) &
                 (kernels.c.scaling_group.in_(sgroup_names))))
         async for row in conn.execute(query):
-            per_sgroup[row['scaling_group']]['using'] += row['occupied_slots']
+            per_sgroup[row['scaling_group']]['using'] += slot_layout.vectorize(row['occupied_slots'])
 
         # Per scaling group resource remaining from agents stats.
-        sgroup_remaining = ResourceSlot({k: Decimal(0) for k in known_slot_types.keys()})
+        sgroup_remaining = slot_layout.zeros()
         query = (
             sa.select([agents.c.available_slots, agents.c.occupied_slots, agents.c.scaling_group])
             .select_from(agents)
@@ -204,8 +207,10 @@ async def check_presets(request: web.Request, params: Any) -> web.Response:
         )
         agent_slots = []
         async for row in conn.execute(query):
-            remaining = row['available_slots'] - row['occupied_slots']
-            remaining += ResourceSlot({k: Decimal(0) for k in known_slot_types.keys()})
+            remaining = (
+                slot_layout.vectorize(row['available_slots'], ROUND_FLOOR) -
+                slot_layout.vectorize(row['occupied_slots'])
+            )
             sgroup_remaining += remaining
             agent_slots.append(remaining)
             per_sgroup[row['scaling_group']]['remaining'] += remaining
@@ -214,12 +219,9 @@ async def check_presets(request: web.Request, params: Any) -> web.Response:
         for sgname, sgfields in per_sgroup.items():
             for rtype, slots in sgfields.items():
                 if rtype == 'remaining':
-                    for slot in known_slot_types.keys():
-                        if slot in slots:
-                            slots[slot] = min(keypair_remaining[slot], slots[slot])
+                    slots = slots.minimum(keypair_remaining_vec)
                 per_sgroup[sgname][rtype] = slots.to_json()  # type: ignore  # it's serialization
-        for slot in known_slot_types.keys():
-            sgroup_remaining[slot] = min(keypair_remaining[slot], sgroup_remaining[slot])
+        sgroup_remaining = sgroup_remaining.minimum(keypair_remaining_vec)
 
         # Fetch all resource presets in the current scaling group.
         query = (
@@ -227,12 +229,12 @@ async def check_presets(request: web.Request, params: Any) -> web.Response:
             .select_from(resource_presets))
         async for row in conn.execute(query):
             # Check if there are any agent that can allocate each preset.
-            allocatable = False
             preset_slots = row['resource_slots'].normalize_slots(ignore_unknown=True)
-            for agent_slot in agent_slots:
-                if agent_slot >= preset_slots and keypair_remaining >= preset_slots:
-                    allocatable = True
-                    break
+            requested = slot_layout.vectorize(preset_slots)
+            allocatable = (
+                keypair_remaining_vec >= requested and
+                any(agent_slot >= requested for agent_slot in agent_slots)
+            )
             resp['presets'].append({
                 'name': row['name'],
                 'resource_slots': preset_slots.to_json(),
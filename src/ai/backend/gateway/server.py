@@ -123,6 +123,8 @@ PUBLIC_INTERFACES: Final = [
     'config_server',
     'dbpool',
     'registry',
+    'metadata_cache',
+    'sched_dispatcher',
     'redis_live',
     'redis_stat',
     'redis_image',
@@ -250,6 +252,7 @@ async def config_server_ctx(app: web.Application) -> AsyncIterator[None]:
     app['config']['redis'] = redis_config_iv.check(
         await app['config_server'].etcd.get_prefix('config/redis')
     )
+    app['config_server'].start_image_catalog_watcher()
     _update_public_interface_objs(app)
     yield
     await app['config_server'].close()
@@ -384,8 +387,11 @@ async def agent_registry_ctx(app: web.Application) -> AsyncIterator[None]:
         app['event_dispatcher'],
         app['storage_manager'],
         app['hook_plugin_ctx'],
+        cluster_ssh_keypair_pool_size=app['config']['manager']['cluster-ssh-keypair-pool-size'],
+        metadata_cache_ttl=app['config']['manager']['metadata-cache-ttl'],
     )
     await app['registry'].init()
+    app['metadata_cache'] = app['registry'].metadata_cache
     _update_public_interface_objs(app)
     yield
     await app['registry'].shutdown()
@@ -394,6 +400,8 @@ async def agent_registry_ctx(app: web.Application) -> AsyncIterator[None]:
 async def sched_dispatcher_ctx(app: web.Application) -> AsyncIterator[None]:
     sched_dispatcher = await SchedulerDispatcher.new(
         app['config'], app['config_server'], app['registry'], app['pidx'])
+    app['sched_dispatcher'] = sched_dispatcher
+    _update_public_interface_objs(app)
     yield
     await sched_dispatcher.close()
 
@@ -20,7 +20,7 @@ from typing import (
     List,
     Mapping,
     MutableMapping,
-    Optional,
+    Sequence,
     Tuple,
     Union,
     TYPE_CHECKING,
@@ -51,14 +51,15 @@ from ai.backend.common.logging import BraceStyleAdapter
 from ai.backend.common.utils import str_to_timedelta
 from ai.backend.common.types import (
     AgentId,
-    KernelId,
     ClusterMode,
+    SessionId,
     SessionTypes,
 )
 from ai.backend.common.plugin.monitor import GAUGE
 
 from .config import DEFAULT_CHUNK_SIZE
 from .defs import REDIS_STREAM_DB
+from .events import EventWaiter
 from .exceptions import (
     InvalidAPIParameters,
     GenericNotFound,
@@ -83,7 +84,6 @@ from ..manager.models import (
     domains,
     association_groups_users as agus, groups,
     keypairs, kernels, query_bootstrap_script,
-    keypair_resource_policies,
     users, UserRole,
     vfolders,
     AgentStatus, KernelStatus,
@@ -259,13 +259,8 @@ async def _query_userinfo(request: web.Request, params: Any, conn: Any) -> Tuple
         owner_domain = row['domain_name']
         owner_uuid = row['user']
         owner_role = row['role']
-        query = (
-            sa.select([keypair_resource_policies])
-            .select_from(keypair_resource_policies)
-            .where(keypair_resource_policies.c.name == row['resource_policy'])
-        )
-        result = await conn.execute(query)
-        resource_policy = await result.first()
+        resource_policy = \
+            await request.app['metadata_cache'].get_resource_policy(row['resource_policy'])
     else:
         # Normal case when the user is creating her/his own session.
         owner_domain = request['user']['domain_name']
@@ -333,6 +328,46 @@ async def _query_userinfo(request: web.Request, params: Any, conn: Any) -> Tuple
     return owner_uuid, group_id, resource_policy
 
 
+async def _wait_for_start(
+    waiter: EventWaiter,
+    started_event_name: str,
+) -> Tuple[str, Sequence[Mapping[str, Any]]]:
+    """
+    Wait until the kernel (or session) of the given waiter gets started or terminated,
+    and return its final status and service ports from the event payload.
+    """
+    while True:
+        event = await waiter.get()
+        if event.event_name == started_event_name:
+            if event.data is None:
+                # The agents also produce the started events before the manager
+                # records the kernel access information.
+                continue
+            return event.data['status'], event.data['service_ports']
+        elif event.event_name.endswith('_cancelled'):
+            return KernelStatus.CANCELLED.name, []
+        else:
+            return KernelStatus.TERMINATED.name, []
+
+
+def _format_service_ports(service_ports: Iterable[Mapping[str, Any]]) -> List[Dict[str, Any]]:
+    formatted = []
+    for item in service_ports:
+        response_dict = {
+            'name': item['name'],
+            'protocol': item['protocol'],
+            'ports': item['container_ports'],
+        }
+        if 'url_template' in item.keys():
+            response_dict['url_template'] = item['url_template']
+        if 'allowed_arguments' in item.keys():
+            response_dict['allowed_arguments'] = item['allowed_arguments']
+        if 'allowed_envs' in item.keys():
+            response_dict['allowed_envs'] = item['allowed_envs']
+        formatted.append(response_dict)
+    return formatted
+
+
 async def _create(request: web.Request, params: Any, dbpool) -> web.Response:
     if params['domain'] is None:
         params['domain'] = request['user']['domain_name']
@@ -370,7 +405,7 @@ async def _create(request: web.Request, params: Any, dbpool) -> web.Response:
     # Resolve the image reference.
     try:
         requested_image_ref = \
-            await ImageRef.resolve_alias(params['image'], request.app['config_server'].etcd)
+            await request.app['metadata_cache'].resolve_image_ref(params['image'])
         async with dbpool.acquire() as conn, conn.begin():
             query = (sa.select([domains.c.allowed_docker_registries])
                        .select_from(domains)
@@ -422,23 +457,13 @@ async def _create(request: web.Request, params: Any, dbpool) -> web.Response:
     if params['cluster_size'] > 1:
         log.debug(" -> cluster_mode:{} (replicate)", params['cluster_mode'])
 
+    # The main kernel shares the ID with the session.
+    session_id = SessionId(uuid.uuid4())
+    waiter = request.app['event_dispatcher'].add_waiter(
+        str(session_id),
+        ('kernel_started', 'kernel_terminated', 'kernel_cancelled', 'session_cancelled'),
+    )
     try:
-        start_event = asyncio.Event()
-        kernel_id: Optional[KernelId] = None
-
-        def interrupt_wait(ctx: Any, event_name: str, agent_id: AgentId,
-                           started_kernel_id: str, *args, **kwargs) -> None:
-            nonlocal start_event, kernel_id
-            if kernel_id is not None and started_kernel_id == str(kernel_id):
-                start_event.set()
-
-        start_handler = request.app['event_dispatcher'].subscribe('kernel_started', None,
-                                                                  interrupt_wait)
-        term_handler = request.app['event_dispatcher'].subscribe('kernel_terminated', None,
-                                                                 interrupt_wait)
-        cancel_handler = request.app['event_dispatcher'].subscribe('kernel_cancelled', None,
-                                                                   interrupt_wait)
-
         async with dbpool.acquire() as conn, conn.begin():
             owner_uuid, group_id, resource_policy = await _query_userinfo(request, params, conn)
 
@@ -470,6 +495,7 @@ async def _create(request: web.Request, params: Any, dbpool) -> web.Response:
             startup_command=params['startup_command'],
             session_tag=params['tag'],
             starts_at=starts_at,
+            session_id=session_id,
         ))
         resp['sessionId'] = str(kernel_id)  # changed since API v5
         resp['sessionName'] = str(params['session_name'])
@@ -483,41 +509,14 @@ async def _create(request: web.Request, params: Any, dbpool) -> web.Response:
             try:
                 if max_wait > 0:
                     with timeout(max_wait):
-                        await start_event.wait()
+                        status, service_ports = await _wait_for_start(waiter, 'kernel_started')
                 else:
-                    await start_event.wait()
+                    status, service_ports = await _wait_for_start(waiter, 'kernel_started')
             except asyncio.TimeoutError:
                 resp['status'] = 'TIMEOUT'
             else:
-                await asyncio.sleep(0.5)
-                async with request.app['dbpool'].acquire() as conn, conn.begin():
-                    query = (
-                        sa.select([
-                            kernels.c.status,
-                            kernels.c.service_ports,
-                        ])
-                        .select_from(kernels)
-                        .where(kernels.c.id == kernel_id)
-                    )
-                    result = await conn.execute(query)
-                    row = await result.first()
-                    if row['status'] == KernelStatus.RUNNING:
-                        resp['status'] = 'RUNNING'
-                        for item in row['service_ports']:
-                            response_dict = {
-                                'name': item['name'],
-                                'protocol': item['protocol'],
-                                'ports': item['container_ports'],
-                            }
-                            if 'url_template' in item.keys():
-                                response_dict['url_template'] = item['url_template']
-                            if 'allowed_arguments' in item.keys():
-                                response_dict['allowed_arguments'] = item['allowed_arguments']
-                            if 'allowed_envs' in item.keys():
-                                response_dict['allowed_envs'] = item['allowed_envs']
-                            resp['servicePorts'].append(response_dict)
-                    else:
-                        resp['status'] = row['status'].name
+                resp['status'] = status
+                resp['servicePorts'] = _format_service_ports(service_ports)
 
     except asyncio.CancelledError:
         raise
@@ -532,9 +531,7 @@ async def _create(request: web.Request, params: Any, dbpool) -> web.Response:
         raise InternalServerError
     finally:
         request.app['pending_waits'].discard(asyncio.current_task())
-        request.app['event_dispatcher'].unsubscribe('kernel_cancelled', cancel_handler)
-        request.app['event_dispatcher'].unsubscribe('kernel_terminated', term_handler)
-        request.app['event_dispatcher'].unsubscribe('kernel_started', start_handler)
+        request.app['event_dispatcher'].remove_waiter(waiter)
     return web.json_response(resp, status=201)
 
 
@@ -875,8 +872,7 @@ async def create_cluster(request: web.Request, params: Any) -> web.Response:
             # Resolve the image reference.
             try:
                 requested_image_ref = \
-                    await ImageRef.resolve_alias(kernel_config['image_ref'],
-                                                 request.app['config_server'].etcd)
+                    await request.app['metadata_cache'].resolve_image_ref(kernel_config['image_ref'])
                 async with dbpool.acquire() as conn, conn.begin():
                     query = (sa.select([domains.c.allowed_docker_registries])
                              .select_from(domains)
@@ -892,23 +888,11 @@ async def create_cluster(request: web.Request, params: Any) -> web.Response:
                 kernel_config['cluster_idx'] = i + 1
                 kernel_configs.append(kernel_config)
 
+    session_id = SessionId(uuid.uuid4())
+    waiter = request.app['event_dispatcher'].add_waiter(
+        str(session_id), ('session_started', 'session_terminated', 'session_cancelled'),
+    )
     try:
-        start_event = asyncio.Event()
-        kernel_id: Optional[KernelId] = None
-
-        def interrupt_wait(ctx: Any, event_name: str, agent_id: AgentId,
-                           started_kernel_id: str, *args, **kwargs) -> None:
-            nonlocal start_event, kernel_id
-            if kernel_id is not None and started_kernel_id == str(kernel_id):
-                start_event.set()
-
-        start_handler = request.app['event_dispatcher'].subscribe('session_started', None,
-                                                                  interrupt_wait)
-        term_handler = request.app['event_dispatcher'].subscribe('session_terminated', None,
-                                                                 interrupt_wait)
-        cancel_handler = request.app['event_dispatcher'].subscribe('session_cancelled', None,
-                                                                   interrupt_wait)
-
         async with dbpool.acquire() as conn, conn.begin():
             owner_uuid, group_id, resource_policy = await _query_userinfo(request, params, conn)
 
@@ -922,7 +906,8 @@ async def create_cluster(request: web.Request, params: Any) -> web.Response:
             group_id=group_id,
             user_uuid=owner_uuid,
             user_role=request['user']['role'],
-            session_tag=params['tag']))
+            session_tag=params['tag'],
+            session_id=session_id))
         resp['kernelId'] = str(kernel_id)
         resp['status'] = 'PENDING'
         resp['servicePorts'] = []
@@ -934,41 +919,14 @@ async def create_cluster(request: web.Request, params: Any) -> web.Response:
             try:
                 if max_wait > 0:
                     with timeout(max_wait):
-                        await start_event.wait()
+                        status, service_ports = await _wait_for_start(waiter, 'session_started')
                 else:
-                    await start_event.wait()
+                    status, service_ports = await _wait_for_start(waiter, 'session_started')
             except asyncio.TimeoutError:
                 resp['status'] = 'TIMEOUT'
             else:
-                await asyncio.sleep(0.5)
-                async with request.app['dbpool'].acquire() as conn, conn.begin():
-                    query = (
-                        sa.select([
-                            kernels.c.status,
-                            kernels.c.service_ports,
-                        ])
-                        .select_from(kernels)
-                        .where(kernels.c.id == kernel_id)
-                    )
-                    result = await conn.execute(query)
-                    row = await result.first()
-                    if row['status'] == KernelStatus.RUNNING:
-                        resp['status'] = 'RUNNING'
-                        for item in row['service_ports']:
-                            response_dict = {
-                                'name': item['name'],
-                                'protocol': item['protocol'],
-                                'ports': item['container_ports'],
-                            }
-                            if 'url_template' in item.keys():
-                                response_dict['url_template'] = item['url_template']
-                            if 'allowed_arguments' in item.keys():
-                                response_dict['allowed_arguments'] = item['allowed_arguments']
-                            if 'allowed_envs' in item.keys():
-                                response_dict['allowed_envs'] = item['allowed_envs']
-                            resp['servicePorts'].append(response_dict)
-                    else:
-                        resp['status'] = row['status'].name
+                resp['status'] = status
+                resp['servicePorts'] = _format_service_ports(service_ports)
 
     except asyncio.CancelledError:
         raise
@@ -983,9 +941,7 @@ async def create_cluster(request: web.Request, params: Any) -> web.Response:
         raise InternalServerError
     finally:
         request.app['pending_waits'].discard(asyncio.Task.current_task())
-        request.app['event_dispatcher'].unsubscribe('session_cancelled', cancel_handler)
-        request.app['event_dispatcher'].unsubscribe('session_terminated', term_handler)
-        request.app['event_dispatcher'].unsubscribe('session_started', start_handler)
+        request.app['event_dispatcher'].remove_waiter(waiter)
     return web.json_response(resp, status=201)
 
 
@@ -1122,6 +1078,14 @@ async def check_agent_lost(app, interval):
         pass
 
 
+@catch_unexpected(log)
+async def check_resource_usage_drift(app, interval):
+    try:
+        await app['registry'].recalc_resource_usage()
+    except asyncio.CancelledError:
+        pass
+
+
 # NOTE: This event is ignored during the grace period.
 async def handle_instance_stats(app: web.Application, agent_id: AgentId, event_name: str,
                                 kern_stats) -> None:
@@ -1183,6 +1147,19 @@ async def report_stats(app: web.Application) -> None:
     await stats_monitor.report_metric(
         GAUGE, 'ai.backend.gateway.agent_instances', len(all_inst_ids))
 
+    metadata_cache = app.get('metadata_cache')
+    if metadata_cache is not None:
+        for name, value in metadata_cache.collect_stats().items():
+            await stats_monitor.report_metric(
+                GAUGE, f'ai.backend.manager.metadata_cache.{name}', value)
+
+    sched_dispatcher = app.get('sched_dispatcher')
+    if sched_dispatcher is not None:
+        start_metrics = sched_dispatcher.start_executor.collect_metrics()
+        for name, value in start_metrics.items():
+            await stats_monitor.report_metric(
+                GAUGE, f'ai.backend.manager.scheduler.session_start.{name}', value)
+
     async with app['dbpool'].acquire() as conn, conn.begin():
         query = (sa.select([sa.func.sum(keypairs.c.concurrency_used)])
                    .select_from(keypairs))
@@ -1793,12 +1770,17 @@ async def init(app: web.Application) -> None:
     # Scan ALIVE agents
     app['agent_lost_checker'] = aiotools.create_timer(
         functools.partial(check_agent_lost, app), 1.0)
+    app['resource_usage_checker'] = aiotools.create_timer(
+        functools.partial(check_resource_usage_drift, app),
+        app['config']['manager']['resource-usage-check-interval'])
     app['stats_task'] = asyncio.create_task(stats_report_timer(app))
 
 
 async def shutdown(app: web.Application) -> None:
     app['agent_lost_checker'].cancel()
     await app['agent_lost_checker']
+    app['resource_usage_checker'].cancel()
+    await app['resource_usage_checker']
     app['stats_task'].cancel()
     await app['stats_task']
 
@@ -9,7 +9,7 @@ import trafaret as t
 from ai.backend.common import msgpack
 from ai.backend.common.logging import BraceStyleAdapter
 
-from .auth import auth_required
+from .auth import auth_required, invalidate_auth_cache
 from .exceptions import (
     InvalidAPIParameters, DotfileCreationFailed,
     DotfileNotFound, DotfileAlreadyExists
@@ -73,6 +73,7 @@ async def create(request: web.Request, params: Any) -> web.Response:
                          .values(dotfiles=dotfile_packed)
                          .where(keypairs.c.access_key == owner_access_key))
         await conn.execute(query)
+    await invalidate_auth_cache(request.app, [owner_access_key])
     return web.json_response({})
 
 
@@ -140,6 +141,7 @@ async def update(request: web.Request, params: Any) -> web.Response:
                          .values(dotfiles=dotfile_packed)
                          .where(keypairs.c.access_key == owner_access_key))
         await conn.execute(query)
+    await invalidate_auth_cache(request.app, [owner_access_key])
     return web.json_response({})
 
 
@@ -169,7 +171,8 @@ async def delete(request: web.Request, params: Any) -> web.Response:
                          .values(dotfiles=dotfile_packed)
                          .where(keypairs.c.access_key == owner_access_key))
         await conn.execute(query)
-        return web.json_response({'success': True})
+    await invalidate_auth_cache(request.app, [owner_access_key])
+    return web.json_response({'success': True})
 
 
 @server_status_required(READ_ALLOWED)
@@ -191,6 +194,7 @@ async def update_bootstrap_script(request: web.Request, params: Any) -> web.Resp
                          .values(bootstrap_script=script)
                          .where(keypairs.c.access_key == access_key))
         await conn.execute(query)
+    await invalidate_auth_cache(request.app, [access_key])
     return web.json_response({})
 
 
@@ -0,0 +1,265 @@
+"""
+A shared cache of the rarely-changing metadata looked up to create and start sessions,
+such as the keypair resource policies, the image metadata, and the registry information.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict, defaultdict
+import functools
+import logging
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    DefaultDict,
+    Dict,
+    Final,
+    Hashable,
+    Iterable,
+    Mapping,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+    Union,
+)
+
+import attr
+import sqlalchemy as sa
+from yarl import URL
+
+from ai.backend.common.docker import ImageRef, get_registry_info
+from ai.backend.common.logging import BraceStyleAdapter
+from ai.backend.common.types import ResourceSlot
+
+from .models import keypair_resource_policies
+
+if TYPE_CHECKING:
+    from ..gateway.etcd import ConfigServer
+    from ..gateway.events import EventDispatcher
+
+__all__ = (
+    'METADATA_CACHE_NAMESPACES',
+    'MetadataCache',
+    'handle_metadata_cache_invalidation',
+)
+
+log = BraceStyleAdapter(logging.getLogger('ai.backend.manager.metadata_cache'))
+
+# The kinds of the cached metadata, each of which is invalidated separately.
+METADATA_CACHE_NAMESPACES: Final = frozenset([
+    'resource_policy',  # keypair resource policy rows keyed by the name
+    'image',            # alias resolutions, image metadata and slot ranges
+    'registry',         # registry URLs and credentials keyed by the registry name
+    'config',           # etcd config values keyed by the etcd key
+])
+
+# The maximum number of entries per namespace.
+METADATA_CACHE_SIZE: Final = 1024
+METADATA_CACHE_TTL: Final = 60.0  # seconds
+
+
+@attr.s(auto_attribs=True, slots=True)
+class _CacheStats:
+    hits: int = 0
+    misses: int = 0
+    invalidations: int = 0
+    # The age of the oldest entry returned as a hit, which bounds
+    # how stale the data used by the callers may have been.
+    max_age: float = 0.0
+
+
+class MetadataCache:
+    """
+    A per-process TTL cache of the session metadata with single-flight loading:
+    concurrent lookups of the same key wait for the same query, and failed lookups are
+    not cached.
+
+    The entries expire after *ttl* seconds, and are dropped earlier by the
+    ``metadata_cache_invalidated`` events whenever the metadata is modified via the API.
+    The changes made out of band (e.g., by the manager CLI or direct etcd writes)
+    become visible after the TTL.
+    """
+
+    config_server: ConfigServer
+    dbpool: Any
+    event_dispatcher: Optional[EventDispatcher]
+    ttl: float
+    maxsize: int
+
+    _entries: DefaultDict[str, OrderedDict[Hashable, Tuple[float, asyncio.Future]]]
+    _stats: DefaultDict[str, _CacheStats]
+
+    def __init__(
+        self,
+        config_server: ConfigServer,
+        dbpool: Any,
+        event_dispatcher: Optional[EventDispatcher] = None,
+        *,
+        ttl: float = METADATA_CACHE_TTL,
+        maxsize: int = METADATA_CACHE_SIZE,
+    ) -> None:
+        self.config_server = config_server
+        self.dbpool = dbpool
+        self.event_dispatcher = event_dispatcher
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = defaultdict(OrderedDict)
+        self._stats = defaultdict(_CacheStats)
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    async def _get(
+        self,
+        namespace: str,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        entries = self._entries[namespace]
+        stats = self._stats[namespace]
+        now = time.monotonic()
+        entry = entries.get(key)
+        if entry is not None:
+            loaded_at, fut = entry
+            if now - loaded_at < self.ttl:
+                entries.move_to_end(key)
+                stats.hits += 1
+                if fut.done():
+                    stats.max_age = max(stats.max_age, now - loaded_at)
+                return await asyncio.shield(fut)
+            del entries[key]
+        stats.misses += 1
+        fut = asyncio.ensure_future(loader())
+        entries[key] = (now, fut)
+        fut.add_done_callback(functools.partial(self._drop_failed, namespace, key))
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
+        return await asyncio.shield(fut)
+
+    def _drop_failed(self, namespace: str, key: Hashable, fut: asyncio.Future) -> None:
+        if not fut.cancelled() and fut.exception() is None:
+            return
+        entries = self._entries[namespace]
+        entry = entries.get(key)
+        if entry is not None and entry[1] is fut:
+            del entries[key]
+
+    def invalidate(
+        self,
+        namespace: Optional[str] = None,
+        keys: Optional[Iterable[Hashable]] = None,
+    ) -> None:
+        """
+        Drop the given keys of the namespace, or all entries of the namespace if *keys* is None,
+        or all entries if *namespace* is None.
+        The lookups already in flight are not affected but their results are not stored.
+        """
+        namespaces = METADATA_CACHE_NAMESPACES if namespace is None else [namespace]
+        for ns in namespaces:
+            self._stats[ns].invalidations += 1
+            if keys is None:
+                self._entries[ns].clear()
+            else:
+                for key in keys:
+                    self._entries[ns].pop(key, None)
+            if ns == 'image':
+                # Let the image slot ranges and the image catalog be re-read
+                # instead of hitting ConfigServer's own caches.
+                self.config_server.get_image_slot_ranges.cache_clear()
+                self.config_server.invalidate_image_catalog()
+
+    async def broadcast_invalidation(
+        self,
+        namespace: str,
+        keys: Optional[Iterable[Hashable]] = None,
+    ) -> None:
+        """
+        Invalidate the given entries in this process immediately and in all other
+        manager processes via an event.
+        """
+        if keys is not None:
+            keys = list(keys)
+        self.invalidate(namespace, keys)
+        if self.event_dispatcher is not None:
+            args = (namespace,) if keys is None else (namespace, keys)
+            await self.event_dispatcher.produce_event('metadata_cache_invalidated', args)
+
+    def collect_stats(self) -> Mapping[str, float]:
+        """
+        Return the hit rates, the number of entries, and the staleness of each namespace
+        since the last collection.
+        """
+        stats, self._stats = self._stats, defaultdict(_CacheStats)
+        result: Dict[str, float] = {}
+        for ns in sorted(METADATA_CACHE_NAMESPACES):
+            ns_stats = stats[ns]
+            num_lookups = ns_stats.hits + ns_stats.misses
+            result[f'{ns}.hits'] = ns_stats.hits
+            result[f'{ns}.misses'] = ns_stats.misses
+            result[f'{ns}.hit_rate'] = ns_stats.hits / num_lookups if num_lookups else 0.0
+            result[f'{ns}.invalidations'] = ns_stats.invalidations
+            result[f'{ns}.max_age'] = ns_stats.max_age
+            result[f'{ns}.entries'] = len(self._entries[ns])
+        return result
+
+    async def get_resource_policy(self, name: str) -> Any:
+        """
+        Return the keypair resource policy row of the given name, or None if not exists.
+        """
+        async def _query() -> Any:
+            async with self.dbpool.acquire() as conn, conn.begin():
+                query = (
+                    sa.select([keypair_resource_policies])
+                    .select_from(keypair_resource_policies)
+                    .where(keypair_resource_policies.c.name == name)
+                )
+                result = await conn.execute(query)
+                return await result.first()
+        return await self._get('resource_policy', name, _query)
+
+    async def get_config(self, key: str) -> Optional[str]:
+        return await self._get('config', key, lambda: self.config_server.get(key))
+
+    async def resolve_image_ref(self, reference: str) -> ImageRef:
+        return await self._get(
+            'image', ('ref', reference),
+            lambda: ImageRef.resolve_alias(reference, self.config_server.etcd),
+        )
+
+    async def inspect_image(self, reference: Union[str, ImageRef]) -> Mapping[str, Any]:
+        """
+        Return the image metadata like :meth:`ConfigServer.inspect_image()`.
+        The installation status included there may be as stale as the TTL.
+        """
+        return await self._get(
+            'image', ('info', reference),
+            lambda: self.config_server.inspect_image(reference),
+        )
+
+    async def get_image_slot_ranges(self, image_ref: ImageRef) -> Tuple[ResourceSlot, ResourceSlot]:
+        return await self._get(
+            'image', ('slot_ranges', image_ref),
+            lambda: self.config_server.get_image_slot_ranges(image_ref),
+        )
+
+    async def get_registry_info(self, registry_name: str) -> Tuple[URL, Mapping[str, Any]]:
+        """
+        Return the URL and the credentials of the given registry.
+        """
+        return await self._get(
+            'registry', registry_name,
+            lambda: get_registry_info(self.config_server.etcd, registry_name),
+        )
+
+
+async def handle_metadata_cache_invalidation(
+    cache: MetadataCache, agent_id: str, event_name: str,
+    namespace: str, keys: Optional[Iterable[Hashable]] = None,
+) -> None:
+    if namespace not in METADATA_CACHE_NAMESPACES:
+        log.warning('ignoring the invalidation of an unknown namespace: {}', namespace)
+        return
+    cache.invalidate(namespace, keys)
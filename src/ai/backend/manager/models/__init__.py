@@ -13,6 +13,7 @@ from . import resource_preset as _rpreset
 from . import scaling_group as _sgroup
 from . import session_template as _sessiontemplate
 from . import error_logs as _errorlogs
+from . import resource_usage as _resource_usage
 
 __all__ = (
     'metadata',
@@ -29,6 +30,7 @@ __all__ = (
     *_sgroup.__all__,
     *_sessiontemplate.__all__,
     *_errorlogs.__all__,
+    *_resource_usage.__all__,
 )
 
 from .agent import *  # noqa
@@ -43,4 +45,5 @@ from .resource_policy import *  # noqa
 from .resource_preset import *  # noqa
 from .scaling_group import *  # noqa
 from .session_template import *  # noqa
-from .error_logs import *  # noqa
\ No newline at end of file
+from .error_logs import *  # noqa
+from .resource_usage import *  # noqa
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""add-occupied_slots-to-keypairs-groups-domains
+
+Revision ID: a7b9c3e1d5f2
+Revises: 57e717103287
+Create Date: 2020-10-20 11:32:04.518270
+
+"""
+from collections import defaultdict
+from decimal import Decimal
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pgsql
+
+# revision identifiers, used by Alembic.
+revision = 'a7b9c3e1d5f2'
+down_revision = '57e717103287'
+branch_labels = None
+depends_on = None
+
+# The kernel statuses that occupy the resources of users (keypairs, groups, and domains).
+user_resource_occupying_kernel_statuses = (
+    'PREPARING', 'BUILDING', 'PULLING', 'RUNNING',
+    'RESTARTING', 'RESIZING', 'SUSPENDED', 'ERROR',
+)
+
+
+def _stringify(value: Decimal) -> str:
+    if value == value.to_integral():
+        return str(value.quantize(Decimal(1)))
+    return str(value.normalize())
+
+
+def upgrade():
+    for table in ('keypairs', 'groups', 'domains'):
+        op.add_column(table, sa.Column('occupied_slots', pgsql.JSONB(),
+                                       nullable=False, server_default='{}'))
+
+    # Fill the initial values from the live kernels.
+    conn = op.get_bind()
+    query = (
+        sa.text(
+            'SELECT access_key, group_id, domain_name, occupied_slots FROM kernels '
+            'WHERE status IN :statuses'
+        )
+        .bindparams(sa.bindparam('statuses', expanding=True))
+    )
+    occupancy = {
+        'keypairs': defaultdict(lambda: defaultdict(Decimal)),
+        'groups': defaultdict(lambda: defaultdict(Decimal)),
+        'domains': defaultdict(lambda: defaultdict(Decimal)),
+    }
+    for row in conn.execute(query, statuses=list(user_resource_occupying_kernel_statuses)):
+        for k, v in (row['occupied_slots'] or {}).items():
+            if v is None:
+                continue
+            occupancy['keypairs'][row['access_key']][k] += Decimal(v)
+            occupancy['groups'][row['group_id']][k] += Decimal(v)
+            occupancy['domains'][row['domain_name']][k] += Decimal(v)
+    key_columns = {'keypairs': 'access_key', 'groups': 'id', 'domains': 'name'}
+    for table, per_key_slots in occupancy.items():
+        for key, slots in per_key_slots.items():
+            conn.execute(
+                sa.text(
+                    f'UPDATE {table} SET occupied_slots = CAST(:slots AS jsonb) '
+                    f'WHERE {key_columns[table]} = :key'
+                ),
+                slots=json.dumps({k: _stringify(v) for k, v in slots.items()}),
+                key=key,
+            )
+
+
+def downgrade():
+    for table in ('keypairs', 'groups', 'domains'):
+        op.drop_column(table, 'occupied_slots')
@@ -53,6 +53,8 @@ domains = sa.Table(
               server_default=sa.func.now(), onupdate=sa.func.current_timestamp()),
     # TODO: separate resource-related fields with new domain resource policy table when needed.
     sa.Column('total_resource_slots', ResourceSlotColumn(), default='{}'),
+    # The sum of occupied slots of the domain's kernels maintained as a ledger.
+    sa.Column('occupied_slots', ResourceSlotColumn(), nullable=False, server_default='{}'),
     sa.Column('allowed_vfolder_hosts', pgsql.ARRAY(sa.String), nullable=False, default='{}'),
     sa.Column('allowed_docker_registries', pgsql.ARRAY(sa.String), nullable=False, default='{}'),
     #: Field for synchronization with external services.
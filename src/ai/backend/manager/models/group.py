@@ -84,6 +84,8 @@ groups = sa.Table(
               nullable=False, index=True),
     # TODO: separate resource-related fields with new domain resource policy table when needed.
     sa.Column('total_resource_slots', ResourceSlotColumn(), default='{}'),
+    # The sum of occupied slots of the group's kernels maintained as a ledger.
+    sa.Column('occupied_slots', ResourceSlotColumn(), nullable=False, server_default='{}'),
     sa.Column('allowed_vfolder_hosts', pgsql.ARRAY(sa.String), nullable=False, default='{}'),
     sa.UniqueConstraint('name', 'domain_name', name='uq_groups_name_domain_name'),
     # dotfiles column, \x90 means empty list in msgpack
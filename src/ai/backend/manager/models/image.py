@@ -71,8 +71,12 @@ class Image(graphene.ObjectType):
 
     @classmethod
     async def load_item(cls, context, reference):
-        r = await context['config_server'].inspect_image(reference)
-        return cls._convert_from_dict(context, r)
+        metadata_cache = context['metadata_cache']
+        image_ref = await metadata_cache.resolve_image_ref(reference)
+        r = await metadata_cache.inspect_image(image_ref)
+        # Use the up-to-date installation status instead of the cached one.
+        installation = await context['config_server'].get_image_installation(image_ref)
+        return cls._convert_from_dict(context, {**r, **installation})
 
     @classmethod
     async def load_all(cls, context, is_installed=None, is_operation=None):
@@ -188,6 +192,7 @@ class RescanImages(graphene.Mutation):
 
         async def _rescan_task(reporter: ProgressReporter) -> None:
             await config_server.rescan_images(registry, reporter=reporter)
+            await info.context['metadata_cache'].broadcast_invalidation('image')
 
         task_id = await info.context['background_task_manager'].start(_rescan_task)
         return RescanImages(ok=True, msg='', task_id=task_id)
@@ -212,6 +217,7 @@ class ForgetImage(graphene.Mutation):
         log.info('forget image {0} by API request', reference)
         config_server = info.context['config_server']
         await config_server.forget_image(reference)
+        await info.context['metadata_cache'].broadcast_invalidation('image')
         return ForgetImage(ok=True, msg='')
 
 
@@ -239,6 +245,7 @@ class AliasImage(graphene.Mutation):
             await config_server.alias(alias, target)
         except ValueError as e:
             return AliasImage(ok=False, msg=str(e))
+        await info.context['metadata_cache'].broadcast_invalidation('image')
         return AliasImage(ok=True, msg='')
 
 
@@ -261,4 +268,5 @@ class DealiasImage(graphene.Mutation):
         log.info('dealias image {0} by API request', alias)
         config_server = info.context['config_server']
         await config_server.dealias(alias)
+        await info.context['metadata_cache'].broadcast_invalidation('image')
         return DealiasImage(ok=True, msg='')
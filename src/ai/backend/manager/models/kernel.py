@@ -1248,7 +1248,8 @@ async def recalc_concurrency_used(db_conn: SAConnection, access_key: AccessKey)
                 .select_from(kernels)
                 .where(
                     (kernels.c.access_key == access_key) &
-                    (kernels.c.status.in_(USER_RESOURCE_OCCUPYING_KERNEL_STATUSES))
+                    (kernels.c.status.in_(USER_RESOURCE_OCCUPYING_KERNEL_STATUSES)) &
+                    (kernels.c.cluster_role == DEFAULT_ROLE)
                 )
                 .as_scalar()
             ),
@@ -36,6 +36,7 @@ from .base import (
     ForeignKeyIDColumn,
     Item,
     PaginatedList,
+    ResourceSlotColumn,
     metadata,
     batch_result,
     batch_multiresult,
@@ -73,6 +74,8 @@ keypairs = sa.Table(
               server_default=sa.func.now(), onupdate=sa.func.current_timestamp()),
     sa.Column('last_used', sa.DateTime(timezone=True), nullable=True),
     sa.Column('concurrency_used', sa.Integer),
+    # The sum of occupied slots of the keypair's kernels maintained as a ledger.
+    sa.Column('occupied_slots', ResourceSlotColumn(), nullable=False, server_default='{}'),
     sa.Column('rate_limit', sa.Integer),
     sa.Column('num_queries', sa.Integer, server_default='0'),
 
@@ -202,9 +202,11 @@ class CreateKeyPairResourcePolicy(graphene.Mutation):
         item_query = (
             keypair_resource_policies.select()
             .where(keypair_resource_policies.c.name == name))
-        return await simple_db_mutate_returning_item(
+        result = await simple_db_mutate_returning_item(
             cls, info.context, insert_query,
             item_query=item_query, item_cls=KeyPairResourcePolicy)
+        await info.context['metadata_cache'].broadcast_invalidation('resource_policy', [name])
+        return result
 
 
 class ModifyKeyPairResourcePolicy(graphene.Mutation):
@@ -235,7 +237,9 @@ class ModifyKeyPairResourcePolicy(graphene.Mutation):
             keypair_resource_policies.update()
             .values(data)
             .where(keypair_resource_policies.c.name == name))
-        return await simple_db_mutate(cls, info.context, update_query)
+        result = await simple_db_mutate(cls, info.context, update_query)
+        await info.context['metadata_cache'].broadcast_invalidation('resource_policy', [name])
+        return result
 
 
 class DeleteKeyPairResourcePolicy(graphene.Mutation):
@@ -254,4 +258,6 @@ class DeleteKeyPairResourcePolicy(graphene.Mutation):
             keypair_resource_policies.delete()
             .where(keypair_resource_policies.c.name == name)
         )
-        return await simple_db_mutate(cls, info.context, delete_query)
+        result = await simple_db_mutate(cls, info.context, delete_query)
+        await info.context['metadata_cache'].broadcast_invalidation('resource_policy', [name])
+        return result
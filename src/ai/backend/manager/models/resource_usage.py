@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+from collections import defaultdict
+import itertools
+import logging
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Mapping,
+    Sequence,
+    Tuple,
+)
+import uuid
+
+from aiopg.sa.connection import SAConnection
+import sqlalchemy as sa
+
+from ai.backend.common.logging import BraceStyleAdapter
+from ai.backend.common.types import (
+    AccessKey,
+    AgentId,
+    ResourceSlot,
+)
+
+from ..defs import DEFAULT_ROLE
+from ..slots import SlotLayout, SlotVector
+from .agent import agents, AgentStatus
+from .domain import domains
+from .group import groups
+from .kernel import (
+    kernels,
+    AGENT_RESOURCE_OCCUPYING_KERNEL_STATUSES,
+    USER_RESOURCE_OCCUPYING_KERNEL_STATUSES,
+)
+from .keypair import keypairs
+from .utils import execute_bulk_update
+
+__all__: Sequence[str] = (
+    'apply_agent_slot_deltas',
+    'apply_concurrency_deltas',
+    'apply_occupancy_deltas',
+    'repair_resource_usage_drift',
+)
+
+log = BraceStyleAdapter(logging.getLogger('ai.backend.manager.models.resource_usage'))
+
+# The resource usage counters are maintained incrementally as a ledger:
+# every kernel state transition that enters or leaves the resource-occupying statuses
+# applies signed deltas to the counters, instead of recalculating them from all kernels.
+#
+# - keypairs.concurrency_used counts the sessions (main kernels)
+#   in USER_RESOURCE_OCCUPYING_KERNEL_STATUSES.
+# - keypairs/groups/domains.occupied_slots sum the occupied slots of the owned kernels
+#   in USER_RESOURCE_OCCUPYING_KERNEL_STATUSES.
+# - agents.occupied_slots sums the occupied slots of the kernels
+#   in AGENT_RESOURCE_OCCUPYING_KERNEL_STATUSES.
+#
+# To avoid deadlocks, the transactions should lock the rows in the order of
+# keypairs, groups, domains, and agents, and the rows of the same table in the order of their keys.
+
+
+async def _apply_slot_deltas(
+    db_conn: SAConnection,
+    table: sa.Table,
+    key_column: sa.Column,
+    per_key_slots: Mapping[Any, ResourceSlot], *,
+    release: bool = False,
+    drop_zeros: bool = False,
+) -> None:
+    if not per_key_slots:
+        return
+    query = (
+        sa.select([key_column, table.c.occupied_slots], for_update=True)
+        .select_from(table)
+        .where(key_column.in_(sorted(per_key_slots.keys())))
+        .order_by(key_column)
+    )
+    updates = {}
+    async for row in db_conn.execute(query):
+        slots = per_key_slots[row[key_column.name]]
+        if release:
+            occupied_slots = row['occupied_slots'] - slots
+        else:
+            occupied_slots = row['occupied_slots'] + slots
+        if drop_zeros:
+            occupied_slots = ResourceSlot({k: v for k, v in occupied_slots.items() if v != 0})
+        updates[row[key_column.name]] = {'occupied_slots': occupied_slots}
+    for key in per_key_slots.keys() - updates.keys():
+        log.warning('_apply_slot_deltas(): {} {} does not exist', table.name, key)
+    await execute_bulk_update(db_conn, table, key_column, updates)
+
+
+async def apply_agent_slot_deltas(
+    db_conn: SAConnection,
+    per_agent_slots: Mapping[AgentId, ResourceSlot], *,
+    release: bool = False,
+) -> None:
+    """
+    Add (or subtract if *release* is set) the given slots to the occupied slots of the agents.
+    """
+    await _apply_slot_deltas(db_conn, agents, agents.c.id, per_agent_slots, release=release)
+
+
+async def apply_occupancy_deltas(
+    db_conn: SAConnection,
+    occupancies: Iterable[Tuple[AccessKey, uuid.UUID, str, ResourceSlot]], *,
+    release: bool = False,
+) -> None:
+    """
+    Add (or subtract if *release* is set) the given slots to the occupied slots of
+    the owner keypairs, groups, and domains.
+
+    Each item of *occupancies* is a tuple of the access key, the group ID, the domain name,
+    and the occupied slots of kernels owned by them.
+    """
+    per_keypair_slots: Dict[AccessKey, ResourceSlot] = defaultdict(ResourceSlot)
+    per_group_slots: Dict[uuid.UUID, ResourceSlot] = defaultdict(ResourceSlot)
+    per_domain_slots: Dict[str, ResourceSlot] = defaultdict(ResourceSlot)
+    for access_key, group_id, domain_name, slots in occupancies:
+        per_keypair_slots[access_key] += slots
+        per_group_slots[group_id] += slots
+        per_domain_slots[domain_name] += slots
+    # Idle scopes go back to empty slots, so that the drift check can skip them.
+    for table, key_column, per_key_slots in (
+        (keypairs, keypairs.c.access_key, per_keypair_slots),
+        (groups, groups.c.id, per_group_slots),
+        (domains, domains.c.name, per_domain_slots),
+    ):
+        await _apply_slot_deltas(
+            db_conn, table, key_column, per_key_slots,
+            release=release, drop_zeros=True,
+        )
+
+
+async def apply_concurrency_deltas(
+    db_conn: SAConnection,
+    per_key_deltas: Mapping[AccessKey, int],
+) -> None:
+    """
+    Add the given signed deltas to the concurrency_used counters of the keypairs.
+    The keypairs having the same delta are updated together.
+    """
+    keyfunc = lambda item: item[1]
+    for delta, items in itertools.groupby(
+        sorted(((ak, d) for ak, d in per_key_deltas.items() if d != 0), key=keyfunc),
+        key=keyfunc,
+    ):
+        query = (
+            sa.update(keypairs)
+            .values({
+                'concurrency_used': sa.func.greatest(keypairs.c.concurrency_used + delta, 0),
+            })
+            .where(keypairs.c.access_key.in_(sorted(ak for ak, _ in items)))
+        )
+        await db_conn.execute(query)
+
+
+async def repair_resource_usage_drift(db_conn: SAConnection) -> Mapping[str, int]:
+    """
+    Compare the resource usage counters with the live kernels and repair only the rows
+    that have diverged, in the given transaction.
+
+    Returns the number of repaired rows per table.
+    """
+    # Lock the counters first so that the concurrent transitions are applied on top of
+    # the repaired values after this transaction.
+    live_kernels = (
+        sa.select([kernels.c.access_key, kernels.c.group_id, kernels.c.domain_name])
+        .select_from(kernels)
+        .where(kernels.c.status.in_(USER_RESOURCE_OCCUPYING_KERNEL_STATUSES))
+        .alias('live_kernels')
+    )
+    query = (
+        sa.select([
+            keypairs.c.access_key,
+            keypairs.c.concurrency_used,
+            keypairs.c.occupied_slots,
+        ], for_update=True)
+        .select_from(keypairs)
+        .where(
+            (keypairs.c.concurrency_used != 0) |
+            (keypairs.c.occupied_slots != {}) |
+            (keypairs.c.access_key.in_(sa.select([live_kernels.c.access_key])))
+        )
+        .order_by(keypairs.c.access_key)
+    )
+    current_keypairs = {
+        row['access_key']: row
+        async for row in db_conn.execute(query)
+    }
+    current_scopes: Dict[str, Mapping[Any, ResourceSlot]] = {}
+    for table, key_column, live_key_column in (
+        (groups, groups.c.id, live_kernels.c.group_id),
+        (domains, domains.c.name, live_kernels.c.domain_name),
+    ):
+        query = (
+            sa.select([key_column, table.c.occupied_slots], for_update=True)
+            .select_from(table)
+            .where(
+                (table.c.occupied_slots != {}) |
+                (key_column.in_(sa.select([live_key_column])))
+            )
+            .order_by(key_column)
+        )
+        current_scopes[table.name] = {
+            row[key_column.name]: row['occupied_slots']
+            async for row in db_conn.execute(query)
+        }
+    live_agent_kernels = (
+        sa.select([kernels.c.agent])
+        .select_from(kernels)
+        .where(kernels.c.status.in_(AGENT_RESOURCE_OCCUPYING_KERNEL_STATUSES))
+    )
+    query = (
+        sa.select([agents.c.id, agents.c.occupied_slots], for_update=True)
+        .select_from(agents)
+        .where(
+            (agents.c.status == AgentStatus.ALIVE) |
+            (agents.c.id.in_(live_agent_kernels))
+        )
+        .order_by(agents.c.id)
+    )
+    current_agents = {
+        row['id']: row['occupied_slots']
+        async for row in db_conn.execute(query)
+    }
+    current_scopes['keypairs'] = {
+        access_key: row['occupied_slots']
+        for access_key, row in current_keypairs.items()
+    }
+    current_scopes['agents'] = current_agents
+
+    query = (
+        sa.select([
+            kernels.c.access_key,
+            kernels.c.group_id,
+            kernels.c.domain_name,
+            kernels.c.agent,
+            kernels.c.cluster_role,
+            kernels.c.status,
+            kernels.c.occupied_slots,
+        ])
+        .select_from(kernels)
+        .where(kernels.c.status.in_(AGENT_RESOURCE_OCCUPYING_KERNEL_STATUSES))
+    )
+    live_kernel_rows = [row async for row in db_conn.execute(query)]
+
+    # Aggregate the expected values with a single scan of the live kernels,
+    # using the slot vectors covering all slot types seen in the counters and the kernels.
+    slot_layout = SlotLayout.of(itertools.chain(
+        itertools.chain.from_iterable(row['occupied_slots'].keys() for row in live_kernel_rows),
+        itertools.chain.from_iterable(
+            slots.keys()
+            for current_slots in current_scopes.values()
+            for slots in current_slots.values()
+        ),
+    ))
+    expected_concurrency: Dict[AccessKey, int] = defaultdict(int)
+    expected_slots: Dict[str, Dict[Any, SlotVector]] = {
+        'keypairs': {},
+        'groups': {},
+        'domains': {},
+        'agents': {},
+    }
+    for row in live_kernel_rows:
+        slots = slot_layout.vectorize(row['occupied_slots'])
+        scopes = []
+        if row['agent'] is not None:
+            scopes.append(('agents', row['agent']))
+        if row['status'] in USER_RESOURCE_OCCUPYING_KERNEL_STATUSES:
+            if row['cluster_role'] == DEFAULT_ROLE:
+                expected_concurrency[row['access_key']] += 1
+            scopes.append(('keypairs', row['access_key']))
+            scopes.append(('groups', row['group_id']))
+            scopes.append(('domains', row['domain_name']))
+        for table_name, key in scopes:
+            expected = expected_slots[table_name].get(key)
+            if expected is None:
+                expected_slots[table_name][key] = slots.copy()
+            else:
+                expected += slots
+
+    num_repairs = {}
+    keypair_repairs: Dict[AccessKey, Dict[str, Any]] = {}
+    for access_key, row in current_keypairs.items():
+        expected_count = expected_concurrency.get(access_key, 0)
+        if row['concurrency_used'] != expected_count:
+            log.info('repairing concurrency_used of keypair {} ({} -> {})',
+                     access_key, row['concurrency_used'], expected_count)
+            keypair_repairs.setdefault(access_key, {})['concurrency_used'] = expected_count
+    scope_repairs: Dict[str, Dict[Any, Dict[str, Any]]] = {
+        'keypairs': keypair_repairs,
+        'groups': {},
+        'domains': {},
+        'agents': {},
+    }
+    empty_slots = slot_layout.zeros()
+    for table_name, current_slots in current_scopes.items():
+        for key, occupied_slots in current_slots.items():
+            expected = expected_slots[table_name].get(key, empty_slots)
+            if slot_layout.vectorize(occupied_slots) != expected:
+                # Idle owner scopes go back to empty slots, so that the drift check can skip them.
+                expected_occupied_slots = expected.to_slots(drop_zeros=(table_name != 'agents'))
+                log.info('repairing occupied_slots of {} {} ({} -> {})',
+                         table_name, key, occupied_slots, expected_occupied_slots)
+                scope_repairs[table_name].setdefault(key, {})['occupied_slots'] = \
+                    expected_occupied_slots
+    for table, key_column in (
+        (keypairs, keypairs.c.access_key),
+        (groups, groups.c.id),
+        (domains, domains.c.name),
+        (agents, agents.c.id),
+    ):
+        await execute_bulk_update(db_conn, table, key_column, scope_repairs[table.name])
+        num_repairs[table.name] = len(scope_repairs[table.name])
+    return num_repairs
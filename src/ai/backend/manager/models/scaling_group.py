@@ -1,4 +1,13 @@
-from typing import Union, Sequence, Set
+from collections import defaultdict
+from typing import (
+    Collection,
+    Dict,
+    List,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 import uuid
 
 from aiopg.sa.connection import SAConnection
@@ -14,7 +23,7 @@ from .base import (
     set_if_set,
     batch_result,
 )
-from .group import resolve_group_name_or_id
+from .group import groups, resolve_group_name_or_id
 from .user import UserRole
 
 __all__: Sequence[str] = (
@@ -25,6 +34,7 @@ __all__: Sequence[str] = (
     'sgroups_for_keypairs',
     # functions
     'query_allowed_sgroups',
+    'query_allowed_sgroups_batch',
     'ScalingGroup',
     'CreateScalingGroup',
     'ModifyScalingGroup',
@@ -142,6 +152,58 @@ async def query_allowed_sgroups(db_conn: SAConnection,
     return [row async for row in result]
 
 
+async def query_allowed_sgroups_batch(
+    db_conn: SAConnection,
+    targets: Collection[Tuple[str, uuid.UUID, str]],
+) -> Dict[Tuple[str, uuid.UUID, str], List[str]]:
+    """
+    Batched version of :func:`query_allowed_sgroups()` for multiple
+    ``(domain_name, group_id, access_key)`` tuples.
+    It returns the names of allowed active scaling groups for each tuple,
+    using a fixed number of queries regardless of the number of tuples.
+    """
+    if not targets:
+        return {}
+    domain_names = {t[0] for t in targets}
+    group_ids = {t[1] for t in targets}
+    access_keys = {t[2] for t in targets}
+
+    from_domain: Dict[str, Set[str]] = defaultdict(set)
+    query = (sa.select([sgroups_for_domains])
+               .where(sgroups_for_domains.c.domain.in_(domain_names)))
+    async for row in db_conn.execute(query):
+        from_domain[row['domain']].add(row['scaling_group'])
+
+    query = (sa.select([groups.c.id, groups.c.domain_name])
+               .select_from(groups)
+               .where(groups.c.id.in_(group_ids)))
+    group_domains = {row['id']: row['domain_name'] async for row in db_conn.execute(query)}
+    from_group: Dict[uuid.UUID, Set[str]] = defaultdict(set)
+    query = (sa.select([sgroups_for_groups])
+               .where(sgroups_for_groups.c.group.in_(group_ids)))
+    async for row in db_conn.execute(query):
+        from_group[row['group']].add(row['scaling_group'])
+
+    from_keypair: Dict[str, Set[str]] = defaultdict(set)
+    query = (sa.select([sgroups_for_keypairs])
+               .where(sgroups_for_keypairs.c.access_key.in_(access_keys)))
+    async for row in db_conn.execute(query):
+        from_keypair[row['access_key']].add(row['scaling_group'])
+
+    query = (sa.select([scaling_groups.c.name])
+               .select_from(scaling_groups)
+               .where(scaling_groups.c.is_active))
+    active_sgroups = {row['name'] async for row in db_conn.execute(query)}
+
+    results: Dict[Tuple[str, uuid.UUID, str], List[str]] = {}
+    for domain_name, group_id, access_key in targets:
+        sgroups = from_domain[domain_name] | from_keypair[access_key]
+        if group_domains.get(group_id) == domain_name:
+            sgroups = sgroups | from_group[group_id]
+        results[(domain_name, group_id, access_key)] = sorted(sgroups & active_sgroups)
+    return results
+
+
 class ScalingGroup(graphene.ObjectType):
     name = graphene.String()
     description = graphene.String()
@@ -1,9 +1,13 @@
+from __future__ import annotations
+
 import asyncio
+from collections import OrderedDict
 from contextlib import asynccontextmanager as actxmgr
 import itertools
 from typing import (
     Any,
     AsyncIterator,
+    Dict,
     Final,
     Iterable,
     Mapping,
@@ -28,14 +32,20 @@ class StorageProxyInfo:
 
 AUTH_TOKEN_HDR: Final = 'X-BackendAI-Storage-Auth-Token'
 
+MOUNT_PATH_CACHE_SIZE: Final = 8192
+MAX_CONCURRENT_MOUNT_PATH_REQUESTS: Final = 16
+
 
 class StorageSessionManager:
 
     _proxies: Mapping[str, StorageProxyInfo]
+    _mount_paths: OrderedDict[Tuple[str, UUID], str]
 
     def __init__(self, storage_config: Mapping[str, Any]) -> None:
         self.config = storage_config
         self._proxies = {}
+        # The mount paths of vfolders do not change during their lifetime.
+        self._mount_paths = OrderedDict()
         for proxy_name, proxy_config in self.config['proxies'].items():
             connector = aiohttp.TCPConnector(ssl=proxy_config['ssl_verify'])
             session = aiohttp.ClientSession(connector=connector)
@@ -78,6 +88,11 @@ class StorageSessionManager:
         return itertools.chain(*results)
 
     async def get_mount_path(self, vfolder_host: str, vfolder_id: UUID) -> str:
+        key = (vfolder_host, vfolder_id)
+        mount_path = self._mount_paths.get(key)
+        if mount_path is not None:
+            self._mount_paths.move_to_end(key)
+            return mount_path
         async with self.request(
             vfolder_host, 'GET', 'folder/mount',
             json={
@@ -86,7 +101,29 @@ class StorageSessionManager:
             },
         ) as (_, resp):
             reply = await resp.json()
-            return reply['path']
+            mount_path = reply['path']
+        self._mount_paths[key] = mount_path
+        while len(self._mount_paths) > MOUNT_PATH_CACHE_SIZE:
+            self._mount_paths.popitem(last=False)
+        return mount_path
+
+    async def get_mount_paths(
+        self,
+        vfolders: Iterable[Tuple[str, UUID]],
+    ) -> Mapping[Tuple[str, UUID], str]:
+        """
+        Resolve the mount paths of the given (vfolder host, vfolder ID) pairs concurrently.
+        """
+        keys = list(dict.fromkeys(vfolders))
+        sema = asyncio.Semaphore(MAX_CONCURRENT_MOUNT_PATH_REQUESTS)
+
+        async def _resolve(vfolder_host: str, vfolder_id: UUID) -> str:
+            async with sema:
+                return await self.get_mount_path(vfolder_host, vfolder_id)
+
+        mount_paths = await asyncio.gather(*[_resolve(*key) for key in keys])
+        results: Dict[Tuple[str, UUID], str] = dict(zip(keys, mount_paths))
+        return results
 
     @actxmgr
     async def request(
@@ -1,7 +1,14 @@
 from contextlib import asynccontextmanager as actxmgr
+from typing import (
+    Any,
+    Collection,
+    Mapping,
+    Optional,
+)
 
 from aiopg.sa.connection import SAConnection
 from aiopg.sa.engine import Engine as SAEngine
+import sqlalchemy as sa
 
 
 @actxmgr
@@ -12,3 +19,89 @@ async def reenter_txn(pool: SAEngine, conn: SAConnection):
     else:
         async with conn.begin_nested():
             yield conn
+
+
+def build_bulk_update(
+    table: sa.Table,
+    key_column: sa.Column,
+    rows: Mapping[Any, Mapping[str, Any]], *,
+    increments: Collection[str] = (),
+) -> Optional[sa.sql.Update]:
+    """
+    Build a single UPDATE statement that writes different values to multiple rows,
+    in the form of ``UPDATE table SET ... FROM (<rows>) AS v WHERE table.key = v.key``.
+
+    The columns listed in *increments* are added by the given values
+    instead of being overwritten.
+    All rows must update the same set of columns.
+    Returns None if there are no rows to update.
+    """
+    if not rows:
+        return None
+    col_names = None
+    for values in rows.values():
+        if col_names is None:
+            col_names = list(values.keys())
+        elif set(values.keys()) != set(col_names):
+            raise ValueError('all rows of a bulk update must have the same set of columns')
+    assert col_names is not None
+    if len(rows) == 1:
+        key, values = next(iter(rows.items()))
+        return (
+            sa.update(table)
+            .values({
+                name: (table.c[name] + value) if name in increments else value
+                for name, value in values.items()
+            })
+            .where(key_column == key)
+        )
+    columns = [key_column, *(table.c[name] for name in col_names)]
+
+    def _typed_literal(column: sa.Column, value: Any):
+        # Explicit casts let PostgreSQL infer the column types of the derived table.
+        return sa.cast(sa.literal(value, type_=column.type), column.type)
+
+    selects = [
+        sa.select([
+            _typed_literal(key_column, key).label(key_column.name),
+            *(
+                _typed_literal(table.c[name], values[name]).label(name)
+                for name in col_names
+            ),
+        ])
+        for key, values in rows.items()
+    ]
+    derived = sa.union_all(*selects).alias('v')
+    return (
+        sa.update(table)
+        .values({
+            name: (table.c[name] + derived.c[name]) if name in increments else derived.c[name]
+            for name in col_names
+        })
+        .where(key_column == derived.c[columns[0].name])
+    )
+
+
+async def execute_bulk_update(
+    conn: SAConnection,
+    table: sa.Table,
+    key_column: sa.Column,
+    rows: Mapping[Any, Mapping[str, Any]], *,
+    increments: Collection[str] = (),
+) -> int:
+    """
+    Update multiple rows with per-row values, issuing one statement for each distinct
+    set of updated columns instead of one statement for each row.
+    Returns the total number of updated rows.
+    """
+    groups: dict = {}
+    for key, values in rows.items():
+        groups.setdefault(frozenset(values.keys()), {})[key] = values
+    rowcount = 0
+    for group_rows in groups.values():
+        query = build_bulk_update(table, key_column, group_rows, increments=increments)
+        if query is None:
+            continue
+        result = await conn.execute(query)
+        rowcount += result.rowcount
+    return rowcount
@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from contextvars import ContextVar
-from collections import defaultdict
+from collections import defaultdict, deque
 import copy
 from datetime import datetime
 import itertools
@@ -13,12 +14,15 @@ from typing import (
     AsyncIterator,
     Callable,
     Container,
+    Deque,
     Dict,
+    FrozenSet,
     List,
     Mapping,
     MutableMapping,
     Optional,
     Sequence,
+    Set,
     Tuple,
     TYPE_CHECKING,
     Union,
@@ -29,6 +33,7 @@ import uuid
 import aiohttp
 from aiopg.sa.connection import SAConnection
 import aiotools
+import attr
 from async_timeout import timeout as _timeout
 from callosum.rpc import Peer, RPCUserError
 from callosum.lower.zeromq import ZeroMQAddress, ZeroMQRPCTransport
@@ -43,7 +48,7 @@ from yarl import URL
 import zmq.asyncio
 
 from ai.backend.common import msgpack, redis
-from ai.backend.common.docker import get_registry_info, get_known_registries, ImageRef
+from ai.backend.common.docker import get_known_registries, ImageRef
 from ai.backend.common.logging import BraceStyleAdapter
 from ai.backend.common.plugin.hook import (
     HookPluginContext,
@@ -53,6 +58,7 @@ from ai.backend.common.plugin.hook import (
 from ai.backend.common.service_ports import parse_service_ports
 from ai.backend.common.types import (
     AccessKey,
+    AgentId,
     BinarySize,
     ClusterInfo,
     ClusterMode,
@@ -67,6 +73,11 @@ from ai.backend.common.types import (
     SlotTypes,
 )
 from .defs import DEFAULT_ROLE, INTRINSIC_SLOTS
+from .metadata_cache import (
+    METADATA_CACHE_TTL,
+    MetadataCache,
+    handle_metadata_cache_invalidation,
+)
 from .types import SessionGetter
 from ..gateway.exceptions import (
     BackendError, InvalidAPIParameters,
@@ -81,18 +92,18 @@ from ..gateway.exceptions import (
     GenericForbidden,
 )
 from .models import (
-    agents, kernels, keypairs, vfolders,
+    agents, domains, groups, kernels, keypairs, vfolders,
     query_group_dotfiles, query_domain_dotfiles,
-    keypair_resource_policies,
     AgentStatus, KernelStatus,
     query_accessible_vfolders, query_allowed_sgroups,
-    recalc_concurrency_used,
+    apply_agent_slot_deltas, apply_concurrency_deltas, apply_occupancy_deltas,
+    repair_resource_usage_drift,
     AGENT_RESOURCE_OCCUPYING_KERNEL_STATUSES,
     USER_RESOURCE_OCCUPYING_KERNEL_STATUSES,
     DEAD_KERNEL_STATUSES,
 )
 from .models.kernel import match_session_ids, get_all_kernels, get_main_kernels
-from .models.utils import reenter_txn
+from .models.utils import execute_bulk_update, reenter_txn
 if TYPE_CHECKING:
     from .models.storage import StorageSessionManager
     from .scheduler import (
@@ -109,6 +120,93 @@ log = BraceStyleAdapter(logging.getLogger('ai.backend.manager.registry'))
 
 agent_peers: MutableMapping[str, zmq.asyncio.Socket] = {}  # agent-addr to socket
 
+# The agent information fields stored in the DB which are compared to skip unchanged heartbeats.
+_HEARTBEAT_AGENT_FIELDS = (
+    'resource_slots', 'region', 'scaling_group', 'addr',
+    'version', 'compute_plugins', 'swarm_enabled',
+)
+
+# The number of seconds to trust the last known agent state before re-checking the DB.
+_AGENT_STATE_CACHE_TTL = 30.0
+
+# The number of seconds to cache the known registries read from etcd.
+_KNOWN_REGISTRIES_CACHE_TTL = 60.0
+
+# The number of threads to generate the SSH keypairs of cluster sessions.
+_CLUSTER_SSH_KEYGEN_WORKERS = 2
+
+
+# Replaces the image set of an agent (ARGV[1]) with the given images (ARGV[2:])
+# in both the image-to-agents sets and the agent-to-images reverse index (KEYS[1]).
+_UPDATE_AGENT_IMAGES_SCRIPT = '''
+local agent_id = ARGV[1]
+local current = {}
+for i = 2, #ARGV do
+  current[ARGV[i]] = true
+end
+for _, image in ipairs(redis.call('SMEMBERS', KEYS[1])) do
+  if not current[image] then
+    redis.call('SREM', image, agent_id)
+    redis.call('SREM', KEYS[1], image)
+  end
+end
+for i = 2, #ARGV do
+  redis.call('SADD', ARGV[i], agent_id)
+  redis.call('SADD', KEYS[1], ARGV[i])
+end
+return #ARGV - 1
+'''
+
+# Removes an agent (ARGV[1]) from the image-to-agents sets of the images in its reverse index
+# (KEYS[1]) and returns the number of images, or -1 if there is no reverse index.
+_REMOVE_AGENT_IMAGES_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+  return -1
+end
+local images = redis.call('SMEMBERS', KEYS[1])
+for _, image in ipairs(images) do
+  redis.call('SREM', image, ARGV[1])
+end
+redis.call('DEL', KEYS[1])
+return #images
+'''
+
+
+def _agent_images_key(agent_id: AgentId) -> str:
+    return f'agent-images.{agent_id}'
+
+
+@attr.s(auto_attribs=True, slots=True)
+class _AgentHeartbeatState:
+    checked_at: float
+    agent_fields: Mapping[str, Any]
+    images: FrozenSet[str]
+
+
+# The maximum number of kernels whose stats are fetched by a single script invocation.
+_KERNEL_STATS_BATCH_SIZE = 500
+
+# Returns a list of {type} or {type, value} pairs for the given kernel stat keys.
+# The string-typed stats are msgpack-encoded, so they are hex-encoded to be returned
+# via the connection decoding the replies as UTF-8.
+_KERNEL_STATS_SCRIPT = '''
+local results = {}
+for i, key in ipairs(KEYS) do
+  local stat_type = redis.call('TYPE', key)['ok']
+  if stat_type == 'string' then
+    local value = redis.call('GET', key)
+    results[i] = {stat_type, (value:gsub('.', function (c)
+      return string.format('%02x', string.byte(c))
+    end))}
+  elseif stat_type == 'hash' then
+    results[i] = {stat_type, redis.call('HGETALL', key)}
+  else
+    results[i] = {stat_type}
+  end
+end
+return results
+'''
+
 
 class PeerInvoker(Peer):
 
@@ -182,6 +280,94 @@ async def cleanup_agent_peers():
     await asyncio.gather(*closing_tasks, return_exceptions=True)
 
 
+def generate_cluster_ssh_keypair() -> ClusterSSHKeyPair:
+    key = rsa.generate_private_key(
+        backend=default_backend(),
+        public_exponent=65537,
+        key_size=2048,
+    )
+    public_key = key.public_key().public_bytes(
+        serialization.Encoding.OpenSSH,
+        serialization.PublicFormat.OpenSSH,
+    )
+    public_key += b' work@cluster.backend.ai.local'
+    pem = key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+    return {
+        'private_key': pem.decode('utf-8'),
+        'public_key': public_key.decode('utf-8'),
+    }
+
+
+class ClusterSSHKeyPairPool:
+    """
+    Keeps up to *size* pre-generated SSH keypairs for the cluster sessions.
+
+    The keypairs are generated in a thread pool so that the RSA key generation
+    does not block the event loop.  When the pool runs dry, the keypairs are generated
+    on demand in the same thread pool.
+    """
+
+    def __init__(self, size: int, max_workers: int = _CLUSTER_SSH_KEYGEN_WORKERS) -> None:
+        self.size = size
+        self.max_workers = max_workers
+        self._keypairs: Deque[ClusterSSHKeyPair] = deque()
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='cluster-ssh-keygen')
+        self._refill_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._keypairs)
+
+    async def _generate(self) -> ClusterSSHKeyPair:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, generate_cluster_ssh_keypair)
+
+    def refill(self) -> None:
+        """
+        Start filling up the pool in the background unless it is full or being filled.
+        """
+        if self._closed or len(self._keypairs) >= self.size:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self) -> None:
+        try:
+            while not self._closed and len(self._keypairs) < self.size:
+                num_keypairs = min(self.size - len(self._keypairs), self.max_workers)
+                self._keypairs.extend(await asyncio.gather(*[
+                    self._generate() for _ in range(num_keypairs)
+                ]))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception('error while pre-generating the cluster SSH keypairs')
+
+    async def acquire(self) -> ClusterSSHKeyPair:
+        try:
+            keypair = self._keypairs.popleft()
+        except IndexError:
+            keypair = await self._generate()
+        self.refill()
+        return keypair
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._refill_task is not None and not self._refill_task.done():
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+        self._keypairs.clear()
+        # The running key generations cannot be interrupted but finish shortly.
+        self._executor.shutdown(wait=False)
+
+
 class AgentRegistry:
     """
     Provide a high-level API to create, destroy, and query the computation
@@ -201,6 +387,9 @@ class AgentRegistry:
         event_dispatcher: EventDispatcher,
         storage_manager:  StorageSessionManager,
         hook_plugin_ctx: HookPluginContext,
+        *,
+        cluster_ssh_keypair_pool_size: int = 0,
+        metadata_cache_ttl: float = METADATA_CACHE_TTL,
     ) -> None:
         self.config_server = config_server
         self.dbpool = dbpool
@@ -210,11 +399,22 @@ class AgentRegistry:
         self.event_dispatcher = event_dispatcher
         self.storage_manager = storage_manager
         self.hook_plugin_ctx = hook_plugin_ctx
+        self.cluster_ssh_keypair_pool_size = cluster_ssh_keypair_pool_size
+        self.metadata_cache = MetadataCache(
+            config_server, dbpool, event_dispatcher, ttl=metadata_cache_ttl)
 
     async def init(self) -> None:
-        self.heartbeat_lock = asyncio.Lock()
+        self._pending_heartbeats: Dict[AgentId, Mapping[str, Any]] = {}
+        self._heartbeats_in_progress: Set[AgentId] = set()
+        self._agent_states: Dict[AgentId, _AgentHeartbeatState] = {}
+        self._known_registries: Optional[Tuple[float, Mapping[str, URL]]] = None
+        self._cluster_ssh_keypairs = ClusterSSHKeyPairPool(self.cluster_ssh_keypair_pool_size)
+        self._cluster_ssh_keypairs.refill()
+        self.event_dispatcher.subscribe(
+            'metadata_cache_invalidated', self.metadata_cache, handle_metadata_cache_invalidation)
 
     async def shutdown(self) -> None:
+        await self._cluster_ssh_keypairs.close()
         await cleanup_agent_peers()
 
     async def get_instance(self, inst_id, field=None):
@@ -659,11 +859,14 @@ class AgentRegistry:
         session_tag: str = None,
         internal_data: dict = None,
         starts_at: datetime = None,
+        session_id: Optional[SessionId] = None,
     ) -> SessionId:
 
         mounts = kernel_enqueue_configs[0]['creation_config'].get('mounts') or []
         mount_map = kernel_enqueue_configs[0]['creation_config'].get('mount_map') or {}
-        session_id = SessionId(uuid.uuid4())
+        if session_id is None:
+            # The callers may designate the session ID to wait for its events beforehand.
+            session_id = SessionId(uuid.uuid4())
 
         # Check scaling group availability if scaling_group parameter is given.
         # If scaling_group is not provided, it will be selected in scheduling step.
@@ -694,46 +897,57 @@ class AgentRegistry:
                 user_role=user_role, domain_name=domain_name,
                 allowed_vfolder_types=allowed_vfolder_types,
                 extra_vf_conds=extra_vf_conds)
+        # User's accessible group vfolders should not be mounted
+        # if not belong to the execution kernel.
+        matched_vfolders = [
+            item for item in matched_vfolders
+            if item['group'] is None or item['group'] == str(group_id)
+        ]
 
-            for item in matched_vfolders:
-                if item['group'] is not None and item['group'] != str(group_id):
-                    # User's accessible group vfolders should not be mounted
-                    # if not belong to the execution kernel.
-                    continue
-                mount_path = await self.storage_manager.get_mount_path(item['host'], item['id'])
-                if item['name'] == '.local' and item['group'] is not None:
-                    try:
-                        async with self.storage_manager.request(
-                            item['host'], 'POST', 'folder/file/mkdir',
-                            params={
-                                'volume': self.storage_manager.split_host(item['host'])[1],
-                                'vfid': item['id'],
-                                'relpath': str(user_uuid.hex)
-                            },
-                        ):
-                            pass
-                    except aiohttp.ClientResponseError:
-                        # the server may respond with error if the directory already exists
-                        pass
-                    matched_mounts.add(item['name'])
-                    determined_mounts.append((
-                        item['name'],
-                        item['host'],
-                        f"{mount_path}/{user_uuid.hex}",
-                        item['permission'].value,
-                        ''
-                    ))
-                else:
-                    matched_mounts.add(item['name'])
-                    determined_mounts.append((
-                        item['name'],
-                        item['host'],
-                        mount_path,
-                        item['permission'].value,
-                        item['unmanaged_path'] if item['unmanaged_path'] else '',
-                    ))
-            if mounts and set(mounts) > matched_mounts:
-                raise VFolderNotFound
+        async def _create_user_local_dir(item: Mapping[str, Any]) -> None:
+            try:
+                async with self.storage_manager.request(
+                    item['host'], 'POST', 'folder/file/mkdir',
+                    params={
+                        'volume': self.storage_manager.split_host(item['host'])[1],
+                        'vfid': item['id'],
+                        'relpath': str(user_uuid.hex)
+                    },
+                ):
+                    pass
+            except aiohttp.ClientResponseError:
+                # the server may respond with error if the directory already exists
+                pass
+
+        # Resolve the mount paths and prepare the per-user directories concurrently.
+        mount_paths = await self.storage_manager.get_mount_paths(
+            (item['host'], item['id']) for item in matched_vfolders
+        )
+        await asyncio.gather(*[
+            _create_user_local_dir(item) for item in matched_vfolders
+            if item['name'] == '.local' and item['group'] is not None
+        ])
+        for item in matched_vfolders:
+            mount_path = mount_paths[(item['host'], item['id'])]
+            matched_mounts.add(item['name'])
+            if item['name'] == '.local' and item['group'] is not None:
+                determined_mounts.append((
+                    item['name'],
+                    item['host'],
+                    f"{mount_path}/{user_uuid.hex}",
+                    item['permission'].value,
+                    ''
+                ))
+            else:
+                determined_mounts.append((
+                    item['name'],
+                    item['host'],
+                    mount_path,
+                    item['permission'].value,
+                    item['unmanaged_path'] if item['unmanaged_path'] else '',
+                ))
+        if mounts and set(mounts) > matched_mounts:
+            raise VFolderNotFound
         mounts = determined_mounts
 
         ids = []
@@ -783,10 +997,9 @@ class AgentRegistry:
             resource_opts = creation_config.get('resource_opts') or {}
 
             creation_config['mounts'] = mounts
-            # TODO: merge into a single call
-            image_info = await self.config_server.inspect_image(image_ref)
+            image_info = await self.metadata_cache.inspect_image(image_ref)
             image_min_slots, image_max_slots = \
-                await self.config_server.get_image_slot_ranges(image_ref)
+                await self.metadata_cache.get_image_slot_ranges(image_ref)
             known_slot_types = await self.config_server.get_resource_slots()
 
             # Parse service ports to check for port errors
@@ -990,7 +1203,9 @@ class AgentRegistry:
         sched_ctx: SchedulingContext,
         session_agent_binding: Tuple[PendingSession, List[KernelAgentBinding]],
     ) -> None:
-
+        """
+        Create the kernels of a scheduled session in the bound agents.
+        """
         pending_session, kernel_agent_bindings = session_agent_binding
 
         hook_result = await self.hook_plugin_ctx.dispatch(
@@ -1001,27 +1216,25 @@ class AgentRegistry:
         if hook_result.status != PASSED:
             raise RejectedByHook(hook_result.src_plugin, hook_result.reason)
 
-        # Get resource policy for the session
-        # TODO: memoize with TTL
-        async with self.dbpool.acquire() as conn, conn.begin():
-            query = (
-                sa.select([keypair_resource_policies])
-                .select_from(keypair_resource_policies)
-                .where(keypair_resource_policies.c.name == pending_session.resource_policy)
-            )
-            result = await conn.execute(query)
-            resource_policy = await result.first()
-        auto_pull = await self.config_server.get('config/docker/image/auto_pull')
+        # Get resource policy for the session,
+        # reusing the one preloaded for the scheduling predicates if available.
+        resource_policy = None
+        if sched_ctx.predicate_snapshot is not None:
+            resource_policy = sched_ctx.predicate_snapshot.keypair_resource_policies.get(
+                pending_session.resource_policy)
+        if resource_policy is None:
+            resource_policy = await self.metadata_cache.get_resource_policy(
+                pending_session.resource_policy)
+        auto_pull = await self.metadata_cache.get_config('config/docker/image/auto_pull')
 
         # Aggregate image registry information
-        keyfunc = lambda item: item.kernel.image_ref
+        image_refs = {binding.kernel.image_ref for binding in kernel_agent_bindings}
         image_infos = {}
-        for image_ref, _ in itertools.groupby(
-            sorted(kernel_agent_bindings, key=keyfunc), key=keyfunc,
-        ):
-            image_infos[image_ref] = await self.config_server.inspect_image(image_ref)
-            registry_url, registry_creds = \
-                await get_registry_info(self.config_server.etcd, image_ref.registry)
+        registry_infos = {}
+        for image_ref in image_refs:
+            image_infos[image_ref] = await self.metadata_cache.inspect_image(image_ref)
+            registry_infos[image_ref.registry] = \
+                await self.metadata_cache.get_registry_info(image_ref.registry)
 
         network_name: Optional[str]
         if pending_session.cluster_mode == ClusterMode.SINGLE_NODE:
@@ -1081,6 +1294,7 @@ class AgentRegistry:
 
         # Aggregate by agents to minimize RPC calls
         per_agent_tasks = []
+        per_kernel_service_ports: Dict[KernelId, Sequence[Mapping[str, Any]]] = {}
 
         keyfunc = lambda item: item.agent_alloc_ctx.agent_id
         for agent_id, group_iterator in itertools.groupby(
@@ -1107,8 +1321,8 @@ class AgentRegistry:
                                 'image': {
                                     'registry': {
                                         'name': binding.kernel.image_ref.registry,
-                                        'url': str(registry_url),
-                                        **registry_creds,   # type: ignore
+                                        'url': str(registry_infos[binding.kernel.image_ref.registry][0]),
+                                        **registry_infos[binding.kernel.image_ref.registry][1],
                                     },
                                     'digest': image_infos[binding.kernel.image_ref]['digest'],
                                     'repo_digest': None,
@@ -1149,36 +1363,36 @@ class AgentRegistry:
                         agent_alloc_ctx.agent_id,
                     )
 
-                    async with self.dbpool.acquire() as conn, conn.begin():
-                        # Return and record kernel access information
-                        for created_info in created_infos:
-                            agent_host = URL(agent_alloc_ctx.agent_addr).host
-                            kernel_host = created_info.get('kernel_host', agent_host)
-                            service_ports = created_info.get('service_ports', [])
-                            # NOTE: created_info contains resource_spec
-                            query = (
-                                kernels.update()
-                                .values({
-                                    'scaling_group': agent_alloc_ctx.scaling_group,
-                                    'status': KernelStatus.RUNNING,
-                                    'container_id': created_info['container_id'],
-                                    'occupied_shares': {},
-                                    'attached_devices': created_info.get('attached_devices', {}),
-                                    'kernel_host': kernel_host,
-                                    'repl_in_port': created_info['repl_in_port'],
-                                    'repl_out_port': created_info['repl_out_port'],
-                                    'stdin_port': created_info['stdin_port'],
-                                    'stdout_port': created_info['stdout_port'],
-                                    'service_ports': service_ports,
-                                })
-                                .where(kernels.c.id == created_info['id']))
-                            await conn.execute(query)
+                    # Return and record kernel access information
+                    per_kernel_updates: Dict[KernelId, Dict[str, Any]] = {}
+                    for created_info in created_infos:
+                        agent_host = URL(agent_alloc_ctx.agent_addr).host
+                        kernel_host = created_info.get('kernel_host', agent_host)
+                        service_ports = created_info.get('service_ports', [])
+                        # NOTE: created_info contains resource_spec
+                        per_kernel_updates[created_info['id']] = {
+                            'scaling_group': agent_alloc_ctx.scaling_group,
+                            'status': KernelStatus.RUNNING,
+                            'container_id': created_info['container_id'],
+                            'occupied_shares': {},
+                            'attached_devices': created_info.get('attached_devices', {}),
+                            'kernel_host': kernel_host,
+                            'repl_in_port': created_info['repl_in_port'],
+                            'repl_out_port': created_info['repl_out_port'],
+                            'stdin_port': created_info['stdin_port'],
+                            'stdout_port': created_info['stdout_port'],
+                            'service_ports': service_ports,
+                        }
+                    await self.update_kernels(per_kernel_updates)
 
                     for binding in items:
+                        service_ports = per_kernel_updates[binding.kernel.kernel_id]['service_ports']
+                        per_kernel_service_ports[binding.kernel.kernel_id] = service_ports
                         await self.event_dispatcher.produce_event(
                             'kernel_started',
                             (str(binding.kernel.kernel_id), ),
                             agent_id=binding.agent_alloc_ctx.agent_id,
+                            data={'status': KernelStatus.RUNNING.name, 'service_ports': service_ports},
                         )
 
             per_agent_tasks.append(_create_kernels_in_one_agent(agent_alloc_ctx, items))
@@ -1188,6 +1402,12 @@ class AgentRegistry:
         await self.event_dispatcher.produce_event(
             'session_started',
             (str(pending_session.session_id), ),
+            data={
+                'status': KernelStatus.RUNNING.name,
+                # The main kernel shares the ID with the session.
+                'service_ports': per_kernel_service_ports.get(
+                    cast(KernelId, pending_session.session_id), []),
+            },
         )
         await self.hook_plugin_ctx.notify(
             'POST_START_SESSION',
@@ -1195,140 +1415,52 @@ class AgentRegistry:
         )
 
     async def create_cluster_ssh_keypair(self) -> ClusterSSHKeyPair:
-        key = rsa.generate_private_key(
-            backend=default_backend(),
-            public_exponent=65537,
-            key_size=2048,
-        )
-        public_key = key.public_key().public_bytes(
-            serialization.Encoding.OpenSSH,
-            serialization.PublicFormat.OpenSSH,
-        )
-        public_key += b' work@cluster.backend.ai.local'
-        pem = key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.TraditionalOpenSSL,
-            encryption_algorithm=serialization.NoEncryption(),
-        )
-        return {
-            'private_key': pem.decode('utf-8'),
-            'public_key': public_key.decode('utf-8'),
-        }
+        return await self._cluster_ssh_keypairs.acquire()
 
-    async def get_keypair_occupancy(self, access_key, *, conn=None):
-        known_slot_types = \
-            await self.config_server.get_resource_slots()
+    async def _get_scope_occupancy(self, table, key_column, key, *, conn=None) -> ResourceSlot:
+        known_slot_types = await self.config_server.get_resource_slots()
         async with reenter_txn(self.dbpool, conn) as conn:
             query = (
-                sa.select([kernels.c.occupied_slots])
-                .where(
-                    (kernels.c.access_key == access_key) &
-                    (kernels.c.status.in_(USER_RESOURCE_OCCUPYING_KERNEL_STATUSES))
-                )
+                sa.select([table.c.occupied_slots])
+                .select_from(table)
+                .where(key_column == key)
             )
-            zero = ResourceSlot()
-            key_occupied = sum([
-                row['occupied_slots']
-                async for row in conn.execute(query)], zero)
+            result = await conn.execute(query)
+            row = await result.first()
+            if row is None:
+                return ResourceSlot()
+            occupied_slots = row['occupied_slots']
             # drop no-longer used slot types
-            drops = [k for k in key_occupied.keys() if k not in known_slot_types]
+            drops = [k for k in occupied_slots.keys() if k not in known_slot_types]
             for k in drops:
-                del key_occupied[k]
-            return key_occupied
+                del occupied_slots[k]
+            return occupied_slots
+
+    async def get_keypair_occupancy(self, access_key, *, conn=None):
+        return await self._get_scope_occupancy(
+            keypairs, keypairs.c.access_key, access_key, conn=conn)
 
     async def get_domain_occupancy(self, domain_name, *, conn=None):
-        # TODO: store domain occupied_slots in Redis?
-        known_slot_types = await self.config_server.get_resource_slots()
-        async with reenter_txn(self.dbpool, conn) as conn:
-            query = (
-                sa.select([kernels.c.occupied_slots])
-                .where(
-                    (kernels.c.domain_name == domain_name) &
-                    (kernels.c.status.in_(USER_RESOURCE_OCCUPYING_KERNEL_STATUSES))
-                )
-            )
-            zero = ResourceSlot()
-            key_occupied = sum([row['occupied_slots'] async for row in conn.execute(query)], zero)
-            # drop no-longer used slot types
-            drops = [k for k in key_occupied.keys() if k not in known_slot_types]
-            for k in drops:
-                del key_occupied[k]
-            return key_occupied
+        return await self._get_scope_occupancy(
+            domains, domains.c.name, domain_name, conn=conn)
 
     async def get_group_occupancy(self, group_id, *, conn=None):
-        # TODO: store domain occupied_slots in Redis?
-        known_slot_types = await self.config_server.get_resource_slots()
-        async with reenter_txn(self.dbpool, conn) as conn:
-            query = (
-                sa.select([kernels.c.occupied_slots])
-                .where(
-                    (kernels.c.group_id == group_id) &
-                    (kernels.c.status.in_(USER_RESOURCE_OCCUPYING_KERNEL_STATUSES))
-                )
-            )
-            zero = ResourceSlot()
-            key_occupied = sum([row['occupied_slots'] async for row in conn.execute(query)], zero)
-            # drop no-longer used slot types
-            drops = [k for k in key_occupied.keys() if k not in known_slot_types]
-            for k in drops:
-                del key_occupied[k]
-            return key_occupied
+        return await self._get_scope_occupancy(
+            groups, groups.c.id, group_id, conn=conn)
 
     async def recalc_resource_usage(self) -> None:
-        concurrency_used_per_key: MutableMapping[str, int] = defaultdict(lambda: 0)
-        occupied_slots_per_agent: MutableMapping[str, ResourceSlot] = \
-            defaultdict(lambda: ResourceSlot({'cpu': 0, 'mem': 0}))
+        """
+        Check the resource usage counters (concurrency_used and occupied_slots of
+        keypairs, groups, domains, and agents) against the live kernels
+        and repair only the diverged rows.
+        """
         async with self.dbpool.acquire() as conn, conn.begin():
-            # Query running containers and calculate concurrency_used per AK and
-            # occupied_slots per agent.
-            query = (sa.select([kernels.c.access_key, kernels.c.agent, kernels.c.occupied_slots])
-                       .where(kernels.c.status.in_(AGENT_RESOURCE_OCCUPYING_KERNEL_STATUSES))
-                       .order_by(sa.asc(kernels.c.access_key)))
-            async for row in conn.execute(query):
-                occupied_slots_per_agent[row.agent] += ResourceSlot(row.occupied_slots)
-            query = (sa.select([kernels.c.access_key, kernels.c.agent, kernels.c.occupied_slots])
-                     .where(kernels.c.status.in_(USER_RESOURCE_OCCUPYING_KERNEL_STATUSES))
-                     .order_by(sa.asc(kernels.c.access_key)))
-            async for row in conn.execute(query):
-                concurrency_used_per_key[row.access_key] += 1
-
-            if len(concurrency_used_per_key) > 0:
-                # Update concurrency_used for keypairs with running containers.
-                for ak, used in concurrency_used_per_key.items():
-                    query = (sa.update(keypairs)
-                               .values(concurrency_used=used)
-                               .where(keypairs.c.access_key == ak))
-                    await conn.execute(query)
-                # Update all other keypairs to have concurrency_used = 0.
-                query = (sa.update(keypairs)
-                           .values(concurrency_used=0)
-                           .where(keypairs.c.concurrency_used != 0)
-                           .where(sa.not_(keypairs.c.access_key.in_(concurrency_used_per_key.keys()))))
-                await conn.execute(query)
-            else:
-                query = (sa.update(keypairs)
-                           .values(concurrency_used=0)
-                           .where(keypairs.c.concurrency_used != 0))
-                await conn.execute(query)
-
-            if len(occupied_slots_per_agent) > 0:
-                # Update occupied_slots for agents with running containers.
-                for aid, slots in occupied_slots_per_agent.items():
-                    query = (sa.update(agents)
-                               .values(occupied_slots=slots)
-                               .where(agents.c.id == aid))
-                    await conn.execute(query)
-                # Update all other agents to have empty occupied_slots.
-                query = (sa.update(agents)
-                           .values(occupied_slots=ResourceSlot({}))
-                           .where(agents.c.status == AgentStatus.ALIVE)
-                           .where(sa.not_(agents.c.id.in_(occupied_slots_per_agent.keys()))))
-                await conn.execute(query)
-            else:
-                query = (sa.update(agents)
-                           .values(occupied_slots=ResourceSlot({}))
-                           .where(agents.c.status == AgentStatus.ALIVE))
-                await conn.execute(query)
+            num_repairs = await repair_resource_usage_drift(conn)
+        if any(num_repairs.values()):
+            log.warning('recalc_resource_usage(): repaired {}', ', '.join(
+                f'{num_rows} {table_name}' for table_name, num_rows in num_repairs.items()
+                if num_rows
+            ))
 
     async def destroy_session(
         self,
@@ -1343,58 +1475,101 @@ class AgentRegistry:
                 # This is for emergency (e.g., when agents are not responding).
                 # Regardless of the container's real status, it marks the session terminated
                 # and recalculate the resource usage.
-                query = (
-                    sa.select([
-                        kernels.c.id,
-                        kernels.c.session_id,
-                        kernels.c.status,
-                        kernels.c.access_key,
-                        kernels.c.cluster_role,
-                        kernels.c.agent,
-                        kernels.c.agent_addr,
-                    ])
-                    .select_from(kernels)
-                    .where(kernels.c.session_id == session['id'])
-                )
-                result = await conn.execute(query)
-                kernel_list = await result.fetchall()
-                for kernel in kernel_list:
-                    if kernel['status'] == KernelStatus.PENDING:
+                # The status transitions and the released resource usage are applied in
+                # a single transaction, while the kernels are locked against the concurrent
+                # transitions such as mark_kernel_terminated().
+                async with conn.begin():
+                    query = (
+                        sa.select([
+                            kernels.c.id,
+                            kernels.c.session_id,
+                            kernels.c.status,
+                            kernels.c.access_key,
+                            kernels.c.group_id,
+                            kernels.c.domain_name,
+                            kernels.c.cluster_role,
+                            kernels.c.agent,
+                            kernels.c.agent_addr,
+                            kernels.c.occupied_slots,
+                        ], for_update=True)
+                        .select_from(kernels)
+                        .where(
+                            (kernels.c.session_id == session['id']) &
+                            ~(kernels.c.status.in_(DEAD_KERNEL_STATUSES))
+                        )
+                        .order_by(kernels.c.id)
+                    )
+                    result = await conn.execute(query)
+                    kernel_list = await result.fetchall()
+                    if any(
+                        kernel['status'] in (KernelStatus.PREPARING, KernelStatus.PULLING)
+                        for kernel in kernel_list
+                    ):
+                        raise GenericForbidden('Cannot destory kernels in preparing/pulling status')
+                    pending_kernel_ids = [
+                        kernel['id'] for kernel in kernel_list
+                        if kernel['status'] == KernelStatus.PENDING
+                    ]
+                    if pending_kernel_ids:
+                        await self.set_kernels_status(
+                            pending_kernel_ids, KernelStatus.CANCELLED, 'force-terminated',
+                            db_conn=conn,
+                        )
+                    else:
+                        concurrency_deltas: Dict[AccessKey, int] = defaultdict(int)
+                        released_occupancies = []
+                        released_slots: Dict[AgentId, ResourceSlot] = defaultdict(ResourceSlot)
+                        for kernel in kernel_list:
+                            if kernel['status'] not in (KernelStatus.ERROR, KernelStatus.TERMINATING):
+                                # This is allowed, but if agents are working normally,
+                                # the session will become invisible and unaccessible but STILL
+                                # occupy the actual resources until the super-admin manually
+                                # kills & deletes the container.
+                                log.warning('force-terminating kernel in normal status! '
+                                            '(k:{}, status:{})',
+                                            kernel['id'], kernel['status'])
+                            if kernel['status'] in USER_RESOURCE_OCCUPYING_KERNEL_STATUSES:
+                                if kernel['cluster_role'] == DEFAULT_ROLE:
+                                    concurrency_deltas[kernel['access_key']] -= 1
+                                released_occupancies.append((
+                                    kernel['access_key'], kernel['group_id'],
+                                    kernel['domain_name'], kernel['occupied_slots'],
+                                ))
+                            if (
+                                kernel['agent'] is not None
+                                and kernel['status'] in AGENT_RESOURCE_OCCUPYING_KERNEL_STATUSES
+                            ):
+                                released_slots[kernel['agent']] += kernel['occupied_slots']
+                        # TERMINATED is set directly, bypassing mark_kernel_terminated(),
+                        # since we intentionally skip the agent RPC call!
+                        now = datetime.now(tzutc())
                         await conn.execute(
                             sa.update(kernels)
                             .values({
-                                'status': KernelStatus.CANCELLED,
+                                'status': KernelStatus.TERMINATED,
                                 'status_info': 'force-terminated',
+                                'status_changed': now,
+                                'terminated_at': now,
                             })
-                            .where(kernels.c.id == kernel['id'])
-                        )
-                        await self.event_dispatcher.produce_event(
-                            'session_cancelled',
-                            (str(session['session_id']), 'force-terminated'),
+                            .where(
+                                (kernels.c.id.in_([kernel['id'] for kernel in kernel_list])) &
+                                ~(kernels.c.status.in_(DEAD_KERNEL_STATUSES))
+                            )
                         )
-                        return {'status': 'cancelled'}
-                    elif kernel['status'] in (KernelStatus.PREPARING, KernelStatus.PULLING):
-                        raise GenericForbidden('Cannot destory kernels in preparing/pulling status')
-                    if kernel['status'] not in (KernelStatus.ERROR, KernelStatus.TERMINATING):
-                        # This is allowed, but if agents are working normally,
-                        # the session will become invisible and unaccessible but STILL occupy the actual
-                        # resources until the super-admin manually kills & deletes the container.
-                        log.warning('force-terminating kernel in normal status! (k:{}, status:{})',
-                                    kernel['id'], kernel['status'])
-                    await conn.execute(
-                        sa.update(kernels)
-                        .values({
-                            'status': KernelStatus.TERMINATED,
-                            'status_info': 'force-terminated',
-                        })
-                        .where(kernels.c.id == kernel['id'])
+                        await apply_concurrency_deltas(conn, concurrency_deltas)
+                        await apply_occupancy_deltas(conn, released_occupancies, release=True)
+                        await apply_agent_slot_deltas(conn, released_slots, release=True)
+                if pending_kernel_ids:
+                    await self.event_dispatcher.produce_event(
+                        'session_cancelled',
+                        (str(session['session_id']), 'force-terminated'),
                     )
+                    return {'status': 'cancelled'}
+                for kernel in kernel_list:
                     await self.event_dispatcher.produce_event(
                         'kernel_terminated',
                         (str(session['id']), 'terminated'),
                     )
-                # We intentionally skip the agent RPC call!
-                await self.recalc_resource_usage()
                 return {'status': 'terminated'}
 
         hook_result = await self.hook_plugin_ctx.dispatch(
@@ -1415,19 +1590,80 @@ class AgentRegistry:
                         kernels.c.session_id,
                         kernels.c.status,
                         kernels.c.access_key,
+                        kernels.c.group_id,
+                        kernels.c.domain_name,
                         kernels.c.cluster_role,
                         kernels.c.agent,
                         kernels.c.agent_addr,
-                    ])
+                        kernels.c.occupied_slots,
+                    ], for_update=True)
                     .select_from(kernels)
                     .where(kernels.c.session_id == session['id'])
+                    .order_by(kernels.c.id)
                 )
+                # The kernels are locked so that the usage is released only once even if
+                # they are terminated concurrently (e.g., by mark_kernel_terminated()).
                 result = await conn.execute(query)
                 kernel_list = await result.fetchall()
+                if any(
+                    kernel['status'] in (KernelStatus.PREPARING, KernelStatus.PULLING)
+                    for kernel in kernel_list
+                ):
+                    raise GenericForbidden('Cannot destory kernels in preparing/pulling status')
+                cancelled_kernels = [
+                    kernel for kernel in kernel_list
+                    if kernel['status'] == KernelStatus.PENDING
+                ]
+                # The already terminated or cancelled kernels must not go back to TERMINATING,
+                # which would let their agent slots be released again.
+                terminating_kernels = [
+                    kernel for kernel in kernel_list
+                    if kernel['status'] != KernelStatus.PENDING
+                    and kernel['status'] not in DEAD_KERNEL_STATUSES
+                ]
+                await self.set_kernels_status(
+                    [kernel['id'] for kernel in cancelled_kernels],
+                    KernelStatus.CANCELLED, reason, db_conn=conn,
+                )
+                concurrency_deltas = defaultdict(int)
+                released_occupancies = []
+                for kernel in terminating_kernels:
+                    if kernel['status'] in USER_RESOURCE_OCCUPYING_KERNEL_STATUSES:
+                        if kernel['cluster_role'] == DEFAULT_ROLE:
+                            # The main session is terminated;
+                            # decrement the user's concurrency counter
+                            concurrency_deltas[kernel['access_key']] -= 1
+                        released_occupancies.append((
+                            kernel['access_key'], kernel['group_id'],
+                            kernel['domain_name'], kernel['occupied_slots'],
+                        ))
+                await apply_concurrency_deltas(conn, concurrency_deltas)
+                await apply_occupancy_deltas(conn, released_occupancies, release=True)
+                await self.set_kernels_status(
+                    [kernel['id'] for kernel in terminating_kernels],
+                    KernelStatus.TERMINATING, reason, db_conn=conn,
+                )
 
             main_stat = {}
             per_agent_tasks = []
 
+            for kernel in cancelled_kernels:
+                await self.event_dispatcher.produce_event(
+                    'kernel_cancelled',
+                    (str(kernel['id']), reason),
+                )
+                if kernel['cluster_role'] == DEFAULT_ROLE:
+                    main_stat = {'status': 'cancelled'}
+                    await self.event_dispatcher.produce_event(
+                        'session_cancelled',
+                        (str(kernel['session_id']), reason),
+                    )
+            for kernel in terminating_kernels:
+                await self.event_dispatcher.produce_event(
+                    'kernel_terminating',
+                    (str(kernel['id']), reason),
+                )
+
             keyfunc = lambda item: item['agent']
             for agent_id, group_iterator in itertools.groupby(
                 sorted(kernel_list, key=keyfunc), key=keyfunc,
@@ -1435,52 +1671,6 @@ class AgentRegistry:
                 destroyed_kernels = []
                 grouped_kernels = [*group_iterator]
                 for kernel in grouped_kernels:
-                    if kernel['status'] == KernelStatus.PENDING:
-                        await conn.execute(
-                            sa.update(kernels)
-                            .values({
-                                'status': KernelStatus.CANCELLED,
-                                'status_info': reason,
-                            })
-                            .where(kernels.c.id == kernel['id'])
-                        )
-                        await self.event_dispatcher.produce_event(
-                            'kernel_cancelled',
-                            (str(kernel['id']), reason),
-                        )
-                        if kernel['cluster_role'] == DEFAULT_ROLE:
-                            main_stat = {'status': 'cancelled'}
-                            await self.event_dispatcher.produce_event(
-                                'session_cancelled',
-                                (str(kernel['session_id']), reason),
-                            )
-                    elif kernel['status'] in (KernelStatus.PREPARING, KernelStatus.PULLING):
-                        raise GenericForbidden('Cannot destory kernels in preparing/pulling status')
-                    else:
-                        async with self.dbpool.acquire() as conn, conn.begin():
-                            if kernel['cluster_role'] == DEFAULT_ROLE:
-                                # The main session is terminated;
-                                # decrement the user's concurrency counter
-                                await conn.execute(
-                                    sa.update(keypairs)
-                                    .values({
-                                        'concurrency_used': keypairs.c.concurrency_used - 1,
-                                    })
-                                    .where(keypairs.c.access_key == kernel['access_key'])
-                                )
-                            await conn.execute(
-                                sa.update(kernels)
-                                .values({
-                                    'status': KernelStatus.TERMINATING,
-                                    'status_info': reason,
-                                })
-                                .where(kernels.c.id == kernel['id'])
-                            )
-                        await self.event_dispatcher.produce_event(
-                            'kernel_terminating',
-                            (str(kernel['id']), reason),
-                        )
-
                     if kernel['agent_addr'] is None:
                         await self.mark_kernel_terminated(kernel['id'], 'missing-agent-allocation')
                         if kernel['cluster_role'] == DEFAULT_ROLE:
@@ -1864,14 +2054,57 @@ class AgentRegistry:
             await asyncio.gather(*tasks)
 
     async def handle_heartbeat(self, agent_id, agent_info):
-        now = datetime.now(tzutc())
-        async with self.heartbeat_lock:
-
-            instance_rejoin = False
-
-            # Update "last seen" timestamp for liveness tracking
-            await self.redis_live.hset('last_seen', agent_id, now.timestamp())
+        # Heartbeats of different agents are processed concurrently,
+        # while those of the same agent are processed in order.
+        # If more heartbeats arrive while one is being processed, only the latest one is kept.
+        self._pending_heartbeats[agent_id] = agent_info
+        if agent_id in self._heartbeats_in_progress:
+            return
+        self._heartbeats_in_progress.add(agent_id)
+        try:
+            while (agent_info := self._pending_heartbeats.pop(agent_id, None)) is not None:
+                await self._process_heartbeat(agent_id, agent_info)
+        finally:
+            self._heartbeats_in_progress.discard(agent_id)
+
+    async def _get_known_registries(self) -> Mapping[str, URL]:
+        now = time.monotonic()
+        if (
+            self._known_registries is not None
+            and now - self._known_registries[0] <= _KNOWN_REGISTRIES_CACHE_TTL
+        ):
+            return self._known_registries[1]
+        known_registries = await get_known_registries(self.config_server.etcd)
+        self._known_registries = (now, known_registries)
+        return known_registries
 
+    async def _process_heartbeat(self, agent_id: AgentId, agent_info: Mapping[str, Any]) -> None:
+        now = datetime.now(tzutc())
+        instance_rejoin = False
+        last_state = self._agent_states.get(agent_id)
+        if (
+            last_state is not None
+            and time.monotonic() - last_state.checked_at > _AGENT_STATE_CACHE_TTL
+        ):
+            # Periodically check the DB to catch up the changes made by other manager processes.
+            last_state = None
+        agent_fields = {k: agent_info.get(k) for k in _HEARTBEAT_AGENT_FIELDS}
+
+        # Update "last seen" timestamp for liveness tracking
+        await self.redis_live.hset('last_seen', agent_id, now.timestamp())
+
+        slot_key_and_units = {
+            SlotName(k): SlotTypes(v[0]) for k, v in
+            agent_info['resource_slots'].items()}
+        available_slots = ResourceSlot({
+            SlotName(k): v[1] for k, v in
+            agent_info['resource_slots'].items()})
+        current_addr = agent_info['addr']
+        sgroup = agent_info.get('scaling_group', 'default')
+
+        checked_at = last_state.checked_at if last_state is not None else 0.0
+        if last_state is None or last_state.agent_fields != agent_fields:
+            checked_at = time.monotonic()
             # Check and update status of the agent record in DB
             async with self.dbpool.acquire() as conn, conn.begin():
                 query = (
@@ -1881,6 +2114,7 @@ class AgentRegistry:
                         agents.c.scaling_group,
                         agents.c.available_slots,
                         agents.c.clusterized,
+                        agents.c.version,
                     ], for_update=True)
                     .select_from(agents)
                     .where(agents.c.id == agent_id)
@@ -1888,15 +2122,6 @@ class AgentRegistry:
                 result = await conn.execute(query)
                 row = await result.first()
 
-                slot_key_and_units = {
-                    SlotName(k): SlotTypes(v[0]) for k, v in
-                    agent_info['resource_slots'].items()}
-                available_slots = ResourceSlot({
-                    SlotName(k): v[1] for k, v in
-                    agent_info['resource_slots'].items()})
-                current_addr = agent_info['addr']
-                sgroup = agent_info.get('scaling_group', 'default')
-
                 if row is None or row['status'] is None:
                     # new agent detected!
                     log.info('agent {0} joined!', agent_id)
@@ -1927,7 +2152,8 @@ class AgentRegistry:
                         updates['clusterized'] = agent_info.get('swarm_enabled', False)
                     if row['addr'] != current_addr:
                         updates['addr'] = current_addr
-                    updates['version'] = agent_info['version']
+                    if row['version'] != agent_info['version']:
+                        updates['version'] = agent_info['version']
                     # occupied_slots are updated when kernels starts/terminates
                     if updates:
                         await self.config_server.update_resource_slots(slot_key_and_units)
@@ -1957,22 +2183,34 @@ class AgentRegistry:
                 else:
                     log.error('should not reach here! {0}', type(row['status']))
 
-            if instance_rejoin:
-                await self.event_dispatcher.produce_event(
-                    'instance_started', ('revived', ),
-                    agent_id=agent_id)
-
-            # Update the mapping of kernel images to agents.
-            known_registries = await get_known_registries(self.config_server.etcd)
-            images = msgpack.unpackb(snappy.decompress(agent_info['images']))
+        if instance_rejoin:
+            await self.event_dispatcher.produce_event(
+                'instance_started', ('revived', ),
+                agent_id=agent_id)
+
+        # Update the mapping of kernel images to agents.
+        known_registries = await self._get_known_registries()
+        images = msgpack.unpackb(snappy.decompress(agent_info['images']))
+        current_images = frozenset(
+            ImageRef(image[0], known_registries).canonical
+            for image in images
+        )
+        if last_state is None or instance_rejoin or last_state.images != current_images:
+            # The script diffs the images with the agent's reverse index stored in Redis,
+            # so that the changes made by other manager processes are also taken into account.
+            await redis.execute_with_retries(
+                lambda: self.redis_image.eval(
+                    _UPDATE_AGENT_IMAGES_SCRIPT,
+                    keys=[_agent_images_key(agent_id)],
+                    args=[agent_id, *sorted(current_images)],
+                ),
+            )
 
-            def _pipe_builder():
-                pipe = self.redis_image.pipeline()
-                for image in images:
-                    image_ref = ImageRef(image[0], known_registries)
-                    pipe.sadd(image_ref.canonical, agent_id)
-                return pipe
-            await redis.execute_with_retries(_pipe_builder)
+        self._agent_states[agent_id] = _AgentHeartbeatState(
+            checked_at=checked_at,
+            agent_fields=agent_fields,
+            images=current_images,
+        )
 
         await self.hook_plugin_ctx.notify(
             'POST_AGENT_HEARTBEAT',
@@ -1982,13 +2220,24 @@ class AgentRegistry:
     async def mark_agent_terminated(self, agent_id, status, conn=None):
         global agent_peers
         await self.redis_live.hdel('last_seen', agent_id)
+        self._agent_states.pop(agent_id, None)
 
-        async def _pipe_builder():
-            pipe = self.redis_image.pipeline()
-            async for imgname in self.redis_image.iscan():
-                pipe.srem(imgname, agent_id)
-            return pipe
-        await redis.execute_with_retries(_pipe_builder)
+        num_removed_images = await redis.execute_with_retries(
+            lambda: self.redis_image.eval(
+                _REMOVE_AGENT_IMAGES_SCRIPT,
+                keys=[_agent_images_key(agent_id)],
+                args=[agent_id],
+            ),
+        )
+        if num_removed_images < 0:
+            # The agent has no reverse index (e.g., it has not sent any heartbeat since
+            # the manager upgrade or it has no images), so scan all images instead.
+            async def _pipe_builder():
+                pipe = self.redis_image.pipeline()
+                async for imgname in self.redis_image.iscan():
+                    pipe.srem(imgname, agent_id)
+                return pipe
+            await redis.execute_with_retries(_pipe_builder)
 
         async with reenter_txn(self.dbpool, conn) as conn:
 
@@ -2056,9 +2305,23 @@ class AgentRegistry:
                                 status: KernelStatus,
                                 reason: str = '', *,
                                 db_conn: SAConnection = None):
+        await self.set_kernels_status([kernel_id], status, reason, db_conn=db_conn)
+
+    async def set_kernels_status(
+        self,
+        kernel_ids: Sequence[KernelId],
+        status: KernelStatus,
+        reason: str = '', *,
+        db_conn: SAConnection = None,
+    ) -> None:
+        """
+        Set the same status to multiple kernels using a single query.
+        """
         assert status != KernelStatus.TERMINATED, \
                'TERMINATED status update must be handled in ' \
                'mark_kernel_terminated()'
+        if not kernel_ids:
+            return
         data = {
             'status': status,
             'status_info': reason,
@@ -2068,10 +2331,24 @@ class AgentRegistry:
             query = (
                 sa.update(kernels)
                 .values(data)
-                .where(kernels.c.id == kernel_id)
+                .where(kernels.c.id.in_(kernel_ids))
             )
             await conn.execute(query)
 
+    async def update_kernels(
+        self,
+        per_kernel_updates: Mapping[KernelId, Mapping[str, Any]], *,
+        db_conn: SAConnection = None,
+    ) -> None:
+        """
+        Update multiple kernels with different values per kernel.
+        The kernels updating the same set of columns are updated together using a single query.
+        """
+        if not per_kernel_updates:
+            return
+        async with reenter_txn(self.dbpool, db_conn) as conn:
+            await execute_bulk_update(conn, kernels, kernels.c.id, per_kernel_updates)
+
     async def set_session_result(
         self,
         kernel_id: KernelId,
@@ -2095,22 +2372,26 @@ class AgentRegistry:
         self, kernel_ids: Sequence[KernelId], *,
         db_conn: SAConnection = None,
     ) -> None:
-        per_kernel_updates = {}
-
-        for kernel_id in kernel_ids:
-            raw_kernel_id = str(kernel_id)
-            log.debug('sync_kernel_stats(k:{})', kernel_id)
-            updates = {}
-
-            async def _get_kstats_from_redis():
-                stat_type = await self.redis_stat.type(raw_kernel_id)
+        per_kernel_updates: Dict[KernelId, Dict[str, Any]] = {}
+
+        for offset in range(0, len(kernel_ids), _KERNEL_STATS_BATCH_SIZE):
+            batch = kernel_ids[offset:offset + _KERNEL_STATS_BATCH_SIZE]
+            raw_kernel_ids = [str(kernel_id) for kernel_id in batch]
+            log.debug('sync_kernel_stats(k:{})', raw_kernel_ids)
+            # Fetch the stats of all kernels in the batch with a single round trip.
+            results = await redis.execute_script(
+                self.redis_stat, 'kernel_stats', _KERNEL_STATS_SCRIPT,
+                raw_kernel_ids, [],
+            )
+            for kernel_id, (stat_type, *stat_value) in zip(batch, results):
+                updates = {}
                 if stat_type == 'string':
-                    kern_stat = await self.redis_stat.get(raw_kernel_id, encoding=None)
-                    if kern_stat is not None:
-                        updates['last_stat'] = msgpack.unpackb(kern_stat)
-                else:
-                    kern_stat = await self.redis_stat.hgetall(raw_kernel_id)
-                    if kern_stat is not None and 'cpu_used' in kern_stat:
+                    if stat_value:
+                        updates['last_stat'] = msgpack.unpackb(bytes.fromhex(stat_value[0]))
+                elif stat_type == 'hash':
+                    fields = stat_value[0]
+                    kern_stat = dict(zip(fields[0::2], fields[1::2]))
+                    if 'cpu_used' in kern_stat:
                         updates.update({
                             'cpu_used': int(float(kern_stat['cpu_used'])),
                             'mem_max_bytes': int(kern_stat['mem_max_bytes']),
@@ -2120,23 +2401,12 @@ class AgentRegistry:
                             'io_write_bytes': int(kern_stat['io_write_bytes']),
                             'io_max_scratch_size': int(kern_stat['io_max_scratch_size']),
                         })
+                if not updates:
+                    log.warning('sync_kernel_stats(k:{}): no statistics updates', kernel_id)
+                    continue
+                per_kernel_updates[kernel_id] = updates
 
-            await redis.execute_with_retries(
-                lambda: _get_kstats_from_redis(),
-                max_retries=1,
-            )
-            if not updates:
-                log.warning('sync_kernel_stats(k:{}): no statistics updates', kernel_id)
-                continue
-            per_kernel_updates[kernel_id] = updates
-
-        async with reenter_txn(self.dbpool, db_conn) as conn:
-            # TODO: update to use execute_batch() if aiopg supports it.
-            for kernel_id, updates in per_kernel_updates.items():
-                query = (sa.update(kernels)
-                           .values(updates)
-                           .where(kernels.c.id == kernel_id))
-                await conn.execute(query)
+        await self.update_kernels(per_kernel_updates, db_conn=db_conn)
 
     async def mark_kernel_terminated(
         self,
@@ -2153,10 +2423,13 @@ class AgentRegistry:
             query = (
                 sa.select([
                     kernels.c.access_key,
+                    kernels.c.group_id,
+                    kernels.c.domain_name,
                     kernels.c.agent,
                     kernels.c.status,
                     kernels.c.occupied_slots,
                     kernels.c.session_id,
+                    kernels.c.cluster_role,
                 ], for_update=True)
                 .select_from(kernels)
                 .where(kernels.c.id == kernel_id)
@@ -2188,30 +2461,19 @@ class AgentRegistry:
                 .where(kernels.c.id == kernel_id)
             )
             await conn.execute(query)
-            await recalc_concurrency_used(conn, kernel['access_key'])
+            if kernel['status'] in USER_RESOURCE_OCCUPYING_KERNEL_STATUSES:
+                if kernel['cluster_role'] == DEFAULT_ROLE:
+                    await apply_concurrency_deltas(conn, {kernel['access_key']: -1})
+                await apply_occupancy_deltas(conn, [(
+                    kernel['access_key'], kernel['group_id'],
+                    kernel['domain_name'], kernel['occupied_slots'],
+                )], release=True)
 
             # Release agent resource slots.
-            query = (
-                sa.select([
-                    agents.c.occupied_slots,
-                ], for_update=True)
-                .select_from(agents)
-                .where(agents.c.id == kernel['agent'])
-            )
-            result = await conn.execute(query)
-            agent = await result.first()
-            if agent is None:
-                return
-            updated_occupied_slots = \
-                agent['occupied_slots'] - kernel['occupied_slots']
-            query = (
-                sa.update(agents)
-                .values({
-                    'occupied_slots': updated_occupied_slots,
-                })
-                .where(agents.c.id == kernel['agent'])
-            )
-            await conn.execute(query)
+            if kernel['agent'] is not None:
+                await apply_agent_slot_deltas(
+                    conn, {kernel['agent']: kernel['occupied_slots']}, release=True,
+                )
 
         # Perform statistics sync in a separate transaction block, since
         # it may take a while to fetch stats from Redis.
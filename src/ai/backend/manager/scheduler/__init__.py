@@ -1,9 +1,15 @@
 from __future__ import annotations
 
 from abc import ABCMeta, abstractmethod
+from contextlib import asynccontextmanager as actxmgr
+from datetime import datetime
+from decimal import ROUND_CEILING, ROUND_FLOOR
+import itertools
 import logging
 from typing import (
     Any,
+    AsyncIterator,
+    Dict,
     List,
     Mapping,
     MutableMapping,
@@ -11,11 +17,13 @@ from typing import (
     Optional,
     Protocol,
     Sequence,
+    Tuple,
 )
 import uuid
 
 from aiopg.sa.connection import SAConnection
 import attr
+import trafaret as t
 
 from ai.backend.common.logging import BraceStyleAdapter
 from ai.backend.common.docker import (
@@ -33,6 +41,8 @@ from ai.backend.common.types import (
 
 from ..defs import DEFAULT_ROLE
 from ..registry import AgentRegistry
+from ..slots import SlotLayout, SlotVector
+from .capacity import AgentCapacityMatrix
 
 log = BraceStyleAdapter(logging.getLogger('ai.backend.manager.scheduler'))
 
@@ -51,6 +61,75 @@ class AgentContext:
     scaling_group: str
     available_slots: ResourceSlot
     occupied_slots: ResourceSlot
+    clusterized: bool = False
+
+
+@attr.s(auto_attribs=True, slots=True)
+class SchedulingSnapshot:
+    """
+    An in-memory view of the schedulable agents in a scaling group,
+    loaded once per scheduling pass.
+
+    Reservations are applied to the agent contexts immediately so that the
+    subsequent decisions in the same pass see the updated occupancy,
+    while the accumulated per-agent deltas are written back to the database
+    by the transaction of each scheduled session.
+    """
+    scaling_group: str
+    agents: List[AgentContext]
+    total_capacity: ResourceSlot = attr.Factory(ResourceSlot)
+    reserved_slots: Dict[AgentId, ResourceSlot] = attr.Factory(dict)
+    capacity: AgentCapacityMatrix = attr.ib(init=False)
+    _agent_map: Dict[AgentId, AgentContext] = attr.ib(init=False, factory=dict)
+    _txn_log: Optional[List[Tuple[AgentId, ResourceSlot]]] = attr.ib(init=False, default=None)
+
+    def __attrs_post_init__(self) -> None:
+        zero = ResourceSlot()
+        self.total_capacity = sum((ag.available_slots for ag in self.agents), zero)
+        self._agent_map = {ag.agent_id: ag for ag in self.agents}
+        self.capacity = AgentCapacityMatrix(self.agents)
+
+    def get_agent(self, agent_id: AgentId) -> Optional[AgentContext]:
+        return self._agent_map.get(agent_id)
+
+    def reserve(
+        self,
+        agent_id: AgentId,
+        requested_slots: ResourceSlot,
+    ) -> AgentAllocationContext:
+        agent = self._agent_map[agent_id]
+        agent.occupied_slots = agent.occupied_slots + requested_slots
+        if not self.capacity.consume(agent_id, requested_slots):
+            self.capacity.update(agent)
+        self.reserved_slots[agent_id] = \
+            self.reserved_slots.get(agent_id, ResourceSlot()) + requested_slots
+        if self._txn_log is not None:
+            self._txn_log.append((agent_id, requested_slots))
+        return AgentAllocationContext(agent_id, agent.agent_addr, self.scaling_group)
+
+    def _release(self, agent_id: AgentId, requested_slots: ResourceSlot) -> None:
+        agent = self._agent_map[agent_id]
+        agent.occupied_slots = agent.occupied_slots - requested_slots
+        if not self.capacity.consume(agent_id, requested_slots, release=True):
+            self.capacity.update(agent)
+        self.reserved_slots[agent_id] = self.reserved_slots[agent_id] - requested_slots
+
+    @actxmgr
+    async def begin(self) -> AsyncIterator[None]:
+        """
+        Make the reservations done inside the block to be reverted
+        when the block raises an exception, so that the snapshot follows
+        the enclosing database transaction.
+        """
+        self._txn_log = []
+        try:
+            yield
+        except BaseException:
+            for agent_id, requested_slots in reversed(self._txn_log):
+                self._release(agent_id, requested_slots)
+            raise
+        finally:
+            self._txn_log = None
 
 
 @attr.s(auto_attribs=True, slots=True)
@@ -66,6 +145,94 @@ class SchedulingContext:
     """
     registry: AgentRegistry
     known_slot_types: Mapping[str, str]
+    predicate_snapshot: Optional[PredicateSnapshot] = None
+
+
+@attr.s(auto_attribs=True, slots=True)
+class PredicateSnapshot:
+    """
+    The inputs of the scheduling predicates preloaded for all pending sessions
+    of a scheduling pass, so that each predicate runs as an in-memory check.
+
+    The usage figures are updated in place as sessions get scheduled in the pass.
+    The slot amounts are kept as the slot vectors of the known slot types
+    (the given ResourceSlot values are converted), dropping the no-longer used slot types.
+    """
+    keypair_resource_policies: Mapping[str, Mapping[str, Any]]
+    keypair_allowed_slots: Mapping[str, SlotVector]
+    group_allowed_slots: Mapping[uuid.UUID, SlotVector]
+    domain_allowed_slots: Mapping[str, SlotVector]
+    allowed_sgroups: Mapping[Tuple[str, uuid.UUID, str], Sequence[str]]
+    session_starts_at: Mapping[uuid.UUID, Optional[datetime]]
+    concurrency_used: MutableMapping[AccessKey, int]
+    keypair_occupancy: MutableMapping[AccessKey, SlotVector]
+    group_occupancy: MutableMapping[uuid.UUID, SlotVector]
+    domain_occupancy: MutableMapping[str, SlotVector]
+    slot_layout: Optional[SlotLayout] = None
+    _requested_slots: Dict[uuid.UUID, SlotVector] = attr.ib(init=False, factory=dict)
+
+    def __attrs_post_init__(self) -> None:
+        if self.slot_layout is None:
+            self.slot_layout = SlotLayout.of(itertools.chain.from_iterable(
+                slots.keys() for slots in itertools.chain(
+                    self.keypair_allowed_slots.values(),
+                    self.group_allowed_slots.values(),
+                    self.domain_allowed_slots.values(),
+                    self.keypair_occupancy.values(),
+                    self.group_occupancy.values(),
+                    self.domain_occupancy.values(),
+                )
+            ))
+        layout = self.slot_layout
+
+        def vectorize(slots: Mapping[str, Any], rounding: str) -> SlotVector:
+            if isinstance(slots, SlotVector) and slots.layout is layout:
+                return slots
+            return layout.vectorize(slots, rounding)
+
+        self.keypair_allowed_slots = {
+            k: vectorize(v, ROUND_FLOOR) for k, v in self.keypair_allowed_slots.items()
+        }
+        self.group_allowed_slots = {
+            k: vectorize(v, ROUND_FLOOR) for k, v in self.group_allowed_slots.items()
+        }
+        self.domain_allowed_slots = {
+            k: vectorize(v, ROUND_FLOOR) for k, v in self.domain_allowed_slots.items()
+        }
+        self.keypair_occupancy = {
+            k: vectorize(v, ROUND_CEILING) for k, v in self.keypair_occupancy.items()
+        }
+        self.group_occupancy = {
+            k: vectorize(v, ROUND_CEILING) for k, v in self.group_occupancy.items()
+        }
+        self.domain_occupancy = {
+            k: vectorize(v, ROUND_CEILING) for k, v in self.domain_occupancy.items()
+        }
+
+    def get_requested_slots(self, sess_ctx: PendingSession) -> SlotVector:
+        """
+        Return the requested slots of the session as a slot vector,
+        converted only once per scheduling pass.
+        """
+        requested = self._requested_slots.get(sess_ctx.session_id)
+        if requested is None:
+            assert self.slot_layout is not None
+            requested = self.slot_layout.vectorize(sess_ctx.requested_slots, ROUND_CEILING)
+            self._requested_slots[sess_ctx.session_id] = requested
+        return requested
+
+    def add_occupancy(self, sess_ctx: PendingSession) -> None:
+        requested = self.get_requested_slots(sess_ctx)
+        for occupancy, key in (
+            (self.keypair_occupancy, sess_ctx.access_key),
+            (self.group_occupancy, sess_ctx.group_id),
+            (self.domain_occupancy, sess_ctx.domain_name),
+        ):
+            occupied = occupancy.get(key)  # type: ignore
+            if occupied is None:
+                occupancy[key] = requested.copy()  # type: ignore
+            else:
+                occupied += requested
 
 
 @attr.s(auto_attribs=True, slots=True)
@@ -185,9 +352,32 @@ class AbstractScheduler(metaclass=ABCMeta):
     """
 
     config: Mapping[str, Any]
+    capacity_matrix: Optional[AgentCapacityMatrix]
+    backfill: bool
 
     def __init__(self, config: Mapping[str, Any]) -> None:
         self.config = config
+        # If set, a session blocked by the lack of available agents does not end the
+        # scheduling pass: the dispatcher holds the agents where it would fit the earliest
+        # and keeps placing the subsequent sessions into the other agents.
+        self.backfill = t.ToBool().check(config.get('backfill', False))
+        # The dispatcher sets the capacity matrix of the current scheduling pass,
+        # which is kept up-to-date with the reservations made in the pass.
+        self.capacity_matrix = None
+
+    def get_capacity_matrix(
+        self,
+        agents: Sequence[AgentContext],
+    ) -> Tuple[AgentCapacityMatrix, List[int]]:
+        """
+        Return the capacity matrix covering the given agents and their row indices.
+        """
+        if self.capacity_matrix is not None:
+            indices = self.capacity_matrix.indices_of(agents)
+            if indices is not None:
+                return self.capacity_matrix, indices
+        matrix = AgentCapacityMatrix(agents)
+        return matrix, list(range(len(agents)))
 
     @abstractmethod
     def pick_session(
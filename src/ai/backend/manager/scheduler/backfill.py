@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from typing import (
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Sequence,
+    TYPE_CHECKING,
+)
+import uuid
+
+import attr
+
+from ai.backend.common.types import (
+    AgentId,
+    ClusterMode,
+    ResourceSlot,
+)
+
+if TYPE_CHECKING:
+    from . import AbstractScheduler, AgentContext, PendingSession
+
+__all__ = (
+    'BackfillReservation',
+    'may_fit_into',
+    'reserve_agents_for_blocked_session',
+)
+
+
+@attr.s(auto_attribs=True, slots=True, frozen=True)
+class BackfillReservation:
+    """
+    The agents held for the blocked head session of a scheduling pass.
+
+    The subsequent sessions of the pass are backfilled only into the other agents,
+    so that they do not delay the head session which will be placed on the reserved agents
+    as soon as the running sessions there free enough slots.
+    """
+    session_id: uuid.UUID
+    agent_ids: FrozenSet[AgentId]
+
+    def exclude_from(self, agents: Sequence[AgentContext]) -> List[AgentContext]:
+        return [ag for ag in agents if ag.agent_id not in self.agent_ids]
+
+
+def reserve_agents_for_blocked_session(
+    scheduler: AbstractScheduler,
+    agents: Sequence[AgentContext],
+    sess_ctx: PendingSession,
+) -> Optional[BackfillReservation]:
+    """
+    Choose the agents where the blocked session would fit the earliest.
+
+    As the running sessions have no known end times, the earliest fit is estimated as
+    the agents that need the least amount of occupied slots to be freed.
+    The kernels of a multi-node session are planned one by one on top of each other.
+    Returns None if the session cannot fit into the agents even when they become empty,
+    as reserving agents for it would only block the other sessions.
+    """
+    matrix, indices = scheduler.get_capacity_matrix(agents)
+    units: Sequence[ResourceSlot]
+    if sess_ctx.cluster_mode == ClusterMode.SINGLE_NODE:
+        units = [sess_ctx.requested_slots]
+    else:
+        units = [kernel.requested_slots for kernel in sess_ctx.kernels]
+    planned: Dict[int, Dict[str, int]] = {}
+    for requested_slots in units:
+        requested = matrix.to_fixed(requested_slots)
+        chosen_idx: Optional[int] = None
+        chosen_plan: Dict[str, int] = {}
+        chosen_shortfall = 0.0
+        for idx in indices:
+            plan = dict(planned.get(idx, {}))
+            for k, amount in requested.items():
+                plan[k] = plan.get(k, 0) + amount
+            shortfall = matrix.shortfall(idx, plan)
+            if shortfall is None:
+                continue
+            if chosen_idx is None or shortfall < chosen_shortfall:
+                chosen_idx, chosen_plan, chosen_shortfall = idx, plan, shortfall
+        if chosen_idx is None:
+            return None
+        planned[chosen_idx] = chosen_plan
+    return BackfillReservation(
+        sess_ctx.session_id,
+        frozenset(matrix.agents[idx].agent_id for idx in planned),
+    )
+
+
+def may_fit_into(
+    scheduler: AbstractScheduler,
+    agents: Sequence[AgentContext],
+    sess_ctx: PendingSession,
+) -> bool:
+    """
+    Check if each unit of the session fits into at least one of the agents,
+    to skip the hopeless backfill attempts without running the predicates.
+    """
+    matrix, indices = scheduler.get_capacity_matrix(agents)
+    if sess_ctx.cluster_mode == ClusterMode.SINGLE_NODE:
+        return bool(matrix.fits(sess_ctx.requested_slots, indices))
+    if len(sess_ctx.kernels) >= 2:
+        matrix, indices = scheduler.get_capacity_matrix([ag for ag in agents if ag.clusterized])
+    return all(matrix.fits(kernel.requested_slots, indices) for kernel in sess_ctx.kernels)
@@ -0,0 +1,283 @@
+from __future__ import annotations
+
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR
+import enum
+from typing import (
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    TYPE_CHECKING,
+)
+
+from ai.backend.common.types import (
+    AgentId,
+    ResourceSlot,
+)
+
+from ..slots import to_fixed
+
+if TYPE_CHECKING:
+    from . import AgentContext
+
+__all__ = (
+    'AgentSelectionStrategy',
+    'AgentCapacityMatrix',
+)
+
+
+def _to_fixed(value: Decimal, rounding: str) -> int:
+    # The per-candidate comparisons use the fixed-point integers shared with the slot vectors
+    # to avoid Decimal arithmetic.
+    amount = to_fixed(value, rounding)
+    if isinstance(amount, float):
+        raise ValueError('cannot use a non-finite slot amount in the capacity matrix', value)
+    return amount
+
+
+class AgentSelectionStrategy(str, enum.Enum):
+    # Prefer agents without extra slot types (e.g., accelerators) unused by the request,
+    # and then the agent with the most available slots.
+    MOST_AVAILABLE = 'most-available'
+    # Prefer the agent that will have the least remaining slots after placement.
+    BEST_FIT = 'best-fit'
+    # Prefer the agent that will have the most remaining slots after placement.
+    WORST_FIT = 'worst-fit'
+
+
+class AgentCapacityMatrix:
+    """
+    A column-oriented integer matrix of the agents' available and remaining slots,
+    indexed by the agent position and the slot type.
+
+    It is built once per scheduling pass and is updated in place whenever a reservation
+    changes the occupied slots of an agent, so that checking and ranking the candidates
+    for each request only involves integer comparisons over the requested slot columns.
+    """
+
+    __slots__ = ('agents', 'slot_keys', 'available', 'remaining', '_index')
+
+    agents: Sequence[AgentContext]
+    slot_keys: List[str]
+    available: Dict[str, List[int]]
+    remaining: Dict[str, List[int]]
+    _index: Dict[AgentId, int]
+
+    def __init__(self, agents: Sequence[AgentContext]) -> None:
+        self.agents = agents
+        self._build()
+
+    def _build(self) -> None:
+        slot_keys: Set[str] = set()
+        for agent in self.agents:
+            slot_keys.update(agent.available_slots.keys())
+            slot_keys.update(agent.occupied_slots.keys())
+        self.slot_keys = sorted(slot_keys)
+        num_agents = len(self.agents)
+        self.available = {k: [0] * num_agents for k in self.slot_keys}
+        self.remaining = {k: [0] * num_agents for k in self.slot_keys}
+        self._index = {}
+        for idx, agent in enumerate(self.agents):
+            self._index[agent.agent_id] = idx
+            self._fill_row(idx, agent)
+
+    def __len__(self) -> int:
+        return len(self.agents)
+
+    def _fill_row(self, idx: int, agent: AgentContext) -> None:
+        zero = Decimal(0)
+        for k in self.slot_keys:
+            available = Decimal(agent.available_slots.get(k, zero))
+            occupied = Decimal(agent.occupied_slots.get(k, zero))
+            self.available[k][idx] = _to_fixed(available, ROUND_FLOOR)
+            self.remaining[k][idx] = _to_fixed(available - occupied, ROUND_FLOOR)
+
+    def update(self, agent: AgentContext) -> None:
+        """
+        Refresh the row of the given agent after its occupied slots have changed.
+        """
+        idx = self._index[agent.agent_id]
+        if not (agent.available_slots.keys() | agent.occupied_slots.keys()) <= set(self.slot_keys):
+            # A new slot type has appeared; rebuild all columns.
+            self._build()
+            return
+        self._fill_row(idx, agent)
+
+    def consume(
+        self,
+        agent_id: AgentId,
+        requested_slots: ResourceSlot,
+        *,
+        release: bool = False,
+    ) -> bool:
+        """
+        Subtract (or add back if *release* is set) the requested slots from the remaining
+        slots of the agent's row, without converting the whole row again.
+        Returns False if the requested slots include a slot type unknown to the matrix,
+        where the caller should :meth:`update()` the row instead.
+        """
+        idx = self._index[agent_id]
+        deltas = []
+        for k, v in requested_slots.items():
+            column = self.remaining.get(k)
+            if column is None:
+                return False
+            deltas.append((column, _to_fixed(v, ROUND_CEILING)))
+        for column, amount in deltas:
+            if release:
+                column[idx] += amount
+            else:
+                column[idx] -= amount
+        return True
+
+    def indices_of(self, agents: Sequence[AgentContext]) -> Optional[List[int]]:
+        """
+        Map the given agent contexts to the matrix rows.
+        Returns None if any of them is not a part of this matrix.
+        """
+        if agents is self.agents:
+            return list(range(len(self.agents)))
+        indices = []
+        for agent in agents:
+            idx = self._index.get(agent.agent_id)
+            if idx is None or self.agents[idx] is not agent:
+                return None
+            indices.append(idx)
+        return indices
+
+    def fits(
+        self,
+        requested_slots: ResourceSlot,
+        indices: Sequence[int],
+    ) -> List[int]:
+        """
+        Filter the rows whose remaining slots can host the requested slots.
+        """
+        candidates = list(indices)
+        for k, v in requested_slots.items():
+            if not candidates:
+                break
+            amount = _to_fixed(v, ROUND_CEILING)
+            if amount <= 0:
+                continue
+            column = self.remaining.get(k)
+            if column is None:
+                return []
+            candidates = [idx for idx in candidates if column[idx] >= amount]
+        return candidates
+
+    def to_fixed(self, slots: ResourceSlot) -> Dict[str, int]:
+        """
+        Convert the requested slots into the fixed-point amounts used by the matrix.
+        """
+        return {k: _to_fixed(v, ROUND_CEILING) for k, v in slots.items()}
+
+    def shortfall(self, idx: int, requested: Mapping[str, int]) -> Optional[float]:
+        """
+        Estimate how much of the occupied slots of the row should be freed to host
+        the requested fixed-point amounts, as the sum of the per-slot-type deficits
+        normalized by the capacity.
+        Returns None if the row cannot host them even when it becomes empty.
+        """
+        deficit = 0.0
+        for k, amount in requested.items():
+            if amount <= 0:
+                continue
+            column = self.available.get(k)
+            if column is None or column[idx] < amount:
+                return None
+            remaining = self.remaining[k][idx]
+            if remaining < amount:
+                deficit += (amount - remaining) / column[idx]
+        return deficit
+
+    def select(
+        self,
+        candidates: Sequence[int],
+        requested_slots: ResourceSlot,
+        strategy: AgentSelectionStrategy = AgentSelectionStrategy.MOST_AVAILABLE,
+        *,
+        penalize_extra_slots: bool = True,
+    ) -> Optional[AgentId]:
+        """
+        Choose an agent among the candidate rows, which should have been filtered by
+        :meth:`fits()`.  The first candidate wins ties.
+        """
+        if not candidates:
+            return None
+        if strategy == AgentSelectionStrategy.MOST_AVAILABLE:
+            chosen = self._select_most_available(candidates, requested_slots, penalize_extra_slots)
+        else:
+            chosen = self._select_by_leftover(
+                candidates, requested_slots,
+                prefer_less=(strategy == AgentSelectionStrategy.BEST_FIT),
+            )
+        return self.agents[chosen].agent_id
+
+    def _select_most_available(
+        self,
+        candidates: Sequence[int],
+        requested_slots: ResourceSlot,
+        penalize_extra_slots: bool,
+    ) -> int:
+        # This follows the semantics of max() with ResourceSlot keys, which are partially ordered:
+        # a candidate replaces the current choice only when its available slots dominate.
+        if penalize_extra_slots:
+            unused_columns = [
+                self.available[k] for k, v in requested_slots.items()
+                if v == 0 and k in self.available
+            ]
+            num_extras = {
+                idx: sum(1 for column in unused_columns if column[idx] > 0)
+                for idx in candidates
+            }
+        else:
+            num_extras = {idx: 0 for idx in candidates}
+        columns = [self.available[k] for k in self.slot_keys]
+        chosen = candidates[0]
+        for idx in candidates[1:]:
+            if num_extras[idx] != num_extras[chosen]:
+                if num_extras[idx] < num_extras[chosen]:
+                    chosen = idx
+                continue
+            dominates = True
+            differs = False
+            for column in columns:
+                if column[idx] < column[chosen]:
+                    dominates = False
+                    break
+                if column[idx] != column[chosen]:
+                    differs = True
+            if dominates and differs:
+                chosen = idx
+        return chosen
+
+    def _select_by_leftover(
+        self,
+        candidates: Sequence[int],
+        requested_slots: ResourceSlot,
+        prefer_less: bool,
+    ) -> int:
+        # Score the remaining slots after placement, normalized by the largest capacity
+        # of each slot type so that slot types with different units are comparable.
+        requested: Mapping[str, int] = {
+            k: _to_fixed(requested_slots.get(k, Decimal(0)), ROUND_CEILING)
+            for k in self.slot_keys
+        }
+        weights = {}
+        for k in self.slot_keys:
+            max_capacity = max(self.available[k], default=0)
+            if max_capacity > 0:
+                weights[k] = 1 / max_capacity
+        chosen = candidates[0]
+        chosen_score: Optional[float] = None
+        for idx in candidates:
+            score = sum(
+                (self.remaining[k][idx] - requested[k]) * weight
+                for k, weight in weights.items()
+            )
+            if chosen_score is None or (score < chosen_score if prefer_less else score > chosen_score):
+                chosen, chosen_score = idx, score
+        return chosen
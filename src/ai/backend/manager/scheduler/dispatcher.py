@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import asyncio
 from datetime import datetime
+import functools
 import itertools
 import logging
 import pkg_resources
@@ -9,16 +10,22 @@ import time
 from typing import (
     Any,
     Awaitable,
+    Callable,
+    Dict,
     List,
     Mapping,
     MutableMapping,
+    Optional,
     Sequence,
+    Set,
     Tuple,
     Union,
 )
+import uuid
 
 from aiopg.sa.connection import SAConnection
 import aioredlock
+import attr
 from dateutil.tz import tzutc
 import sqlalchemy as sa
 from sqlalchemy.sql.expression import true
@@ -28,8 +35,10 @@ from ai.backend.common.logging import BraceStyleAdapter
 from ai.backend.common.docker import ImageRef
 from ai.backend.common.types import (
     aobject,
+    AccessKey,
     AgentId,
     ClusterMode,
+    KernelId,
     ResourceSlot,
 )
 from ai.backend.common.identity import get_instance_id
@@ -42,18 +51,27 @@ from ..models import (
     AgentStatus, KernelStatus,
     AGENT_RESOURCE_OCCUPYING_KERNEL_STATUSES,
 )
+from ..models.resource_usage import apply_agent_slot_deltas, apply_occupancy_deltas
+from ..models.utils import execute_bulk_update
+from ..slots import sum_resource_slots
 from . import (
     PredicateResult,
     PendingSession,
     ExistingSession,
     SchedulingContext,
+    SchedulingSnapshot,
     AgentContext,
-    AgentAllocationContext,
     AbstractScheduler,
     KernelInfo,
     KernelAgentBinding,
 )
+from .backfill import (
+    BackfillReservation,
+    may_fit_into,
+    reserve_agents_for_blocked_session,
+)
 from .predicates import (
+    preload_predicate_snapshot,
     check_reserved_batch_session,
     check_concurrency,
     check_dependencies,
@@ -62,14 +80,19 @@ from .predicates import (
     check_domain_resource_limit,
     check_scaling_group,
 )
+from .starter import SessionStartExecutor
 
 __all__ = (
     'load_scheduler',
+    'schedule_pending_sessions',
+    'ScheduledSession',
     'SchedulerDispatcher',
 )
 
 log = BraceStyleAdapter(logging.getLogger('ai.backend.manager.scheduler'))
 
+log_fmt = 'schedule(s:{}, type:{}, name:{}, ak:{}, cluster_mode:{}): '
+
 
 def load_scheduler(name: str, scheduler_configs: Mapping[str, Any]) -> AbstractScheduler:
     entry_prefix = 'backendai_scheduler_v10'
@@ -82,6 +105,16 @@ def load_scheduler(name: str, scheduler_configs: Mapping[str, Any]) -> AbstractS
     raise ImportError('Cannot load the scheduler plugin', name)
 
 
+@attr.s(auto_attribs=True, slots=True)
+class ScheduledSession:
+    """
+    A session assigned to agents in a scheduling pass, to be started after the pass.
+    """
+    sched_ctx: SchedulingContext
+    session_agent_binding: Tuple[PendingSession, List[KernelAgentBinding]]
+    check_results: List[Union[Exception, PredicateResult]]
+
+
 def merge_resource(src: MutableMapping[str, Any], val: MutableMapping[str, Any]) -> None:
     for k in val.keys():
         if k in src.keys():
@@ -90,10 +123,105 @@ def merge_resource(src: MutableMapping[str, Any], val: MutableMapping[str, Any])
             src[k] = val[k]
 
 
+class SessionQueueView:
+    """
+    A per-process live view of the pending and existing sessions of all scaling groups,
+    fed by the session lifecycle events so that each scheduling pass only reloads
+    the sessions changed since the previous pass.
+
+    Since the event broadcasts may be lost (e.g., upon Redis reconnection) and the view
+    may miss changes made without events, it periodically falls back to a full reload.
+    Stale pending sessions are safe to keep because the dispatcher re-checks their status
+    while locking them before scheduling.
+    """
+
+    full_sync_interval: float
+    _pending: Dict[uuid.UUID, Tuple[datetime, PendingSession]]
+    _existing: Dict[uuid.UUID, ExistingSession]
+    _dirty_session_ids: Set[uuid.UUID]
+    _last_full_sync: Optional[float]
+    _sync_lock: asyncio.Lock
+
+    def __init__(self, full_sync_interval: float = 60.0) -> None:
+        self.full_sync_interval = full_sync_interval
+        self._pending = {}
+        self._existing = {}
+        self._dirty_session_ids = set()
+        self._last_full_sync = None
+        self._sync_lock = asyncio.Lock()
+
+    def mark_dirty(self, *session_ids: uuid.UUID) -> None:
+        self._dirty_session_ids.update(session_ids)
+
+    def invalidate(self) -> None:
+        self._last_full_sync = None
+
+    async def sync(self, db_conn: SAConnection) -> None:
+        # Serialize the concurrent passes of different scaling groups sharing this view.
+        async with self._sync_lock:
+            await self._sync(db_conn)
+
+    async def _sync(self, db_conn: SAConnection) -> None:
+        now = time.monotonic()
+        if self._last_full_sync is None or now - self._last_full_sync >= self.full_sync_interval:
+            self._dirty_session_ids.clear()
+            self._pending = {
+                sess.session_id: (created_at, sess)
+                for created_at, sess in await _query_pending_sessions(db_conn, true())
+            }
+            self._existing = {
+                sess.session_id: sess
+                for sess in await _query_existing_sessions(db_conn, true())
+            }
+            self._last_full_sync = now
+            return
+        if not self._dirty_session_ids:
+            return
+        # Events arriving during the reload are kept for the next sync.
+        session_ids, self._dirty_session_ids = self._dirty_session_ids, set()
+        for session_id in session_ids:
+            self._pending.pop(session_id, None)
+            self._existing.pop(session_id, None)
+        for created_at, pending_sess in await _query_pending_sessions(
+            db_conn, kernels.c.session_id.in_(session_ids),
+        ):
+            self._pending[pending_sess.session_id] = (created_at, pending_sess)
+        for existing_sess in await _query_existing_sessions(
+            db_conn, kernels.c.session_id.in_(session_ids),
+        ):
+            self._existing[existing_sess.session_id] = existing_sess
+
+    def list_pending_sessions(self, sgroup_name: str) -> List[PendingSession]:
+        items = [
+            item for item in self._pending.values()
+            if item[1].scaling_group in (sgroup_name, None)
+        ]
+        items.sort(key=lambda item: item[0])
+        # Return copies since the scheduling pass updates some fields.
+        return [attr.evolve(sess, target_sgroup_names=[]) for _, sess in items]
+
+    def list_existing_sessions(self, sgroup_name: str) -> List[ExistingSession]:
+        return [
+            sess for sess in self._existing.values()
+            if sess.scaling_group == sgroup_name
+        ]
+
+
 class SchedulerDispatcher(aobject):
 
     config_server: ConfigServer
     registry: AgentRegistry
+    session_view: Optional[SessionQueueView]
+    _running_sgroups: Set[str]
+    _rerun_sgroups: Set[str]
+
+    session_view_events = (
+        'session_enqueued',
+        'session_scheduled',
+        'session_started',
+        'session_cancelled',
+        'session_terminated',
+    )
 
     tick_script = '''
     local key_last_sync = KEYS[1]
@@ -140,6 +268,15 @@ class SchedulerDispatcher(aobject):
         self.registry = registry
         self.dbpool = registry.dbpool
         self.pidx = pidx
+        self.session_view = None
+        if config['manager']['scheduler-incremental']:
+            self.session_view = SessionQueueView()
+        self._running_sgroups = set()
+        self._rerun_sgroups = set()
+        self.start_executor = SessionStartExecutor(
+            config['manager']['session-start-concurrency'],
+            config['manager']['session-start-concurrency-per-agent'],
+        )
 
     async def __ainit__(self) -> None:
         log.info('Session scheduler started')
@@ -148,6 +285,11 @@ class SchedulerDispatcher(aobject):
         self.registry.event_dispatcher.consume('session_terminated', None, self.schedule)
         self.registry.event_dispatcher.consume('instance_started', None, self.schedule)
         self.registry.event_dispatcher.consume('do_schedule', None, self.schedule)
+        if self.session_view is not None:
+            # All manager processes keep their views up-to-date by subscribing the broadcasts,
+            # while the scheduling triggers are consumed by only one of them.
+            for event_name in self.session_view_events:
+                self.registry.event_dispatcher.subscribe(event_name, None, self.update_session_view)
         # TODO: add events for resource configuration changes and subscribe them here.
         self.lock_manager = aioredlock.Aioredlock(
             [
@@ -166,6 +308,7 @@ class SchedulerDispatcher(aobject):
         log.info('Session scheduler stopped')
         self.tick_task.cancel()
         await self.tick_task
+        await self.start_executor.close()
 
     async def generate_scheduling_tick(self) -> None:
         """
@@ -202,218 +345,132 @@ class SchedulerDispatcher(aobject):
 
     async def schedule(self, ctx: object, agent_id: AgentId, event_name: str,
                        *args, **kwargs) -> None:
+        async with self.dbpool.acquire() as db_conn:
+            target_sgroups = await _resolve_target_sgroups(db_conn, agent_id, event_name, args)
+        if not target_sgroups:
+            log.debug('schedule(ev:{}): no scaling groups to schedule', event_name)
+            return
+        # Each scaling group has its own set of agents and pending sessions,
+        # so we can schedule them concurrently under separate locks.
+        sgroup_names = sorted(target_sgroups)
+        results = await asyncio.gather(*[
+            self._schedule_sgroup(sgroup_name) for sgroup_name in sgroup_names
+        ], return_exceptions=True)
+        for sgroup_name, result in zip(sgroup_names, results):
+            if isinstance(result, Exception):
+                log.error('schedule(sgroup:{}): unexpected error', sgroup_name, exc_info=result)
+
+    async def update_session_view(self, ctx: object, agent_id: AgentId, event_name: str,
+                                  raw_session_id: str, *args) -> None:
+        if self.session_view is not None:
+            self.session_view.mark_dirty(uuid.UUID(raw_session_id))
+
+    async def _schedule_sgroup(self, sgroup_name: str) -> None:
+        if sgroup_name in self._running_sgroups:
+            # Coalesce the events arriving during a running pass into a single follow-up pass.
+            self._rerun_sgroups.add(sgroup_name)
+            return
+        self._running_sgroups.add(sgroup_name)
+        try:
+            while True:
+                self._rerun_sgroups.discard(sgroup_name)
+                rerun_requested = await self._schedule_sgroup_once(sgroup_name)
+                if not (rerun_requested or sgroup_name in self._rerun_sgroups):
+                    break
+                log.debug('schedule(sgroup:{}): running a follow-up pass', sgroup_name)
+        finally:
+            self._running_sgroups.discard(sgroup_name)
+
+    async def _schedule_sgroup_once(self, sgroup_name: str) -> bool:
+        """
+        Run a scheduling pass for the scaling group and return if another manager process
+        has requested a follow-up pass while this pass was running.
+        """
+        rerun_key = f'manager.scheduler.{sgroup_name}.rerun'
         try:
-            lock = await self.lock_manager.lock('manager.scheduler')
+            lock = await self.lock_manager.lock(f'manager.scheduler.{sgroup_name}')
             async with lock:
-                await self.schedule_impl()
+                await self.schedule_impl(sgroup_name)
+                num_deleted = await redis.execute_with_retries(
+                    lambda: self.registry.redis_live.delete(rerun_key))
+                return num_deleted > 0
         except aioredlock.LockError:
-            log.debug('schedule(): temporary locking failure; will be retried.')
-            # The dispatcher will try the next chance.
+            log.debug('schedule(sgroup:{}): temporary locking failure; will be retried.', sgroup_name)
+            # Let the lock holder run a follow-up pass after finishing its current pass.
+            # If it has already finished, the dispatcher will try the next chance.
+            await redis.execute_with_retries(
+                lambda: self.registry.redis_live.set(rerun_key, b'1', expire=60))
+            return False
 
-    async def schedule_impl(self) -> None:
-        log.debug('schedule(): triggered')
+    async def schedule_impl(self, sgroup_name: str) -> None:
+        log.debug('schedule(sgroup:{}): triggered', sgroup_name)
         known_slot_types = await self.config_server.get_resource_slots()
         sched_ctx = SchedulingContext(
             registry=self.registry,
             known_slot_types=known_slot_types,
         )
 
-        log_fmt = 'schedule(s:{}, type:{}, name:{}, ak:{}, cluster_mode:{}): '
-        start_task_args: List[Tuple[
-            Tuple[Any, ...],
-            SchedulingContext,
-            Tuple[PendingSession, List[KernelAgentBinding]],
-            List[Union[Exception, PredicateResult]],
-        ]]
-        start_task_args = []
+        scheduled_sessions: List[ScheduledSession] = []
+        # The sessions whose status has been changed or found outdated in this pass.
+        touched_session_ids: Set[uuid.UUID] = set()
 
         async def _schedule_in_sgroup(db_conn: SAConnection, sgroup_name: str) -> None:
             async with db_conn.begin():
                 scheduler = await self._load_scheduler(db_conn, sgroup_name)
-                pending_sessions = await _list_pending_sessions(db_conn, sgroup_name)
-                existing_sessions = await _list_existing_sessions(db_conn, sgroup_name)
-            log.debug('running scheduler (sgroup:{}, pending:{}, existing:{})',
-                      sgroup_name, len(pending_sessions), len(existing_sessions))
-            zero = ResourceSlot()
-            while len(pending_sessions) > 0:
-                async with db_conn.begin():
-                    candidate_agents = await _list_agents_by_sgroup(db_conn, sgroup_name)
-                    total_capacity = sum((ag.available_slots for ag in candidate_agents), zero)
-
-                picked_session_id = scheduler.pick_session(
-                    total_capacity,
-                    pending_sessions,
-                    existing_sessions,
-                )
-                if picked_session_id is None:
-                    # no session is picked.
-                    # continue to next sgroup.
-                    return
-                for picked_idx, sess_ctx in enumerate(pending_sessions):
-                    if sess_ctx.session_id == picked_session_id:
-                        break
+                if self.session_view is not None:
+                    await self.session_view.sync(db_conn)
+                    pending_sessions = self.session_view.list_pending_sessions(sgroup_name)
+                    existing_sessions = self.session_view.list_existing_sessions(sgroup_name)
                 else:
-                    # no matching entry for picked session?
-                    raise RuntimeError('should not reach here')
-                sess_ctx = pending_sessions.pop(picked_idx)
-
-                log_args = (
-                    sess_ctx.session_id,
-                    sess_ctx.session_type,
-                    sess_ctx.session_name,
-                    sess_ctx.access_key,
-                    sess_ctx.cluster_mode,
+                    pending_sessions = await _list_pending_sessions(db_conn, sgroup_name)
+                    existing_sessions = await _list_existing_sessions(db_conn, sgroup_name)
+                snapshot = SchedulingSnapshot(
+                    sgroup_name,
+                    await _list_agents_by_sgroup(db_conn, sgroup_name),
                 )
-                log.debug(log_fmt + 'try-scheduling', *log_args)
-                session_agent_binding: Tuple[PendingSession, List[KernelAgentBinding]]
-
-                async with db_conn.begin():
-                    predicates: Sequence[Awaitable[PredicateResult]] = [
-                        check_reserved_batch_session(db_conn, sched_ctx, sess_ctx),
-                        check_concurrency(db_conn, sched_ctx, sess_ctx),
-                        check_dependencies(db_conn, sched_ctx, sess_ctx),
-                        check_keypair_resource_limit(db_conn, sched_ctx, sess_ctx),
-                        check_group_resource_limit(db_conn, sched_ctx, sess_ctx),
-                        check_domain_resource_limit(db_conn, sched_ctx, sess_ctx),
-                        check_scaling_group(db_conn, sched_ctx, sess_ctx),
-                    ]
-                    check_results: List[Union[Exception, PredicateResult]] = []
-                    for check in predicates:
-                        try:
-                            check_results.append(await check)
-                        except Exception as e:
-                            log.exception(log_fmt + 'predicate-error', *log_args)
-                            check_results.append(e)
-                    has_failure = False
-                    for result in check_results:
-                        if isinstance(result, Exception):
-                            has_failure = True
-                            continue
-                        if not result.passed:
-                            has_failure = True
-                    if has_failure:
-                        log.debug(log_fmt + 'predicate-checks-failed', *log_args)
-                        await _invoke_failure_callbacks(
-                            db_conn, sched_ctx, sess_ctx, check_results,
-                        )
-                        # Predicate failures are *NOT* permanent errors.
-                        # We need to retry the scheduling afterwards.
-                        continue
-
-                    if sess_ctx.cluster_mode == ClusterMode.SINGLE_NODE:
-                        # Assign agent resource per session.
-                        try:
-                            agent_id = scheduler.assign_agent_for_session(candidate_agents, sess_ctx)
-                            if agent_id is None:
-                                raise InstanceNotAvailable
-                            agent_alloc_ctx = await _reserve_agent(
-                                sched_ctx, db_conn, sgroup_name, agent_id, sess_ctx.requested_slots,
-                            )
-                        except InstanceNotAvailable:
-                            log.debug(log_fmt + 'no-available-instances', *log_args)
-                            await _invoke_failure_callbacks(
-                                db_conn, sched_ctx, sess_ctx, check_results,
-                            )
-                            raise
-                        except Exception:
-                            log.exception(log_fmt + 'unexpected-error, during agent allocation',
-                                          *log_args)
-                            await _invoke_failure_callbacks(
-                                db_conn, sched_ctx, sess_ctx, check_results,
-                            )
-                            raise
-                        query = kernels.update().values({
-                            'agent': agent_alloc_ctx.agent_id,
-                            'agent_addr': agent_alloc_ctx.agent_addr,
-                            'scaling_group': sgroup_name,
-                            'status': KernelStatus.PREPARING,
-                            'status_info': 'scheduled',
-                            'status_changed': datetime.now(tzutc()),
-                        }).where(kernels.c.session_id == sess_ctx.session_id)
-                        await db_conn.execute(query)
-                        session_agent_binding = (
-                            sess_ctx,
-                            [
-                                KernelAgentBinding(kernel, agent_alloc_ctx)
-                                for kernel in sess_ctx.kernels
-                            ],
-                        )
-                    elif sess_ctx.cluster_mode == ClusterMode.MULTI_NODE:
-                        # Assign agent resource per kernel in the session.
-                        agent_query_extra_conds = None
-                        if len(sess_ctx.kernels) >= 2:
-                            # We should use agents that supports overlay networking.
-                            agent_query_extra_conds = (agents.c.clusterized)
-                        kernel_agent_bindings = []
-                        for kernel in sess_ctx.kernels:
-                            try:
-                                agent_id = scheduler.assign_agent_for_kernel(candidate_agents, kernel)
-                                if agent_id is None:
-                                    raise InstanceNotAvailable
-                                agent_alloc_ctx = await _reserve_agent(
-                                    sched_ctx, db_conn, sgroup_name, agent_id, kernel.requested_slots,
-                                    extra_conds=agent_query_extra_conds,
-                                )
-                            except InstanceNotAvailable:
-                                log.debug(log_fmt + 'no-available-instances', *log_args)
-                                await _invoke_failure_callbacks(
-                                    db_conn, sched_ctx, sess_ctx, check_results,
-                                )
-                                # continue
-                                raise
-                            except Exception:
-                                log.exception(log_fmt + 'unexpected-error, during agent allocation',
-                                              *log_args)
-                                await _invoke_failure_callbacks(
-                                    db_conn, sched_ctx, sess_ctx, check_results,
-                                )
-                                # continue
-                                raise
-                            # TODO: if error occurs for one kernel, should we cancel all others?
-                            query = kernels.update().values({
-                                'agent': agent_alloc_ctx.agent_id,
-                                'agent_addr': agent_alloc_ctx.agent_addr,
-                                'scaling_group': sgroup_name,
-                                'status': KernelStatus.PREPARING,
-                                'status_info': 'scheduled',
-                                'status_changed': datetime.now(tzutc()),
-                            }).where(kernels.c.id == kernel.kernel_id)
-                            await db_conn.execute(query)
-                            kernel_agent_bindings.append(KernelAgentBinding(kernel, agent_alloc_ctx))
-                        session_agent_binding = (sess_ctx, kernel_agent_bindings)
-                    start_task_args.append(
-                        (
-                            log_args,
-                            sched_ctx,
-                            session_agent_binding,
-                            check_results,
-                        )
-                    )
+                scheduler.capacity_matrix = snapshot.capacity
+                sgroup_sched_ctx = attr.evolve(
+                    sched_ctx,
+                    predicate_snapshot=await preload_predicate_snapshot(
+                        db_conn, sched_ctx, pending_sessions,
+                    ),
+                )
+            log.debug('running scheduler (sgroup:{}, pending:{}, existing:{}, agents:{})',
+                      sgroup_name, len(pending_sessions), len(existing_sessions),
+                      len(snapshot.agents))
+            try:
+                await schedule_pending_sessions(
+                    db_conn, sgroup_sched_ctx, scheduler, snapshot,
+                    pending_sessions, existing_sessions,
+                    scheduled_sessions=scheduled_sessions,
+                    touched_session_ids=touched_session_ids,
+                )
+            finally:
+                if self.session_view is not None:
+                    self.session_view.mark_dirty(*touched_session_ids)
 
         # We use short transaction blocks to prevent deadlock timeouts under heavy loads
-        # because this scheduling handler will be executed by only one process.
-        # It is executed under a globally exclusive context using aioredlock.
+        # because this scheduling handler will be executed by only one process per scaling group.
+        # It is executed under a per-scaling-group exclusive context using aioredlock.
         async with self.dbpool.acquire() as db_conn:
-            query = (
-                sa.select([agents.c.scaling_group])
-                .select_from(agents)
-                .where(agents.c.status == AgentStatus.ALIVE)
-                .group_by(agents.c.scaling_group)
-            )
-            schedulable_scaling_groups = [
-                row.scaling_group async for row in db_conn.execute(query)
-            ]
-            for sgroup_name in schedulable_scaling_groups:
+            try:
                 await _schedule_in_sgroup(db_conn, sgroup_name)
+            except InstanceNotAvailable:
+                # The pass ends at the first session without available agents
+                # in the non-backfill mode, but the sessions already scheduled
+                # (committed as PREPARING) in this pass must still be started.
+                log.debug('schedule(sgroup:{}): no available instances; '
+                          'starting {} scheduled sessions',
+                          sgroup_name, len(scheduled_sessions))
 
         async def start_session(
-            log_args,
             sched_ctx: SchedulingContext,
             session_agent_binding: Tuple[PendingSession, List[KernelAgentBinding]],
-            check_results,
+            check_results: List[Union[Exception, PredicateResult]],
         ) -> None:
-            log.debug(log_fmt + 'try-starting', *log_args)
             sess_ctx = session_agent_binding[0]
+            log_args = _get_log_args(sess_ctx)
+            log.debug(log_fmt + 'try-starting', *log_args)
             await self.registry.event_dispatcher.produce_event(
                 'session_scheduled',
                 (str(sess_ctx.session_id), ),
@@ -425,9 +482,12 @@ class SchedulerDispatcher(aobject):
             except Exception as e:
                 # TODO: handle exception as "multi-error" and rollback only the agents that are affected
                 log.error(log_fmt + 'failed-starting', *log_args, exc_info=e)
-                async with self.dbpool.acquire(), db_conn.begin():
-                    await _unreserve_agent_slots(db_conn, session_agent_binding)
+                async with self.dbpool.acquire() as db_conn, db_conn.begin():
                     await _invoke_failure_callbacks(db_conn, sched_ctx, sess_ctx, check_results)
+                    await apply_occupancy_deltas(
+                        db_conn, [_session_occupancy(sess_ctx)], release=True,
+                    )
+                    await _unreserve_agent_slots(db_conn, session_agent_binding)
                     query = kernels.update().values({
                         'status': KernelStatus.CANCELLED,
                         'status_info': 'failed-to-start',
@@ -440,13 +500,22 @@ class SchedulerDispatcher(aobject):
                 )
             else:
                 log.info(log_fmt + 'started', *log_args)
-                async with self.dbpool.acquire(), db_conn.begin():
+                async with self.dbpool.acquire() as db_conn, db_conn.begin():
                     await _invoke_success_callbacks(db_conn, sched_ctx, sess_ctx, check_results)
 
-        start_coros = []
-        for argset in start_task_args:
-            start_coros.append(start_session(*argset))
-        await asyncio.gather(*start_coros, return_exceptions=True)
+        # Run the starts under the concurrency limits shared with the other scaling groups.
+        start_futures = []
+        for scheduled in scheduled_sessions:
+            sess_ctx, kernel_agent_bindings = scheduled.session_agent_binding
+            start_futures.append(self.start_executor.submit(
+                functools.partial(
+                    start_session,
+                    scheduled.sched_ctx, scheduled.session_agent_binding, scheduled.check_results,
+                ),
+                session_type=sess_ctx.session_type,
+                agent_ids={binding.agent_alloc_ctx.agent_id for binding in kernel_agent_bindings},
+            ))
+        await asyncio.gather(*start_futures, return_exceptions=True)
 
     async def _load_scheduler(
         self,
@@ -463,13 +532,117 @@ class SchedulerDispatcher(aobject):
         return load_scheduler(scheduler_name, self.config['plugins']['scheduler'])
 
 
+async def _list_schedulable_sgroups(db_conn: SAConnection) -> Set[str]:
+    query = (
+        sa.select([agents.c.scaling_group])
+        .select_from(agents)
+        .where(agents.c.status == AgentStatus.ALIVE)
+        .group_by(agents.c.scaling_group)
+    )
+    return {row['scaling_group'] async for row in db_conn.execute(query)}
+
+
+async def _resolve_target_sgroups(
+    db_conn: SAConnection,
+    agent_id: AgentId,
+    event_name: str,
+    args: Sequence[Any],
+) -> Set[str]:
+    """
+    Determine the scaling groups whose scheduling decisions may be affected by the given event,
+    limited to those having alive agents.
+    Falls back to all schedulable scaling groups when the event does not tell.
+    """
+    schedulable_sgroups = await _list_schedulable_sgroups(db_conn)
+    query: Optional[sa.sql.Select] = None
+    if event_name == 'instance_started':
+        query = (
+            sa.select([agents.c.scaling_group])
+            .select_from(agents)
+            .where(agents.c.id == agent_id)
+        )
+    elif event_name == 'session_enqueued' and args:
+        session_id = uuid.UUID(args[0])
+        query = (
+            sa.select([kernels.c.scaling_group])
+            .select_from(kernels)
+            .where(kernels.c.session_id == session_id)
+        )
+    elif event_name == 'session_terminated' and args:
+        session_id = uuid.UUID(args[0])
+        # The released resources may unblock pending sessions of the same owner
+        # in other scaling groups (e.g., keypair concurrency limits).
+        session_owner = (
+            sa.select([kernels.c.access_key])
+            .select_from(kernels)
+            .where(kernels.c.session_id == session_id)
+        )
+        query = (
+            sa.select([kernels.c.scaling_group])
+            .select_from(kernels)
+            .where(
+                (kernels.c.session_id == session_id) |
+                (
+                    (kernels.c.status == KernelStatus.PENDING) &
+                    (kernels.c.access_key.in_(session_owner))
+                )
+            )
+        )
+    if query is None:
+        return schedulable_sgroups
+    target_sgroups: Set[str] = set()
+    async for row in db_conn.execute(query.distinct()):
+        if row[0] is None:
+            # The session may be scheduled to any scaling group.
+            return schedulable_sgroups
+        target_sgroups.add(row[0])
+    return target_sgroups & schedulable_sgroups
+
+
+async def _lock_pending_session(
+    db_conn: SAConnection,
+    sess_ctx: PendingSession,
+) -> bool:
+    """
+    Lock the kernel rows of the given pending session in the current transaction
+    and check if they are still pending.
+    """
+    query = (
+        sa.select([kernels.c.id], for_update=True)
+        .select_from(kernels)
+        .where(
+            (kernels.c.session_id == sess_ctx.session_id) &
+            (kernels.c.status == KernelStatus.PENDING)
+        )
+    )
+    result = await db_conn.execute(query)
+    rows = await result.fetchall()
+    return len(rows) == len(sess_ctx.kernels)
+
+
 async def _list_pending_sessions(
     db_conn: SAConnection,
     sgroup_name: str,
 ) -> List[PendingSession]:
+    cond = (
+        (kernels.c.scaling_group == sgroup_name) |
+        (kernels.c.scaling_group.is_(None))
+    )
+    return [sess for _, sess in await _query_pending_sessions(db_conn, cond)]
+
+
+async def _query_pending_sessions(
+    db_conn: SAConnection,
+    cond: Any,
+) -> List[Tuple[datetime, PendingSession]]:
+    """
+    Load the pending sessions matching the given condition with their creation time,
+    in the order of creation.
+    """
     query = (
         sa.select([
             kernels.c.id,
+            kernels.c.created_at,
             kernels.c.status,
             kernels.c.image,
             kernels.c.cluster_mode,
@@ -502,18 +675,15 @@ async def _list_pending_sessions(
         ))
         .where(
             (kernels.c.status == KernelStatus.PENDING) &
-            (
-                (kernels.c.scaling_group == sgroup_name) |
-                (kernels.c.scaling_group.is_(None))
-            )
+            cond
         )
         .order_by(kernels.c.created_at)
     )
     # TODO: extend for multi-container sessions
-    items: MutableMapping[str, PendingSession] = {}
+    items: MutableMapping[str, Tuple[datetime, PendingSession]] = {}
     async for row in db_conn.execute(query):
-        if _session := items.get(row['session_id']):
-            session = _session
+        if _item := items.get(row['session_id']):
+            _, session = _item
         else:
             session = PendingSession(
                 kernels=[],
@@ -541,7 +711,7 @@ async def _list_pending_sessions(
                 startup_command=row['startup_command'],
                 preopen_ports=row['preopen_ports'],
             )
-            items[row['session_id']] = session
+            items[row['session_id']] = (row['created_at'], session)
         session.kernels.append(KernelInfo(
             kernel_id=row['id'],
             session_id=row['session_id'],
@@ -555,14 +725,25 @@ async def _list_pending_sessions(
             resource_opts=row['resource_opts'],
             requested_slots=row['occupied_slots'],
         ))
-        session.requested_slots += row['occupied_slots']  # type: ignore
         merge_resource(session.resource_opts, row['resource_opts'])  # type: ignore
+    # Sum up the kernel slots once per session instead of adding them one by one.
+    for _, session in items.values():
+        session.requested_slots = sum_resource_slots(
+            kernel.requested_slots for kernel in session.kernels
+        )
     return list(items.values())
 
 
 async def _list_existing_sessions(
     db_conn: SAConnection,
     sgroup: str,
+) -> List[ExistingSession]:
+    return await _query_existing_sessions(db_conn, kernels.c.scaling_group == sgroup)
+
+
+async def _query_existing_sessions(
+    db_conn: SAConnection,
+    cond: Any,
 ) -> List[ExistingSession]:
     query = (
         sa.select([
@@ -597,7 +778,7 @@ async def _list_existing_sessions(
         ))
         .where(
             (kernels.c.status.in_(AGENT_RESOURCE_OCCUPYING_KERNEL_STATUSES)) &
-            (kernels.c.scaling_group == sgroup)
+            cond
         )
         .order_by(kernels.c.created_at)
     )
@@ -641,7 +822,7 @@ async def _list_existing_sessions(
 async def _list_agents_by_sgroup(
     db_conn: SAConnection,
     sgroup_name: str,
-) -> Sequence[AgentContext]:
+) -> List[AgentContext]:
     query = (
         sa.select([
             agents.c.id,
@@ -649,7 +830,8 @@ async def _list_agents_by_sgroup(
             agents.c.scaling_group,
             agents.c.available_slots,
             agents.c.occupied_slots,
-        ], for_update=True)
+            agents.c.clusterized,
+        ])
         .select_from(agents)
         .where(
             (agents.c.status == AgentStatus.ALIVE) &
@@ -665,40 +847,278 @@ async def _list_agents_by_sgroup(
             row['scaling_group'],
             row['available_slots'],
             row['occupied_slots'],
+            row['clusterized'],
         )
         items.append(item)
     return items
 
 
-async def _reserve_agent(
-    sched_ctx: SchedulingContext,
+async def _commit_reservations(
     db_conn: SAConnection,
-    scaling_group: str,
-    agent_id: AgentId,
-    requested_slots: ResourceSlot,
-    extra_conds: Any = None,
-) -> AgentAllocationContext:
-    query = (
-        sa.select([agents.c.occupied_slots], for_update=True)
-        .select_from(agents)
-        .where(agents.c.id == agent_id))
-    if extra_conds is not None:
-        query = query.where(extra_conds)
-    current_occupied_slots = await db_conn.scalar(query)
-    query = (sa.update(agents)
-               .values({
-                   'occupied_slots': current_occupied_slots + requested_slots
-               })
-               .where(agents.c.id == agent_id))
-    await db_conn.execute(query)
-
-    # Get the agent address for later RPC calls
-    query = (sa.select([agents.c.addr])
-               .where(agents.c.id == agent_id))
-    agent_addr = await db_conn.scalar(query)
-    assert agent_addr is not None
-
-    return AgentAllocationContext(agent_id, agent_addr, scaling_group)
+    snapshot: SchedulingSnapshot,
+) -> None:
+    """
+    Apply the per-agent slot reservations accumulated in the snapshot
+    on top of the latest occupied_slots values in the database.
+
+    This is called in the transaction scheduling each session, so that the agents'
+    occupied slots are never seen without the kernels placed on them (e.g., by the
+    resource usage drift repair running concurrently).
+
+    We add the deltas to the current DB values instead of overwriting them with
+    the snapshot values because other handlers (e.g., kernel termination) may
+    have released some slots of the same agents during the scheduling pass.
+    """
+    if not snapshot.reserved_slots:
+        return
+    await apply_agent_slot_deltas(db_conn, snapshot.reserved_slots)
+    snapshot.reserved_slots.clear()
+
+
+async def _commit_scheduled_session(
+    db_conn: SAConnection,
+    snapshot: SchedulingSnapshot,
+    session_agent_binding: Tuple[PendingSession, List[KernelAgentBinding]],
+) -> None:
+    """
+    Write the agent assignment of the scheduled session with its occupancy and
+    the agent reservations, in the transaction scheduling the session.
+    """
+    sess_ctx, kernel_agent_bindings = session_agent_binding
+    now = datetime.now(tzutc())
+    if sess_ctx.cluster_mode == ClusterMode.SINGLE_NODE:
+        agent_alloc_ctx = kernel_agent_bindings[0].agent_alloc_ctx
+        query = kernels.update().values({
+            'agent': agent_alloc_ctx.agent_id,
+            'agent_addr': agent_alloc_ctx.agent_addr,
+            'scaling_group': snapshot.scaling_group,
+            'status': KernelStatus.PREPARING,
+            'status_info': 'scheduled',
+            'status_changed': now,
+        }).where(kernels.c.session_id == sess_ctx.session_id)
+        await db_conn.execute(query)
+    else:
+        per_kernel_updates: Dict[KernelId, Dict[str, Any]] = {
+            binding.kernel.kernel_id: {
+                'agent': binding.agent_alloc_ctx.agent_id,
+                'agent_addr': binding.agent_alloc_ctx.agent_addr,
+                'scaling_group': snapshot.scaling_group,
+                'status': KernelStatus.PREPARING,
+                'status_info': 'scheduled',
+                'status_changed': now,
+            }
+            for binding in kernel_agent_bindings
+        }
+        await execute_bulk_update(db_conn, kernels, kernels.c.id, per_kernel_updates)
+    await apply_occupancy_deltas(db_conn, [_session_occupancy(sess_ctx)])
+    await _commit_reservations(db_conn, snapshot)
+
+
+def _get_log_args(sess_ctx: PendingSession) -> Tuple[Any, ...]:
+    return (
+        sess_ctx.session_id,
+        sess_ctx.session_type,
+        sess_ctx.session_name,
+        sess_ctx.access_key,
+        sess_ctx.cluster_mode,
+    )
+
+
+async def schedule_pending_sessions(
+    db_conn: SAConnection,
+    sched_ctx: SchedulingContext,
+    scheduler: AbstractScheduler,
+    snapshot: SchedulingSnapshot,
+    pending_sessions: List[PendingSession],
+    existing_sessions: List[ExistingSession],
+    *,
+    scheduled_sessions: List[ScheduledSession],
+    touched_session_ids: Set[uuid.UUID],
+    lock_pending_session: Callable[
+        [SAConnection, PendingSession], Awaitable[bool],
+    ] = _lock_pending_session,
+    commit_scheduled_session: Callable[
+        [SAConnection, SchedulingSnapshot, Tuple[PendingSession, List[KernelAgentBinding]]],
+        Awaitable[None],
+    ] = _commit_scheduled_session,
+) -> None:
+    """
+    Run a scheduling pass over the pending sessions of a scaling group, checking the
+    predicates and assigning agents to each picked session in its own transaction.
+
+    The scheduled sessions and the sessions whose status has been changed are appended to
+    *scheduled_sessions* and *touched_session_ids*, which keep the progress made before
+    an :exc:`InstanceNotAvailable` error ending the pass in the non-backfill mode,
+    so that the caller can still start the sessions scheduled until then.
+    The database writes locking and assigning each session may be replaced via
+    *lock_pending_session* and *commit_scheduled_session* (e.g., by the simulator).
+    """
+    # In the backfill mode, the agents reserved for the blocked head session
+    # are excluded from the subsequent placements.
+    reservation: Optional[BackfillReservation] = None
+    schedulable_agents: Sequence[AgentContext] = snapshot.agents
+    while len(pending_sessions) > 0:
+        picked_session_id = scheduler.pick_session(
+            snapshot.total_capacity,
+            pending_sessions,
+            existing_sessions,
+        )
+        if picked_session_id is None:
+            # no session is picked.
+            # continue to next sgroup.
+            return
+        for picked_idx, sess_ctx in enumerate(pending_sessions):
+            if sess_ctx.session_id == picked_session_id:
+                break
+        else:
+            # no matching entry for picked session?
+            raise RuntimeError('should not reach here')
+        sess_ctx = pending_sessions.pop(picked_idx)
+
+        log_args = _get_log_args(sess_ctx)
+        if reservation is not None and not may_fit_into(scheduler, schedulable_agents, sess_ctx):
+            log.debug(log_fmt + 'not-backfilled', *log_args)
+            continue
+        log.debug(log_fmt + 'try-scheduling', *log_args)
+        session_agent_binding: Tuple[PendingSession, List[KernelAgentBinding]]
+
+        try:
+            async with db_conn.begin(), snapshot.begin():
+                if not await lock_pending_session(db_conn, sess_ctx):
+                    # Sessions without a designated scaling group are visible to
+                    # all scaling groups, which may be scheduled concurrently.
+                    log.debug(log_fmt + 'already-scheduled-elsewhere', *log_args)
+                    touched_session_ids.add(sess_ctx.session_id)
+                    continue
+                predicates: Sequence[Awaitable[PredicateResult]] = [
+                    check_reserved_batch_session(db_conn, sched_ctx, sess_ctx),
+                    check_concurrency(db_conn, sched_ctx, sess_ctx),
+                    check_dependencies(db_conn, sched_ctx, sess_ctx),
+                    check_keypair_resource_limit(db_conn, sched_ctx, sess_ctx),
+                    check_group_resource_limit(db_conn, sched_ctx, sess_ctx),
+                    check_domain_resource_limit(db_conn, sched_ctx, sess_ctx),
+                    check_scaling_group(db_conn, sched_ctx, sess_ctx),
+                ]
+                check_results: List[Union[Exception, PredicateResult]] = []
+                for check in predicates:
+                    try:
+                        check_results.append(await check)
+                    except Exception as e:
+                        log.exception(log_fmt + 'predicate-error', *log_args)
+                        check_results.append(e)
+                has_failure = False
+                for result in check_results:
+                    if isinstance(result, Exception):
+                        has_failure = True
+                        continue
+                    if not result.passed:
+                        has_failure = True
+                if has_failure:
+                    log.debug(log_fmt + 'predicate-checks-failed', *log_args)
+                    await _invoke_failure_callbacks(
+                        db_conn, sched_ctx, sess_ctx, check_results,
+                    )
+                    # Predicate failures are *NOT* permanent errors.
+                    # We need to retry the scheduling afterwards.
+                    continue
+
+                if sess_ctx.cluster_mode == ClusterMode.SINGLE_NODE:
+                    # Assign agent resource per session.
+                    try:
+                        agent_id = scheduler.assign_agent_for_session(
+                            schedulable_agents, sess_ctx,
+                        )
+                        if agent_id is None:
+                            raise InstanceNotAvailable
+                        agent_alloc_ctx = snapshot.reserve(agent_id, sess_ctx.requested_slots)
+                    except InstanceNotAvailable:
+                        log.debug(log_fmt + 'no-available-instances', *log_args)
+                        await _invoke_failure_callbacks(
+                            db_conn, sched_ctx, sess_ctx, check_results,
+                        )
+                        raise
+                    except Exception:
+                        log.exception(log_fmt + 'unexpected-error, during agent allocation',
+                                      *log_args)
+                        await _invoke_failure_callbacks(
+                            db_conn, sched_ctx, sess_ctx, check_results,
+                        )
+                        raise
+                    session_agent_binding = (
+                        sess_ctx,
+                        [
+                            KernelAgentBinding(kernel, agent_alloc_ctx)
+                            for kernel in sess_ctx.kernels
+                        ],
+                    )
+                elif sess_ctx.cluster_mode == ClusterMode.MULTI_NODE:
+                    # Assign agent resource per kernel in the session.
+                    candidate_agents: Sequence[AgentContext] = schedulable_agents
+                    if len(sess_ctx.kernels) >= 2:
+                        # We should use agents that supports overlay networking.
+                        candidate_agents = [ag for ag in schedulable_agents if ag.clusterized]
+                    kernel_agent_bindings = []
+                    for kernel in sess_ctx.kernels:
+                        try:
+                            agent_id = scheduler.assign_agent_for_kernel(
+                                candidate_agents, kernel,
+                            )
+                            if agent_id is None:
+                                raise InstanceNotAvailable
+                            agent_alloc_ctx = snapshot.reserve(agent_id, kernel.requested_slots)
+                        except InstanceNotAvailable:
+                            log.debug(log_fmt + 'no-available-instances', *log_args)
+                            await _invoke_failure_callbacks(
+                                db_conn, sched_ctx, sess_ctx, check_results,
+                            )
+                            # continue
+                            raise
+                        except Exception:
+                            log.exception(log_fmt + 'unexpected-error, during agent allocation',
+                                          *log_args)
+                            await _invoke_failure_callbacks(
+                                db_conn, sched_ctx, sess_ctx, check_results,
+                            )
+                            # continue
+                            raise
+                        # TODO: if error occurs for one kernel, should we cancel all others?
+                        kernel_agent_bindings.append(KernelAgentBinding(kernel, agent_alloc_ctx))
+                    session_agent_binding = (sess_ctx, kernel_agent_bindings)
+                await commit_scheduled_session(db_conn, snapshot, session_agent_binding)
+                assert sched_ctx.predicate_snapshot is not None
+                sched_ctx.predicate_snapshot.add_occupancy(sess_ctx)
+                touched_session_ids.add(sess_ctx.session_id)
+                scheduled_sessions.append(
+                    ScheduledSession(sched_ctx, session_agent_binding, check_results)
+                )
+
+        except InstanceNotAvailable:
+            if not scheduler.backfill:
+                raise
+            if reservation is None:
+                candidate_agents = snapshot.agents
+                if (
+                    sess_ctx.cluster_mode == ClusterMode.MULTI_NODE and
+                    len(sess_ctx.kernels) >= 2
+                ):
+                    candidate_agents = [ag for ag in snapshot.agents if ag.clusterized]
+                reservation = reserve_agents_for_blocked_session(
+                    scheduler, candidate_agents, sess_ctx,
+                )
+                if reservation is not None:
+                    log.debug(log_fmt + 'blocked, backfilling others except agents {}',
+                              *log_args, sorted(reservation.agent_ids))
+                    schedulable_agents = reservation.exclude_from(snapshot.agents)
+            else:
+                log.debug(log_fmt + 'not-backfilled', *log_args)
+            # Keep placing the subsequent sessions.
+            continue
+
+
+def _session_occupancy(
+    sess_ctx: PendingSession,
+) -> Tuple[AccessKey, uuid.UUID, str, ResourceSlot]:
+    return (sess_ctx.access_key, sess_ctx.group_id, sess_ctx.domain_name, sess_ctx.requested_slots)
 
 
 async def _unreserve_agent_slots(
@@ -707,25 +1127,16 @@ async def _unreserve_agent_slots(
 ) -> None:
     # Un-reserve agent slots, using the db transaction of the current invocation context.
     keyfunc = lambda item: item.agent_alloc_ctx.agent_id
-    for agent_id, kernel_agent_bindings in itertools.groupby(
-        sorted(session_agent_binding[1], key=keyfunc), key=keyfunc
-    ):
-        per_agent_requested_slots = sum(
+    per_agent_requested_slots = {
+        agent_id: sum(
             (binding.kernel.requested_slots for binding in kernel_agent_bindings),
             start=ResourceSlot(),
         )
-        query = (
-            sa.select([agents.c.occupied_slots], for_update=True)
-            .select_from(agents)
-            .where(agents.c.id == agent_id))
-        current_occupied_slots = await db_conn.scalar(query)
-        query = (
-            sa.update(agents)
-            .values({
-                'occupied_slots': current_occupied_slots - per_agent_requested_slots
-            })
-            .where(agents.c.id == agent_id))
-        await db_conn.execute(query)
+        for agent_id, kernel_agent_bindings in itertools.groupby(
+            sorted(session_agent_binding[1], key=keyfunc), key=keyfunc
+        )
+    }
+    await apply_agent_slot_deltas(db_conn, per_agent_requested_slots, release=True)
 
 
 async def _invoke_success_callbacks(
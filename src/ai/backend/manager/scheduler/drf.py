@@ -24,6 +24,7 @@ from . import (
     ExistingSession,
     KernelInfo,
 )
+from .capacity import AgentSelectionStrategy
 
 log = BraceStyleAdapter(logging.getLogger('ai.backend.manager.scheduler'))
 
@@ -32,10 +33,25 @@ class DRFScheduler(AbstractScheduler):
 
     per_user_dominant_share: Dict[AccessKey, Decimal]
     total_capacity: ResourceSlot
+    agent_selection: AgentSelectionStrategy
+    _existing_shares_loaded: bool
 
     def __init__(self, config: Mapping[str, Any]) -> None:
         super().__init__(config)
         self.per_user_dominant_share = defaultdict(lambda: Decimal(0))
+        self._existing_shares_loaded = False
+        self.agent_selection = AgentSelectionStrategy(
+            config.get('agent-selection', AgentSelectionStrategy.MOST_AVAILABLE))
+
+    def _get_dominant_share(self, slots: ResourceSlot) -> Decimal:
+        dominant_share = Decimal(0)
+        for slot, value in slots.items():
+            slot_cap = Decimal(self.total_capacity.get(slot, 0))
+            if slot_cap == 0 or Decimal(value) <= dominant_share * slot_cap:
+                # Skip the division if this slot cannot raise the dominant share.
+                continue
+            dominant_share = Decimal(value) / slot_cap
+        return dominant_share
 
     def pick_session(
         self,
@@ -46,18 +62,14 @@ class DRFScheduler(AbstractScheduler):
         self.total_capacity = total_capacity
 
         # Calculate the initial dominant shares of all users.
-        for existing_sess in existing_sessions:
-            dominant_share = Decimal(0)
-            self.total_capacity.sync_keys(existing_sess.occupying_slots)
-            for slot, value in existing_sess.occupying_slots.items():
-                slot_cap = Decimal(self.total_capacity[slot])
-                if slot_cap == 0:
-                    continue
-                slot_share = Decimal(value) / slot_cap
-                if dominant_share < slot_share:
-                    dominant_share = slot_share
-            if self.per_user_dominant_share[existing_sess.access_key] < dominant_share:
-                self.per_user_dominant_share[existing_sess.access_key] = dominant_share
+        # The existing sessions do not change within a scheduling pass (a scheduler instance),
+        # so it is done only once even when many sessions are picked in the backfill mode.
+        if not self._existing_shares_loaded:
+            for existing_sess in existing_sessions:
+                dominant_share = self._get_dominant_share(existing_sess.occupying_slots)
+                if self.per_user_dominant_share[existing_sess.access_key] < dominant_share:
+                    self.per_user_dominant_share[existing_sess.access_key] = dominant_share
+            self._existing_shares_loaded = True
         log.debug('per-user dominant share: {}', dict(self.per_user_dominant_share))
 
         # Find who has the least dominant share among the pending session.
@@ -91,11 +103,8 @@ class DRFScheduler(AbstractScheduler):
         # In such case, we just skip updating self.per_user_dominant_share state
         # and the scheduler dispatcher continues to pick another session within the same scaling group.
 
-        possible_agents = []
-        for agent in agents:
-            remaining_slots = agent.available_slots - agent.occupied_slots
-            if remaining_slots >= requested_slots:
-                possible_agents.append(agent)
+        matrix, indices = self.get_capacity_matrix(agents)
+        possible_agents = matrix.fits(requested_slots, indices)
 
         if possible_agents:
             # We have one or more agents that can host the picked session.
@@ -103,22 +112,15 @@ class DRFScheduler(AbstractScheduler):
             # Update the dominant share.
             # This is required to use to the latest dominant share information
             # when iterating over multiple pending sessions in a single scaling group.
-            dominant_share_from_request = Decimal(0)
-            for slot, value in requested_slots.items():
-                self.total_capacity.sync_keys(requested_slots)
-                slot_cap = Decimal(self.total_capacity[slot])
-                if slot_cap == 0:
-                    continue
-                slot_share = Decimal(value) / slot_cap
-                if dominant_share_from_request < slot_share:
-                    dominant_share_from_request = slot_share
+            dominant_share_from_request = self._get_dominant_share(requested_slots)
             if self.per_user_dominant_share[access_key] < dominant_share_from_request:
                 self.per_user_dominant_share[access_key] = dominant_share_from_request
 
             # Choose the agent.
-            chosen_agent = \
-                max(possible_agents, key=lambda a: a.available_slots)
-            return chosen_agent.agent_id
+            return matrix.select(
+                possible_agents, requested_slots, self.agent_selection,
+                penalize_extra_slots=False,
+            )
 
         return None
 
@@ -1,11 +1,9 @@
 from __future__ import annotations
 
-from decimal import Decimal
 from typing import (
     Any, Optional,
     Sequence,
     Mapping,
-    Tuple,
 )
 
 from ai.backend.common.types import (
@@ -20,60 +18,30 @@ from . import (
     ExistingSession,
     KernelInfo,
 )
+from .capacity import AgentSelectionStrategy
 
 
-def key_by_requested_slots(
-    agent: AgentContext,
-    requested_slots: ResourceSlot,
-) -> Tuple[int, ResourceSlot]:
-    unused_slot_keys = set()
-    for k, v in requested_slots.items():
-        if v == Decimal(0):
-            unused_slot_keys.add(k)
-    num_extras = 0
-    for k, v in agent.available_slots.items():
-        if k in unused_slot_keys and v > Decimal(0):
-            num_extras += 1
-    # Put back agents with more extra slot types
-    # (e.g., accelerators)
-    # Also put front agents with exactly required slot types
-    return (-num_extras, agent.available_slots)
+class _BaseQueueSlotScheduler(AbstractScheduler):
+    """
+    The common agent assignment of the queue-ordered schedulers,
+    which differ only in the pending session to pick.
+    """
 
-
-class FIFOSlotScheduler(AbstractScheduler):
+    agent_selection: AgentSelectionStrategy
 
     def __init__(self, config: Mapping[str, Any]) -> None:
         super().__init__(config)
-
-    def pick_session(
-        self,
-        total_capacity: ResourceSlot,
-        pending_sessions: Sequence[PendingSession],
-        existing_sessions: Sequence[ExistingSession],
-    ) -> Optional[SessionId]:
-        # Just pick the first pending session.
-        return SessionId(pending_sessions[0].session_id)
+        self.agent_selection = AgentSelectionStrategy(
+            config.get('agent-selection', AgentSelectionStrategy.MOST_AVAILABLE))
 
     def _assign_agent(
         self,
         agents: Sequence[AgentContext],
         requested_slots: ResourceSlot,
     ) -> Optional[AgentId]:
-        possible_agents = []
-        for agent in agents:
-            remaining_slots = agent.available_slots - agent.occupied_slots
-            if remaining_slots >= requested_slots:
-                possible_agents.append(agent)
-        if possible_agents:
-            chosen_agent = max(
-                possible_agents,
-                key=lambda a: key_by_requested_slots(
-                    a,
-                    requested_slots,
-                )
-            )
-            return chosen_agent.agent_id
-        return None
+        matrix, indices = self.get_capacity_matrix(agents)
+        possible_agents = matrix.fits(requested_slots, indices)
+        return matrix.select(possible_agents, requested_slots, self.agent_selection)
 
     def assign_agent_for_session(
         self,
@@ -94,10 +62,7 @@ class FIFOSlotScheduler(AbstractScheduler):
         )
 
 
-class LIFOSlotScheduler(AbstractScheduler):
-
-    def __init__(self, config: Mapping[str, Any]) -> None:
-        super().__init__(config)
+class FIFOSlotScheduler(_BaseQueueSlotScheduler):
 
     def pick_session(
         self,
@@ -105,44 +70,17 @@ class LIFOSlotScheduler(AbstractScheduler):
         pending_sessions: Sequence[PendingSession],
         existing_sessions: Sequence[ExistingSession],
     ) -> Optional[SessionId]:
-        # Just pick the last pending session.
-        return SessionId(pending_sessions[-1].session_id)
+        # Just pick the first pending session.
+        return SessionId(pending_sessions[0].session_id)
 
-    def _assign_agent(
-        self,
-        agents: Sequence[AgentContext],
-        requested_slots: ResourceSlot,
-    ) -> Optional[AgentId]:
-        possible_agents = []
-        for agent in agents:
-            remaining_slots = agent.available_slots - agent.occupied_slots
-            if remaining_slots >= requested_slots:
-                possible_agents.append(agent)
-        if possible_agents:
-            chosen_agent = max(
-                possible_agents,
-                key=lambda a: key_by_requested_slots(
-                    a,
-                    requested_slots,
-                )
-            )
-            return chosen_agent.agent_id
-        return None
 
-    def assign_agent_for_session(
-        self,
-        agents: Sequence[AgentContext],
-        pending_session: PendingSession,
-    ) -> Optional[AgentId]:
-        return self._assign_agent(
-            agents, pending_session.requested_slots,
-        )
+class LIFOSlotScheduler(_BaseQueueSlotScheduler):
 
-    def assign_agent_for_kernel(
+    def pick_session(
         self,
-        agents: Sequence[AgentContext],
-        pending_kernel: KernelInfo,
-    ) -> Optional[AgentId]:
-        return self._assign_agent(
-            agents, pending_kernel.requested_slots,
-        )
+        total_capacity: ResourceSlot,
+        pending_sessions: Sequence[PendingSession],
+        existing_sessions: Sequence[ExistingSession],
+    ) -> Optional[SessionId]:
+        # Just pick the last pending session.
+        return SessionId(pending_sessions[-1].session_id)
@@ -1,8 +1,17 @@
 from datetime import datetime
+from decimal import ROUND_FLOOR
 import logging
 from typing import (
+    Any,
+    Dict,
     List,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
 )
+import uuid
 
 from aiopg.sa.connection import SAConnection
 from dateutil.tz import tzutc
@@ -10,24 +19,185 @@ import sqlalchemy as sa
 
 from ai.backend.common.logging import BraceStyleAdapter
 from ai.backend.common.types import (
+    AccessKey,
     ResourceSlot, SessionTypes,
 )
 
 from ..models import (
     domains, groups, kernels, keypairs,
     keypair_resource_policies,
-    query_allowed_sgroups,
+    query_allowed_sgroups_batch,
     DefaultForUnspecified,
 )
+from ..slots import SlotLayout, SlotVector
 from . import (
     SchedulingContext,
     PendingSession,
     PredicateResult,
+    PredicateSnapshot,
 )
 
 log = BraceStyleAdapter(logging.getLogger('ai.backend.manager.scheduler'))
 
 
+def _exceeds(
+    occupied: Optional[SlotVector],
+    requested: SlotVector,
+    allowed: SlotVector,
+) -> bool:
+    if occupied is None:
+        return not (requested <= allowed)
+    return not (occupied + requested <= allowed)
+
+
+async def preload_predicate_snapshot(
+    db_conn: SAConnection,
+    sched_ctx: SchedulingContext,
+    pending_sessions: Sequence[PendingSession],
+) -> PredicateSnapshot:
+    """
+    Load the resource policies, current resource usage, allowed scaling groups
+    and reserved start times for all given pending sessions at once,
+    using a fixed number of queries regardless of the number of sessions.
+    """
+    resource_policy_names = {sess.resource_policy for sess in pending_sessions}
+    access_keys = {sess.access_key for sess in pending_sessions}
+    group_ids = {sess.group_id for sess in pending_sessions}
+    domain_names = {sess.domain_name for sess in pending_sessions}
+    batch_session_ids = [
+        sess.session_id for sess in pending_sessions
+        if sess.session_type == SessionTypes.BATCH
+    ]
+    known_slot_types = sched_ctx.known_slot_types
+    slot_layout = SlotLayout.of(known_slot_types.keys())
+
+    query = (
+        sa.select([keypair_resource_policies])
+        .select_from(keypair_resource_policies)
+        .where(keypair_resource_policies.c.name.in_(resource_policy_names))
+    )
+    resource_policies = {
+        row['name']: row async for row in db_conn.execute(query)
+    }
+    keypair_allowed_slots = {
+        name: slot_layout.vectorize(
+            ResourceSlot.from_policy(policy, known_slot_types), ROUND_FLOOR,
+        )
+        for name, policy in resource_policies.items()
+    }
+
+    # The occupancy of each scope is read from the materialized occupied_slots columns,
+    # which are maintained as the kernels enter and leave the resource-occupying statuses.
+    # The no-longer used slot types are dropped when converting them into slot vectors.
+    group_occupancy: Dict[uuid.UUID, SlotVector] = {}
+    query = (
+        sa.select([groups.c.id, groups.c.total_resource_slots, groups.c.occupied_slots])
+        .select_from(groups)
+        .where(groups.c.id.in_(group_ids))
+    )
+    group_allowed_slots = {}
+    async for row in db_conn.execute(query):
+        group_allowed_slots[row['id']] = slot_layout.vectorize(ResourceSlot.from_policy({
+            'total_resource_slots': row['total_resource_slots'],
+            'default_for_unspecified': DefaultForUnspecified.UNLIMITED,
+        }, known_slot_types), ROUND_FLOOR)
+        group_occupancy[row['id']] = slot_layout.vectorize(row['occupied_slots'])
+
+    domain_occupancy: Dict[str, SlotVector] = {}
+    query = (
+        sa.select([domains.c.name, domains.c.total_resource_slots, domains.c.occupied_slots])
+        .select_from(domains)
+        .where(domains.c.name.in_(domain_names))
+    )
+    domain_allowed_slots = {}
+    async for row in db_conn.execute(query):
+        domain_allowed_slots[row['name']] = slot_layout.vectorize(ResourceSlot.from_policy({
+            'total_resource_slots': row['total_resource_slots'],
+            'default_for_unspecified': DefaultForUnspecified.UNLIMITED,
+        }, known_slot_types), ROUND_FLOOR)
+        domain_occupancy[row['name']] = slot_layout.vectorize(row['occupied_slots'])
+
+    concurrency_used: Dict[AccessKey, int] = {}
+    keypair_occupancy: Dict[AccessKey, SlotVector] = {}
+    query = (
+        sa.select([keypairs.c.access_key, keypairs.c.concurrency_used, keypairs.c.occupied_slots])
+        .select_from(keypairs)
+        .where(keypairs.c.access_key.in_(access_keys))
+    )
+    async for row in db_conn.execute(query):
+        concurrency_used[row['access_key']] = row['concurrency_used']
+        keypair_occupancy[row['access_key']] = slot_layout.vectorize(row['occupied_slots'])
+
+    sgroup_targets: Set[Tuple[str, uuid.UUID, str]] = {
+        (sess.domain_name, sess.group_id, sess.access_key)
+        for sess in pending_sessions
+    }
+    allowed_sgroups = await query_allowed_sgroups_batch(db_conn, sgroup_targets)
+
+    session_starts_at = {}
+    if batch_session_ids:
+        query = (
+            sa.select([kernels.c.id, kernels.c.starts_at])
+            .select_from(kernels)
+            .where(kernels.c.id.in_(batch_session_ids))
+        )
+        session_starts_at = {
+            row['id']: row['starts_at']
+            async for row in db_conn.execute(query)
+        }
+
+    return PredicateSnapshot(
+        keypair_resource_policies=resource_policies,
+        keypair_allowed_slots=keypair_allowed_slots,
+        group_allowed_slots=group_allowed_slots,
+        domain_allowed_slots=domain_allowed_slots,
+        allowed_sgroups=allowed_sgroups,
+        session_starts_at=session_starts_at,
+        concurrency_used=concurrency_used,
+        keypair_occupancy=keypair_occupancy,
+        group_occupancy=group_occupancy,
+        domain_occupancy=domain_occupancy,
+        slot_layout=slot_layout,
+    )
+
+
+def _get_snapshot(sched_ctx: SchedulingContext) -> PredicateSnapshot:
+    snapshot = sched_ctx.predicate_snapshot
+    assert snapshot is not None, 'predicate inputs must be preloaded'
+    return snapshot
+
+
+async def _lock_occupancy(
+    db_conn: SAConnection,
+    snapshot: PredicateSnapshot,
+    occupancy: MutableMapping[Any, SlotVector],
+    table: sa.Table,
+    key_column: sa.Column,
+    key: Any,
+) -> Optional[SlotVector]:
+    """
+    Re-read the occupied slots of the given scope and lock its row until the end of
+    the session's scheduling transaction, which applies the session's occupancy.
+
+    The preloaded occupancy misses the sessions scheduled by the other scaling groups
+    and manager processes since the preloading, so the resource limit checks passed
+    with the preloaded values are confirmed against the locked values.
+    """
+    query = (
+        sa.select([table.c.occupied_slots], for_update=True)
+        .select_from(table)
+        .where(key_column == key)
+    )
+    result = await db_conn.execute(query)
+    occupied_slots = await result.scalar()
+    if occupied_slots is None:
+        return occupancy.get(key)
+    assert snapshot.slot_layout is not None
+    occupied = snapshot.slot_layout.vectorize(occupied_slots)
+    occupancy[key] = occupied
+    return occupied
+
+
 async def check_reserved_batch_session(
     db_conn: SAConnection,
     sched_ctx: SchedulingContext,
@@ -37,12 +207,7 @@ async def check_reserved_batch_session(
     Check if a batch-type session should not be started for a certain amount of time.
     """
     if sess_ctx.session_type == SessionTypes.BATCH:
-        query = (
-            sa.select([kernels.c.starts_at])
-            .select_from(kernels)
-            .where(kernels.c.id == sess_ctx.session_id)
-        )
-        starts_at = await db_conn.scalar(query)
+        starts_at = _get_snapshot(sched_ctx).session_starts_at.get(sess_ctx.session_id)
         if starts_at is not None and datetime.now(tzutc()) < starts_at:
             return PredicateResult(
                 False,
@@ -56,31 +221,35 @@ async def check_concurrency(
     sched_ctx: SchedulingContext,
     sess_ctx: PendingSession,
 ) -> PredicateResult:
-    query = (
-        sa.select([keypair_resource_policies])
-        .select_from(keypair_resource_policies)
-        .where(keypair_resource_policies.c.name == sess_ctx.resource_policy)
-    )
-    result = await db_conn.execute(query)
-    resource_policy = await result.first()
-    query = (sa.select([keypairs.c.concurrency_used], for_update=True)
-               .select_from(keypairs)
-               .where(keypairs.c.access_key == sess_ctx.access_key))
-    concurrency_used = await db_conn.scalar(query)
+    snapshot = _get_snapshot(sched_ctx)
+    resource_policy = snapshot.keypair_resource_policies[sess_ctx.resource_policy]
+    max_concurrent_sessions = resource_policy['max_concurrent_sessions']
+    concurrency_used = snapshot.concurrency_used.get(sess_ctx.access_key, 0)
     log.debug('access_key: {0} ({1} / {2})',
-              sess_ctx.access_key, concurrency_used,
-              resource_policy['max_concurrent_sessions'])
-    if concurrency_used >= resource_policy['max_concurrent_sessions']:
+              sess_ctx.access_key, concurrency_used, max_concurrent_sessions)
+    if concurrency_used >= max_concurrent_sessions:
         return PredicateResult(
             False,
             "You cannot run more than "
-            f"{resource_policy['max_concurrent_sessions']} concurrent sessions"
+            f"{max_concurrent_sessions} concurrent sessions"
         )
     # Increment concurrency usage of keypair.
+    # The condition guards against the concurrent changes made after preloading.
     query = (sa.update(keypairs)
                .values(concurrency_used=keypairs.c.concurrency_used + 1)
-               .where(keypairs.c.access_key == sess_ctx.access_key))
-    await db_conn.execute(query)
+               .where(
+                   (keypairs.c.access_key == sess_ctx.access_key) &
+                   (keypairs.c.concurrency_used < max_concurrent_sessions)
+               ))
+    result = await db_conn.execute(query)
+    if result.rowcount == 0:
+        snapshot.concurrency_used[sess_ctx.access_key] = max_concurrent_sessions
+        return PredicateResult(
+            False,
+            "You cannot run more than "
+            f"{max_concurrent_sessions} concurrent sessions"
+        )
+    snapshot.concurrency_used[sess_ctx.access_key] = concurrency_used + 1
 
     async def rollback(
         db_conn: SAConnection,
@@ -91,6 +260,7 @@ async def check_concurrency(
                    .values(concurrency_used=keypairs.c.concurrency_used - 1)
                    .where(keypairs.c.access_key == sess_ctx.access_key))
         await db_conn.execute(query)
+        snapshot.concurrency_used[sess_ctx.access_key] -= 1
 
     return PredicateResult(True, failure_cb=rollback)
 
@@ -109,20 +279,18 @@ async def check_keypair_resource_limit(
     sched_ctx: SchedulingContext,
     sess_ctx: PendingSession,
 ) -> PredicateResult:
-    query = (
-        sa.select([keypair_resource_policies])
-        .select_from(keypair_resource_policies)
-        .where(keypair_resource_policies.c.name == sess_ctx.resource_policy)
-    )
-    result = await db_conn.execute(query)
-    resource_policy = await result.first()
-    total_keypair_allowed = ResourceSlot.from_policy(resource_policy,
-                                                     sched_ctx.known_slot_types)
-    key_occupied = await sched_ctx.registry.get_keypair_occupancy(
-        sess_ctx.access_key, conn=db_conn)
+    snapshot = _get_snapshot(sched_ctx)
+    total_keypair_allowed = snapshot.keypair_allowed_slots[sess_ctx.resource_policy]
+    key_occupied = snapshot.keypair_occupancy.get(sess_ctx.access_key)
     log.debug('keypair:{} current-occupancy: {}', sess_ctx.access_key, key_occupied)
     log.debug('keypair:{} total-allowed: {}', sess_ctx.access_key, total_keypair_allowed)
-    if not (key_occupied + sess_ctx.requested_slots <= total_keypair_allowed):
+    requested = snapshot.get_requested_slots(sess_ctx)
+    if not _exceeds(key_occupied, requested, total_keypair_allowed):
+        key_occupied = await _lock_occupancy(
+            db_conn, snapshot, snapshot.keypair_occupancy,
+            keypairs, keypairs.c.access_key, sess_ctx.access_key,
+        )
+    if _exceeds(key_occupied, requested, total_keypair_allowed):
 
         async def update_status_info(
             db_conn: SAConnection,
@@ -139,7 +307,7 @@ async def check_keypair_resource_limit(
             'Your keypair resource quota is exceeded. ({})'
             .format(' '.join(
                 f'{k}={v}' for k, v in
-                total_keypair_allowed.to_humanized(sched_ctx.known_slot_types).items()
+                total_keypair_allowed.to_slots().to_humanized(sched_ctx.known_slot_types).items()
             )),
             failure_cb=update_status_info)
     return PredicateResult(True)
@@ -150,18 +318,18 @@ async def check_group_resource_limit(
     sched_ctx: SchedulingContext,
     sess_ctx: PendingSession,
 ) -> PredicateResult:
-    query = (sa.select([groups.c.total_resource_slots])
-               .where(groups.c.id == sess_ctx.group_id))
-    group_resource_slots = await db_conn.scalar(query)
-    group_resource_policy = {'total_resource_slots': group_resource_slots,
-                             'default_for_unspecified': DefaultForUnspecified.UNLIMITED}
-    total_group_allowed = ResourceSlot.from_policy(group_resource_policy,
-                                                   sched_ctx.known_slot_types)
-    group_occupied = await sched_ctx.registry.get_group_occupancy(
-        sess_ctx.group_id, conn=db_conn)
+    snapshot = _get_snapshot(sched_ctx)
+    total_group_allowed = snapshot.group_allowed_slots[sess_ctx.group_id]
+    group_occupied = snapshot.group_occupancy.get(sess_ctx.group_id)
     log.debug('group:{} current-occupancy: {}', sess_ctx.group_id, group_occupied)
     log.debug('group:{} total-allowed: {}', sess_ctx.group_id, total_group_allowed)
-    if not (group_occupied + sess_ctx.requested_slots <= total_group_allowed):
+    requested = snapshot.get_requested_slots(sess_ctx)
+    if not _exceeds(group_occupied, requested, total_group_allowed):
+        group_occupied = await _lock_occupancy(
+            db_conn, snapshot, snapshot.group_occupancy,
+            groups, groups.c.id, sess_ctx.group_id,
+        )
+    if _exceeds(group_occupied, requested, total_group_allowed):
 
         async def update_status_info(
             db_conn: SAConnection,
@@ -178,7 +346,7 @@ async def check_group_resource_limit(
             'Your group resource quota is exceeded. ({})'
             .format(' '.join(
                 f'{k}={v}' for k, v in
-                total_group_allowed.to_humanized(sched_ctx.known_slot_types).items()
+                total_group_allowed.to_slots().to_humanized(sched_ctx.known_slot_types).items()
             )),
             failure_cb=update_status_info)
     return PredicateResult(True)
@@ -189,20 +357,18 @@ async def check_domain_resource_limit(
     sched_ctx: SchedulingContext,
     sess_ctx: PendingSession,
 ) -> PredicateResult:
-    query = (sa.select([domains.c.total_resource_slots])
-               .where(domains.c.name == sess_ctx.domain_name))
-    domain_resource_slots = await db_conn.scalar(query)
-    domain_resource_policy = {
-        'total_resource_slots': domain_resource_slots,
-        'default_for_unspecified': DefaultForUnspecified.UNLIMITED
-    }
-    total_domain_allowed = ResourceSlot.from_policy(domain_resource_policy,
-                                                    sched_ctx.known_slot_types)
-    domain_occupied = await sched_ctx.registry.get_domain_occupancy(
-        sess_ctx.domain_name, conn=db_conn)
+    snapshot = _get_snapshot(sched_ctx)
+    total_domain_allowed = snapshot.domain_allowed_slots[sess_ctx.domain_name]
+    domain_occupied = snapshot.domain_occupancy.get(sess_ctx.domain_name)
     log.debug('domain:{} current-occupancy: {}', sess_ctx.domain_name, domain_occupied)
     log.debug('domain:{} total-allowed: {}', sess_ctx.domain_name, total_domain_allowed)
-    if not (domain_occupied + sess_ctx.requested_slots <= total_domain_allowed):
+    requested = snapshot.get_requested_slots(sess_ctx)
+    if not _exceeds(domain_occupied, requested, total_domain_allowed):
+        domain_occupied = await _lock_occupancy(
+            db_conn, snapshot, snapshot.domain_occupancy,
+            domains, domains.c.name, sess_ctx.domain_name,
+        )
+    if _exceeds(domain_occupied, requested, total_domain_allowed):
 
         async def update_status_info(
             db_conn: SAConnection,
@@ -219,7 +385,7 @@ async def check_domain_resource_limit(
             'Your domain resource quota is exceeded. ({})'
             .format(' '.join(
                 f'{k}={v}' for k, v in
-                total_domain_allowed.to_humanized(sched_ctx.known_slot_types).items()
+                total_domain_allowed.to_slots().to_humanized(sched_ctx.known_slot_types).items()
             )),
             failure_cb=update_status_info)
     return PredicateResult(True)
@@ -230,18 +396,12 @@ async def check_scaling_group(
     sched_ctx: SchedulingContext,
     sess_ctx: PendingSession,
 ) -> PredicateResult:
-    sgroups = await query_allowed_sgroups(
-        db_conn,
-        sess_ctx.domain_name,
-        sess_ctx.group_id,
-        sess_ctx.access_key)
+    sgroup_names = _get_snapshot(sched_ctx).allowed_sgroups.get(
+        (sess_ctx.domain_name, sess_ctx.group_id, sess_ctx.access_key), [])
     target_sgroup_names: List[str] = []
     preferred_sgroup_name = sess_ctx.scaling_group
     if preferred_sgroup_name is not None:
-        for sgroup in sgroups:
-            if preferred_sgroup_name == sgroup['name']:
-                break
-        else:
+        if preferred_sgroup_name not in sgroup_names:
             return PredicateResult(
                 False,
                 'The given preferred scaling group is not available. ({})'
@@ -251,7 +411,7 @@ async def check_scaling_group(
         target_sgroup_names = [preferred_sgroup_name]
     else:
         # Consider all agents in all allowed scaling groups.
-        target_sgroup_names = [sgroup['name'] for sgroup in sgroups]
+        target_sgroup_names = [*sgroup_names]
     log.debug('considered scaling groups: {}', target_sgroup_names)
     if not target_sgroup_names:
 
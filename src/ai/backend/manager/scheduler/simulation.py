@@ -0,0 +1,563 @@
+"""
+An offline simulator to measure the scheduler plugins and predicates
+with synthetic agent and session populations.
+
+It drives the actual scheduler, snapshot and predicate implementations
+through the per-pass procedure of :class:`SchedulerDispatcher`, while the database
+and the event bus are replaced with in-memory stand-ins.
+"""
+
+from __future__ import annotations
+
+from contextlib import asynccontextmanager as actxmgr
+from decimal import Decimal
+import logging
+import random
+import statistics
+import time
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    Tuple,
+)
+import uuid
+
+import attr
+
+from ai.backend.common.docker import ImageRef
+from ai.backend.common.logging import BraceStyleAdapter
+from ai.backend.common.types import (
+    AccessKey,
+    AgentId,
+    ClusterMode,
+    KernelId,
+    ResourceSlot,
+    SessionTypes,
+)
+
+from ...gateway.exceptions import InstanceNotAvailable
+from ..defs import DEFAULT_ROLE
+from ..slots import SlotLayout, SlotVector
+from . import (
+    AbstractScheduler,
+    AgentContext,
+    ExistingSession,
+    KernelAgentBinding,
+    KernelInfo,
+    PendingSession,
+    PredicateSnapshot,
+    SchedulingContext,
+    SchedulingSnapshot,
+)
+from .dispatcher import ScheduledSession, schedule_pending_sessions
+from .drf import DRFScheduler
+from .fifo import FIFOSlotScheduler, LIFOSlotScheduler
+from .mof import MOFScheduler
+
+__all__ = (
+    'SimulationConfig',
+    'SimulationResult',
+    'generate_agents',
+    'generate_pending_sessions',
+    'run_simulation',
+)
+
+log = BraceStyleAdapter(logging.getLogger('ai.backend.manager.scheduler.simulation'))
+
+GiB = 2 ** 30
+
+intrinsic_schedulers: Mapping[str, Callable[[Mapping[str, Any]], AbstractScheduler]] = {
+    'fifo': FIFOSlotScheduler,
+    'lifo': LIFOSlotScheduler,
+    'drf': DRFScheduler,
+    'mof': MOFScheduler,
+}
+
+known_slot_types: Mapping[str, str] = {
+    'cpu': 'count',
+    'mem': 'bytes',
+    'cuda.shares': 'count',
+}
+
+_image_ref = ImageRef('lablup/python:3.8-ubuntu18.04')
+
+
+@attr.s(auto_attribs=True, slots=True)
+class SimulationConfig:
+    num_agents: int = 100
+    num_sessions: int = 1000
+    num_users: int = 50
+    scaling_group: str = 'default'
+    # The ratio of agents equipped with accelerators.
+    accelerated_agent_ratio: float = 0.25
+    # The ratio of agents that support overlay networks for multi-node sessions.
+    clusterized_agent_ratio: float = 0.5
+    # The ratio of pending sessions requesting accelerators.
+    accelerated_session_ratio: float = 0.2
+    # The ratio of pending sessions spanning multiple agents.
+    multi_node_ratio: float = 0.05
+    max_cluster_size: int = 4
+    # The lifetime of started sessions in the number of scheduling ticks.
+    max_session_ticks: int = 10
+    max_concurrent_sessions: int = 30
+    max_ticks: int = 100
+    seed: int = 0
+
+
+@attr.s(auto_attribs=True, slots=True)
+class SimulationResult:
+    scheduler_name: str
+    num_agents: int
+    num_sessions: int
+    num_ticks: int
+    num_started: int
+    num_remaining: int
+    tick_latencies: List[float]
+    # The mean ratio of the free CPU slots held by agents that cannot host
+    # the smallest pending CPU request, sampled after each tick.
+    fragmentation: float
+    # The mean ratio of the occupied CPU slots, sampled after each tick.
+    utilization: float
+    # Jain's fairness index of the per-user dominant shares of started sessions.
+    fairness: float
+
+    @property
+    def throughput(self) -> float:
+        """The number of started sessions per second of scheduling time."""
+        elapsed = sum(self.tick_latencies)
+        return self.num_started / elapsed if elapsed > 0 else 0.0
+
+    def latency_percentile(self, p: float) -> float:
+        if not self.tick_latencies:
+            return 0.0
+        latencies = sorted(self.tick_latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    def summary(self) -> Mapping[str, Any]:
+        return {
+            'scheduler': self.scheduler_name,
+            'agents': self.num_agents,
+            'sessions': self.num_sessions,
+            'ticks': self.num_ticks,
+            'started': self.num_started,
+            'remaining': self.num_remaining,
+            'tick-p50 (ms)': round(self.latency_percentile(0.5) * 1000, 3),
+            'tick-p95 (ms)': round(self.latency_percentile(0.95) * 1000, 3),
+            'tick-max (ms)': round(max(self.tick_latencies, default=0.0) * 1000, 3),
+            'throughput (sess/s)': round(self.throughput, 1),
+            'fragmentation': round(self.fragmentation, 4),
+            'utilization': round(self.utilization, 4),
+            'fairness': round(self.fairness, 4),
+        }
+
+
+class StandInResult:
+
+    def __init__(self, rowcount: int = 1) -> None:
+        self.rowcount = rowcount
+
+    async def fetchall(self) -> List[Any]:
+        return []
+
+    async def first(self) -> Any:
+        return None
+
+    async def scalar(self) -> Any:
+        return None
+
+
+class StandInConnection:
+    """
+    A stand-in of SAConnection that accepts and counts all statements.
+    The simulator keeps the states that the predicates would update in the database
+    (e.g., the keypair concurrency) in the predicate snapshot instead.
+    """
+
+    def __init__(self) -> None:
+        self.num_statements = 0
+        self.num_transactions = 0
+
+    async def execute(self, query: Any, *args, **kwargs) -> StandInResult:
+        self.num_statements += 1
+        return StandInResult()
+
+    async def scalar(self, query: Any, *args, **kwargs) -> Any:
+        self.num_statements += 1
+        return None
+
+    @actxmgr
+    async def begin(self) -> AsyncIterator[None]:
+        self.num_transactions += 1
+        yield
+
+
+class StandInEventDispatcher:
+    """
+    A stand-in of EventDispatcher that records the produced events.
+    """
+
+    def __init__(self) -> None:
+        self.produced_events: List[Tuple[str, Sequence[Any]]] = []
+
+    async def produce_event(self, event_name: str, args: Sequence[Any] = tuple(), *,
+                            agent_id: str = 'manager') -> None:
+        self.produced_events.append((event_name, args))
+
+
+class StandInRegistry:
+
+    def __init__(self) -> None:
+        self.event_dispatcher = StandInEventDispatcher()
+
+
+def generate_agents(config: SimulationConfig, rng: random.Random) -> List[AgentContext]:
+    agents = []
+    for idx in range(config.num_agents):
+        cpu = rng.choice((8, 16, 32, 64))
+        accelerated = rng.random() < config.accelerated_agent_ratio
+        agents.append(AgentContext(
+            agent_id=AgentId(f'i-sim{idx:06d}'),
+            agent_addr=f'tcp://10.{idx // 65536 % 256}.{idx // 256 % 256}.{idx % 256}:6001',
+            scaling_group=config.scaling_group,
+            available_slots=ResourceSlot({
+                'cpu': Decimal(cpu),
+                'mem': Decimal(cpu * 4 * GiB),
+                'cuda.shares': Decimal(rng.choice((4, 8)) if accelerated else 0),
+            }),
+            occupied_slots=ResourceSlot({
+                'cpu': Decimal(0),
+                'mem': Decimal(0),
+                'cuda.shares': Decimal(0),
+            }),
+            clusterized=(rng.random() < config.clusterized_agent_ratio),
+        ))
+    return agents
+
+
+def generate_pending_sessions(
+    config: SimulationConfig,
+    rng: random.Random,
+) -> List[PendingSession]:
+    group_id = uuid.UUID(int=rng.getrandbits(128))
+    sessions = []
+    for idx in range(config.num_sessions):
+        session_id = uuid.UUID(int=rng.getrandbits(128))
+        access_key = AccessKey(f'AKSIM{rng.randrange(config.num_users):06d}')
+        multi_node = (rng.random() < config.multi_node_ratio)
+        cluster_size = rng.randint(2, config.max_cluster_size) if multi_node else 1
+        cpu = rng.choice((1, 2, 4, 8))
+        kernel_slots = ResourceSlot({
+            'cpu': Decimal(cpu),
+            'mem': Decimal(cpu * rng.choice((1, 2, 4)) * GiB),
+            'cuda.shares': Decimal(
+                rng.choice((1, 2)) if rng.random() < config.accelerated_session_ratio else 0
+            ),
+        })
+        kernels = []
+        for cluster_idx in range(cluster_size):
+            cluster_role = DEFAULT_ROLE if cluster_idx == 0 else 'sub'
+            kernels.append(KernelInfo(
+                kernel_id=KernelId(uuid.UUID(int=rng.getrandbits(128))),
+                session_id=session_id,
+                access_key=access_key,
+                cluster_role=cluster_role,
+                cluster_idx=cluster_idx + 1,
+                cluster_hostname=f'{cluster_role}{cluster_idx}',
+                image_ref=_image_ref,
+                resource_opts={},
+                requested_slots=ResourceSlot(kernel_slots),
+                bootstrap_script=None,
+                startup_command=None,
+            ))
+        requested_slots = ResourceSlot({
+            k: v * cluster_size for k, v in kernel_slots.items()
+        })
+        sessions.append(PendingSession(
+            kernels=kernels,
+            access_key=access_key,
+            session_id=session_id,
+            session_type=SessionTypes.INTERACTIVE,
+            session_name=f'sim{idx:06d}',
+            cluster_mode=ClusterMode.MULTI_NODE if multi_node else ClusterMode.SINGLE_NODE,
+            cluster_size=cluster_size,
+            domain_name='default',
+            group_id=group_id,
+            scaling_group=config.scaling_group,
+            resource_policy='default',
+            resource_opts={},
+            requested_slots=requested_slots,
+            target_sgroup_names=[],
+            environ={},
+            mounts=[],
+            mount_map={},
+            bootstrap_script=None,
+            startup_command=None,
+            internal_data=None,
+            preopen_ports=[],
+        ))
+    return sessions
+
+
+def _build_predicate_snapshot(
+    config: SimulationConfig,
+    pending_sessions: Sequence[PendingSession],
+    running_sessions: Sequence[ExistingSession],
+) -> PredicateSnapshot:
+    slot_layout = SlotLayout.of(known_slot_types.keys())
+    unlimited = slot_layout.vectorize({k: Decimal('Infinity') for k in known_slot_types})
+    concurrency_used: Dict[AccessKey, int] = {}
+    keypair_occupancy: Dict[AccessKey, SlotVector] = {}
+    total_occupancy = slot_layout.zeros()
+    for sess in running_sessions:
+        concurrency_used[sess.access_key] = concurrency_used.get(sess.access_key, 0) + 1
+        occupying_slots = slot_layout.vectorize(sess.occupying_slots)
+        if sess.access_key in keypair_occupancy:
+            keypair_occupancy[sess.access_key] += occupying_slots
+        else:
+            keypair_occupancy[sess.access_key] = occupying_slots.copy()
+        total_occupancy += occupying_slots
+    group_occupancy = {}
+    domain_occupancy = {}
+    if running_sessions:
+        group_occupancy = {running_sessions[0].group_id: total_occupancy}
+        domain_occupancy = {running_sessions[0].domain_name: total_occupancy.copy()}
+    return PredicateSnapshot(
+        keypair_resource_policies={
+            'default': {'max_concurrent_sessions': config.max_concurrent_sessions},
+        },
+        keypair_allowed_slots={'default': unlimited},
+        group_allowed_slots={sess.group_id: unlimited for sess in pending_sessions},
+        domain_allowed_slots={sess.domain_name: unlimited for sess in pending_sessions},
+        allowed_sgroups={
+            (sess.domain_name, sess.group_id, sess.access_key): [config.scaling_group]
+            for sess in pending_sessions
+        },
+        session_starts_at={},
+        concurrency_used=concurrency_used,
+        keypair_occupancy=keypair_occupancy,
+        group_occupancy=group_occupancy,
+        domain_occupancy=domain_occupancy,
+        slot_layout=slot_layout,
+    )
+
+
+async def _lock_pending_session(db_conn: Any, sess_ctx: PendingSession) -> bool:
+    # The simulated sessions are scheduled by this simulator only.
+    return True
+
+
+async def _commit_scheduled_session(
+    db_conn: Any,
+    snapshot: SchedulingSnapshot,
+    session_agent_binding: Tuple[PendingSession, List[KernelAgentBinding]],
+) -> None:
+    # The agent occupancy is kept in the agent contexts of the snapshot
+    # and the owner occupancy in the predicate snapshot.
+    snapshot.reserved_slots.clear()
+
+
+async def _schedule_tick(
+    db_conn: StandInConnection,
+    sched_ctx: SchedulingContext,
+    scheduler: AbstractScheduler,
+    snapshot: SchedulingSnapshot,
+    pending_sessions: List[PendingSession],
+    existing_sessions: List[ExistingSession],
+) -> List[Tuple[PendingSession, List[AgentId]]]:
+    """
+    Run a scheduling pass with the same procedure as ``SchedulerDispatcher.schedule_impl()``
+    and return the scheduled sessions with their assigned agents.
+    """
+    scheduled_sessions: List[ScheduledSession] = []
+    try:
+        await schedule_pending_sessions(
+            db_conn, sched_ctx, scheduler, snapshot,
+            list(pending_sessions), existing_sessions,
+            scheduled_sessions=scheduled_sessions,
+            touched_session_ids=set(),
+            lock_pending_session=_lock_pending_session,
+            commit_scheduled_session=_commit_scheduled_session,
+        )
+    except InstanceNotAvailable:
+        # Like the dispatcher, end the pass when there are no available agents
+        # and start the sessions scheduled until then.
+        pass
+    scheduled = [
+        (sess_ctx, [binding.agent_alloc_ctx.agent_id for binding in kernel_agent_bindings])
+        for sess_ctx, kernel_agent_bindings in (
+            item.session_agent_binding for item in scheduled_sessions
+        )
+    ]
+    # Sessions failing the predicates stay pending for the next pass
+    # as they remain in the PENDING status in the database.
+    scheduled_ids = {sess_ctx.session_id for sess_ctx, _ in scheduled}
+    pending_sessions[:] = [
+        sess_ctx for sess_ctx in pending_sessions
+        if sess_ctx.session_id not in scheduled_ids
+    ]
+    return scheduled
+
+
+def _measure_fragmentation(
+    agents: Sequence[AgentContext],
+    pending_sessions: Sequence[PendingSession],
+) -> float:
+    if not pending_sessions:
+        return 0.0
+    min_cpu_request = min(
+        min(Decimal(k.requested_slots['cpu']) for k in sess.kernels)
+        for sess in pending_sessions
+    )
+    total_free = Decimal(0)
+    stranded_free = Decimal(0)
+    for agent in agents:
+        free = Decimal(agent.available_slots['cpu']) - Decimal(agent.occupied_slots['cpu'])
+        total_free += free
+        if free < min_cpu_request:
+            stranded_free += free
+    return float(stranded_free / total_free) if total_free > 0 else 0.0
+
+
+def _measure_utilization(agents: Sequence[AgentContext]) -> float:
+    total = sum(Decimal(ag.available_slots['cpu']) for ag in agents)
+    occupied = sum(Decimal(ag.occupied_slots['cpu']) for ag in agents)
+    return float(occupied / total) if total > 0 else 0.0
+
+
+def _measure_fairness(
+    total_capacity: ResourceSlot,
+    started_sessions: Sequence[PendingSession],
+    users: Sequence[AccessKey],
+) -> float:
+    allocated: MutableMapping[AccessKey, ResourceSlot] = {}
+    for sess in started_sessions:
+        allocated[sess.access_key] = \
+            allocated.get(sess.access_key, ResourceSlot()) + sess.requested_slots
+    shares = []
+    for access_key in users:
+        share = 0.0
+        for k, v in allocated.get(access_key, ResourceSlot()).items():
+            cap = Decimal(total_capacity.get(k, 0))
+            if cap > 0:
+                share = max(share, float(Decimal(v) / cap))
+        shares.append(share)
+    if not shares or sum(shares) == 0:
+        return 1.0
+    return sum(shares) ** 2 / (len(shares) * sum(s * s for s in shares))
+
+
+async def run_simulation(
+    scheduler_name: str,
+    config: SimulationConfig,
+    *,
+    scheduler_config: Optional[Mapping[str, Any]] = None,
+    scheduler_factory: Optional[Callable[[Mapping[str, Any]], AbstractScheduler]] = None,
+) -> SimulationResult:
+    """
+    Replay the synthetic population generated from the given config through the scheduler
+    until all sessions are started or ``config.max_ticks`` ticks have passed.
+    Started sessions are terminated after a random number of ticks, releasing their slots.
+    """
+    rng = random.Random(config.seed)
+    agents = generate_agents(config, rng)
+    pending_sessions = generate_pending_sessions(config, rng)
+    users = sorted({sess.access_key for sess in pending_sessions})
+    if scheduler_factory is None:
+        scheduler_factory = intrinsic_schedulers[scheduler_name]
+    db_conn = StandInConnection()
+    registry: Any = StandInRegistry()
+    sched_ctx = SchedulingContext(registry=registry, known_slot_types=known_slot_types)
+
+    running: List[Tuple[int, ExistingSession, List[Tuple[AgentId, ResourceSlot]]]] = []
+    started_sessions: List[PendingSession] = []
+    tick_latencies: List[float] = []
+    fragmentation_samples: List[float] = []
+    utilization_samples: List[float] = []
+    agent_map = {ag.agent_id: ag for ag in agents}
+    num_ticks = 0
+    total_capacity = sum((ag.available_slots for ag in agents), ResourceSlot())
+
+    for tick in range(config.max_ticks):
+        if not pending_sessions:
+            break
+        num_ticks += 1
+        # Release the slots of the sessions terminated since the last tick.
+        still_running = []
+        for ends_at, existing_sess, allocations in running:
+            if ends_at > tick:
+                still_running.append((ends_at, existing_sess, allocations))
+                continue
+            for agent_id, slots in allocations:
+                agent = agent_map[agent_id]
+                agent.occupied_slots = agent.occupied_slots - slots
+        running = still_running
+
+        existing_sessions = [existing_sess for _, existing_sess, _ in running]
+        begin = time.perf_counter()
+        scheduler = scheduler_factory(scheduler_config or {})
+        snapshot = SchedulingSnapshot(config.scaling_group, agents)
+        scheduler.capacity_matrix = snapshot.capacity
+        tick_sched_ctx = attr.evolve(
+            sched_ctx,
+            predicate_snapshot=_build_predicate_snapshot(
+                config, pending_sessions, existing_sessions,
+            ),
+        )
+        scheduled = await _schedule_tick(
+            db_conn, tick_sched_ctx, scheduler, snapshot,
+            pending_sessions, existing_sessions,
+        )
+        tick_latencies.append(time.perf_counter() - begin)
+
+        for sess_ctx, agent_ids in scheduled:
+            await registry.event_dispatcher.produce_event(
+                'session_scheduled', (str(sess_ctx.session_id), ),
+            )
+            if sess_ctx.cluster_mode == ClusterMode.SINGLE_NODE:
+                allocations = [(agent_ids[0], sess_ctx.requested_slots)]
+            else:
+                allocations = [
+                    (agent_id, kernel.requested_slots)
+                    for agent_id, kernel in zip(agent_ids, sess_ctx.kernels)
+                ]
+            existing_sess = ExistingSession(
+                kernels=sess_ctx.kernels,
+                access_key=sess_ctx.access_key,
+                session_id=sess_ctx.session_id,
+                session_type=sess_ctx.session_type,
+                session_name=sess_ctx.session_name,
+                cluster_mode=sess_ctx.cluster_mode,
+                cluster_size=sess_ctx.cluster_size,
+                domain_name=sess_ctx.domain_name,
+                group_id=sess_ctx.group_id,
+                scaling_group=config.scaling_group,
+                occupying_slots=ResourceSlot(sess_ctx.requested_slots),
+            )
+            ends_at = tick + rng.randint(1, config.max_session_ticks)
+            running.append((ends_at, existing_sess, allocations))
+            started_sessions.append(sess_ctx)
+
+        fragmentation_samples.append(_measure_fragmentation(agents, pending_sessions))
+        utilization_samples.append(_measure_utilization(agents))
+        log.debug('tick {}: scheduled {} sessions in {:.3f} ms ({} pending)',
+                  tick, len(scheduled), tick_latencies[-1] * 1000, len(pending_sessions))
+
+    return SimulationResult(
+        scheduler_name=scheduler_name,
+        num_agents=config.num_agents,
+        num_sessions=config.num_sessions,
+        num_ticks=num_ticks,
+        num_started=len(started_sessions),
+        num_remaining=len(pending_sessions),
+        tick_latencies=tick_latencies,
+        fragmentation=statistics.mean(fragmentation_samples) if fragmentation_samples else 0.0,
+        utilization=statistics.mean(utilization_samples) if utilization_samples else 0.0,
+        fairness=_measure_fairness(total_capacity, started_sessions, users),
+    )
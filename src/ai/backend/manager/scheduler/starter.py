@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import asyncio
+from collections import defaultdict
+import heapq
+import itertools
+import logging
+import time
+from typing import (
+    Awaitable,
+    Callable,
+    Collection,
+    Dict,
+    FrozenSet,
+    List,
+    Mapping,
+    Set,
+)
+
+import attr
+
+from ai.backend.common.logging import BraceStyleAdapter
+from ai.backend.common.types import (
+    AgentId,
+    SessionTypes,
+)
+
+__all__ = (
+    'SESSION_START_PRIORITIES',
+    'SessionStartExecutor',
+)
+
+log = BraceStyleAdapter(logging.getLogger('ai.backend.manager.scheduler.starter'))
+
+# Lower values start first.  Interactive sessions have users waiting for them.
+SESSION_START_PRIORITIES: Mapping[SessionTypes, int] = {
+    SessionTypes.INTERACTIVE: 0,
+    SessionTypes.BATCH: 1,
+}
+
+
+@attr.s(auto_attribs=True, slots=True, eq=False)
+class _StartJob:
+    start_fn: Callable[[], Awaitable[None]]
+    agent_ids: FrozenSet[AgentId]
+    future: asyncio.Future
+    enqueued_at: float
+
+
+@attr.s(auto_attribs=True, slots=True)
+class _StartMetrics:
+    num_started: int = 0
+    num_finished: int = 0
+    num_failed: int = 0
+    total_wait_time: float = 0.0
+    max_wait_time: float = 0.0
+    total_run_time: float = 0.0
+    max_run_time: float = 0.0
+
+
+class SessionStartExecutor:
+    """
+    Runs the session start procedures produced by the scheduling passes
+    with the global and per-agent concurrency limits.
+
+    Starting a session involves database queries, etcd lookups, and agent RPCs,
+    so starting all sessions placed in a pass at once may exhaust the database
+    connection pool and overload the agents.  The queued starts are taken in the order of
+    their session type priority and then their submission, skipping the ones whose agents
+    are already busy with as many starts as the per-agent limit.
+    """
+
+    max_concurrency: int
+    max_concurrency_per_agent: int
+
+    _queue: List[tuple]
+    _running: Set[asyncio.Task]
+    _running_per_agent: Dict[AgentId, int]
+
+    def __init__(self, max_concurrency: int, max_concurrency_per_agent: int) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_agent = max_concurrency_per_agent
+        self._queue = []
+        self._seq = itertools.count()
+        self._running = set()
+        self._running_per_agent = defaultdict(int)
+        self._metrics = _StartMetrics()
+        self._closed = False
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def num_running(self) -> int:
+        return len(self._running)
+
+    def submit(
+        self,
+        start_fn: Callable[[], Awaitable[None]],
+        *,
+        session_type: SessionTypes,
+        agent_ids: Collection[AgentId],
+    ) -> asyncio.Future:
+        """
+        Queue a session start and return a future resolved with its result.
+        """
+        if self._closed:
+            raise RuntimeError('The session start executor is already closed.')
+        loop = asyncio.get_running_loop()
+        job = _StartJob(start_fn, frozenset(agent_ids), loop.create_future(), time.perf_counter())
+        priority = SESSION_START_PRIORITIES.get(session_type, len(SESSION_START_PRIORITIES))
+        heapq.heappush(self._queue, (priority, next(self._seq), job))
+        self._dispatch()
+        return job.future
+
+    def _is_startable(self, job: _StartJob) -> bool:
+        return all(
+            self._running_per_agent[agent_id] < self.max_concurrency_per_agent
+            for agent_id in job.agent_ids
+        )
+
+    def _dispatch(self) -> None:
+        deferred = []
+        while self._queue and len(self._running) < self.max_concurrency:
+            item = heapq.heappop(self._queue)
+            job = item[2]
+            if job.future.cancelled():
+                continue
+            if not self._is_startable(job):
+                deferred.append(item)
+                continue
+            for agent_id in job.agent_ids:
+                self._running_per_agent[agent_id] += 1
+            task = asyncio.create_task(self._run(job))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+        for item in deferred:
+            heapq.heappush(self._queue, item)
+
+    async def _run(self, job: _StartJob) -> None:
+        started_at = time.perf_counter()
+        wait_time = started_at - job.enqueued_at
+        metrics = self._metrics
+        metrics.num_started += 1
+        metrics.total_wait_time += wait_time
+        metrics.max_wait_time = max(metrics.max_wait_time, wait_time)
+        try:
+            await job.start_fn()
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            self._metrics.num_failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(None)
+        finally:
+            run_time = time.perf_counter() - started_at
+            # The metrics may have been collected in the meantime.
+            metrics = self._metrics
+            metrics.num_finished += 1
+            metrics.total_run_time += run_time
+            metrics.max_run_time = max(metrics.max_run_time, run_time)
+            for agent_id in job.agent_ids:
+                self._running_per_agent[agent_id] -= 1
+                if self._running_per_agent[agent_id] <= 0:
+                    del self._running_per_agent[agent_id]
+            self._running.discard(asyncio.current_task())  # type: ignore
+            self._dispatch()
+
+    def collect_metrics(self) -> Mapping[str, float]:
+        """
+        Return the current queue status and the latency statistics of the starts
+        finished since the last collection.
+        """
+        metrics, self._metrics = self._metrics, _StartMetrics()
+        num_started = metrics.num_started
+        num_finished = metrics.num_finished
+        return {
+            'queue_depth': len(self._queue),
+            'running': len(self._running),
+            'started': num_started,
+            'finished': num_finished,
+            'failed': metrics.num_failed,
+            'avg_wait_time': metrics.total_wait_time / num_started if num_started else 0.0,
+            'max_wait_time': metrics.max_wait_time,
+            'avg_run_time': metrics.total_run_time / num_finished if num_finished else 0.0,
+            'max_run_time': metrics.max_run_time,
+        }
+
+    async def close(self) -> None:
+        """
+        Stop taking new starts and wait for the queued and running ones to finish.
+
+        The submitted sessions are already committed as PREPARING with their agent slots
+        and occupancy reserved, so cancelling them would bypass the rollback of
+        the failed starts and leave them stuck holding the resources.
+        """
+        self._closed = True
+        if self._queue or self._running:
+            log.info('waiting for {} queued and {} running session starts',
+                     len(self._queue), len(self._running))
+        while self._queue or self._running:
+            self._dispatch()
+            await asyncio.gather(*self._running, return_exceptions=True)
@@ -0,0 +1,240 @@
+"""
+Compact fixed-layout slot vectors for the resource arithmetic in the hot paths.
+
+:class:`ResourceSlot` keeps the slot amounts as Decimal values in a dict and
+synchronizes the keys of both operands in every arithmetic and comparison.
+A :class:`SlotVector` keeps them as fixed-point integers in a list ordered by
+an interned :class:`SlotLayout` (usually the known slot types), so that
+the scheduling passes and the allocatability checks run on plain integer operations.
+The conversion from/to :class:`ResourceSlot` should happen only at the API and DB boundaries.
+"""
+
+from __future__ import annotations
+
+from decimal import Decimal, ROUND_CEILING
+import math
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from ai.backend.common.types import ResourceSlot
+
+__all__ = (
+    'SLOT_SCALE',
+    'SlotLayout',
+    'SlotVector',
+    'from_fixed',
+    'sum_resource_slots',
+    'to_fixed',
+)
+
+# Slot amounts are stored as fixed-point integers with this precision,
+# which is finer than the quantum of user-provided slot amounts.
+SLOT_SCALE = 10 ** 6
+_DECIMAL_SCALE = Decimal(SLOT_SCALE)
+_DECIMAL_INFINITY = Decimal('Infinity')
+
+# Unlimited amounts (e.g., the default resource policy limits) are kept as infinite floats,
+# which are compared and added with the integers as expected.
+FixedAmount = Union[int, float]
+
+
+def to_fixed(value: Any, rounding: str = ROUND_CEILING) -> FixedAmount:
+    """
+    Convert a slot amount into a fixed-point integer.
+    Requested amounts should be rounded up and capacities should be rounded down.
+    """
+    value = Decimal(value)
+    if not value.is_finite():
+        if value.is_nan():
+            raise ValueError('cannot use NaN as a slot amount', value)
+        return math.inf if value > 0 else -math.inf
+    return int((value * _DECIMAL_SCALE).to_integral_value(rounding=rounding))
+
+
+def from_fixed(amount: FixedAmount) -> Decimal:
+    if isinstance(amount, float):
+        return _DECIMAL_INFINITY if amount > 0 else -_DECIMAL_INFINITY
+    return Decimal(amount) / _DECIMAL_SCALE
+
+
+class SlotLayout:
+    """
+    An interned ordering of slot names.
+    Vectors built from the same set of slot names share the same layout object,
+    so that checking the compatibility of two vectors is an identity comparison.
+    """
+
+    __slots__ = ('names', 'index')
+
+    names: Tuple[str, ...]
+    index: Mapping[str, int]
+
+    _interned: ClassVar[Dict[Tuple[str, ...], SlotLayout]] = {}
+
+    def __init__(self, names: Tuple[str, ...]) -> None:
+        self.names = names
+        self.index = {name: idx for idx, name in enumerate(names)}
+
+    @classmethod
+    def of(cls, slot_names: Iterable[str]) -> SlotLayout:
+        """
+        Return the layout of the given slot names, such as the keys of
+        ``ConfigServer.get_resource_slots()``.
+        """
+        names = tuple(sorted(set(slot_names)))
+        layout = cls._interned.get(names)
+        if layout is None:
+            layout = cls._interned.setdefault(names, cls(names))
+        return layout
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __repr__(self) -> str:
+        return f'<SlotLayout {list(self.names)}>'
+
+    def zeros(self) -> SlotVector:
+        return SlotVector(self, [0] * len(self.names))
+
+    def vectorize(
+        self,
+        slots: Optional[Mapping[str, Any]],
+        rounding: str = ROUND_CEILING,
+    ) -> SlotVector:
+        """
+        Convert the given slots into a vector of this layout.
+        The missing slot types are filled with zeros and the unknown slot types are ignored,
+        like ``ResourceSlot.normalize_slots(ignore_unknown=True)``.
+        """
+        values: List[FixedAmount] = [0] * len(self.names)
+        if slots:
+            index = self.index
+            for k, v in slots.items():
+                idx = index.get(k)
+                if idx is not None and v is not None:
+                    values[idx] = to_fixed(v, rounding)
+        return SlotVector(self, values)
+
+
+class SlotVector(Mapping[str, Decimal]):
+    """
+    A fixed-point slot vector of a :class:`SlotLayout`.
+
+    The arithmetic and comparison operators work element-wise like those of
+    :class:`ResourceSlot` but require both operands to share the same layout.
+    It also provides the read-only mapping interface returning Decimal amounts.
+    """
+
+    __slots__ = ('layout', 'amounts')
+
+    layout: SlotLayout
+    amounts: List[FixedAmount]
+
+    def __init__(self, layout: SlotLayout, amounts: List[FixedAmount]) -> None:
+        self.layout = layout
+        self.amounts = amounts
+
+    def _check_layout(self, other: SlotVector) -> List[FixedAmount]:
+        if other.layout is not self.layout:
+            raise ValueError('cannot operate on slot vectors of different layouts',
+                             self.layout, other.layout)
+        return other.amounts
+
+    def copy(self) -> SlotVector:
+        return SlotVector(self.layout, list(self.amounts))
+
+    def __add__(self, other: SlotVector) -> SlotVector:
+        other_values = self._check_layout(other)
+        return SlotVector(self.layout, [a + b for a, b in zip(self.amounts, other_values)])
+
+    def __sub__(self, other: SlotVector) -> SlotVector:
+        other_values = self._check_layout(other)
+        return SlotVector(self.layout, [a - b for a, b in zip(self.amounts, other_values)])
+
+    def __iadd__(self, other: SlotVector) -> SlotVector:
+        other_values = self._check_layout(other)
+        values = self.amounts
+        for idx, b in enumerate(other_values):
+            values[idx] += b
+        return self
+
+    def __isub__(self, other: SlotVector) -> SlotVector:
+        other_values = self._check_layout(other)
+        values = self.amounts
+        for idx, b in enumerate(other_values):
+            values[idx] -= b
+        return self
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, SlotVector):
+            return NotImplemented
+        return self.amounts == self._check_layout(other)
+
+    def __ne__(self, other: object) -> bool:
+        if not isinstance(other, SlotVector):
+            return NotImplemented
+        return self.amounts != self._check_layout(other)
+
+    __hash__ = None  # type: ignore  # mutable
+
+    def __le__(self, other: SlotVector) -> bool:
+        other_values = self._check_layout(other)
+        return all(a <= b for a, b in zip(self.amounts, other_values))
+
+    def __ge__(self, other: SlotVector) -> bool:
+        other_values = self._check_layout(other)
+        return all(a >= b for a, b in zip(self.amounts, other_values))
+
+    def minimum(self, *others: SlotVector) -> SlotVector:
+        """
+        Take the element-wise minimum of this and the given vectors.
+        """
+        values = list(self.amounts)
+        for other in others:
+            for idx, b in enumerate(self._check_layout(other)):
+                if b < values[idx]:
+                    values[idx] = b
+        return SlotVector(self.layout, values)
+
+    def __getitem__(self, key: str) -> Decimal:
+        return from_fixed(self.amounts[self.layout.index[key]])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.layout.names)
+
+    def __len__(self) -> int:
+        return len(self.layout.names)
+
+    def __repr__(self) -> str:
+        return f'SlotVector({self.to_json()!r})'
+
+    def to_slots(self, *, drop_zeros: bool = False) -> ResourceSlot:
+        return ResourceSlot({
+            k: from_fixed(v) for k, v in zip(self.layout.names, self.amounts)
+            if not (drop_zeros and v == 0)
+        })
+
+    def to_json(self) -> Mapping[str, str]:
+        return self.to_slots().to_json()
+
+
+def sum_resource_slots(items: Iterable[Mapping[str, Any]]) -> ResourceSlot:
+    """
+    Sum up the given slots with a single pass of dict updates, which is cheaper than
+    chaining ``ResourceSlot.__add__()`` that synchronizes the keys of both operands every time.
+    """
+    result: Dict[str, Decimal] = {}
+    for slots in items:
+        for k, v in slots.items():
+            result[k] = result.get(k, Decimal(0)) + v
+    return ResourceSlot(result)
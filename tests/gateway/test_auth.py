@@ -1,12 +1,17 @@
 from collections import UserDict
 from datetime import datetime, timedelta
+import hashlib, hmac
 import json
 import uuid
 
 from dateutil.tz import tzutc, gettz
 import pytest
 
-from ai.backend.gateway.auth import _extract_auth_params, check_date
+from ai.backend.gateway.auth import (
+    _extract_auth_params, check_date,
+    AuthCache, KeypairUsageRecorder, SigningKeyCache,
+    sign_request,
+)
 from ai.backend.gateway.server import config_server_ctx, database_ctx, monitoring_ctx
 from ai.backend.gateway.exceptions import InvalidAuthParameters
 
@@ -79,6 +84,113 @@ def test_check_date():
     assert check_date(request)
 
 
+def _make_sign_request(date, api_version, body=b''):
+    request = UserDict()
+    request.method = 'POST'
+    request.raw_path = '/auth/test'
+    request.host = 'api.example.com'
+    request.content_type = 'application/json'
+    request.can_read_body = bool(body)
+    request.headers = {'X-BackendAI-Version': api_version}
+    request['date'] = date
+    request['raw_date'] = date.isoformat()
+
+    async def read():
+        return body
+
+    request.read = read
+    return request
+
+
+def _expected_signature(request, secret_key, api_version, body=b''):
+    sign_bytes = (
+        f"POST\n/auth/test\n{request['raw_date']}\nhost:api.example.com\n"
+        f"content-type:application/json\nx-backendai-version:{api_version}\n"
+        f"{hashlib.sha256(body).hexdigest()}"
+    ).encode()
+    sign_key = hmac.new(secret_key.encode(), request['date'].strftime('%Y%m%d').encode(),
+                        'sha256').digest()
+    sign_key = hmac.new(sign_key, b'api.example.com', 'sha256').digest()
+    return hmac.new(sign_key, sign_bytes, 'sha256').hexdigest()
+
+
+@pytest.mark.asyncio
+async def test_sign_request_with_signing_key_cache():
+    cache = SigningKeyCache()
+    now = datetime.now(tzutc())
+    json_body = b'{"echo": "hello"}'
+    for api_version, body in [
+        ('v5.20191215', b''),
+        ('v4.20181215', b''),
+        ('v4.20180915', json_body),
+    ]:
+        request = _make_sign_request(now, api_version, body)
+        expected = _expected_signature(request, 'sk1', api_version, body)
+        assert await sign_request('HMAC-SHA256', request, 'sk1') == expected
+        for _ in range(2):
+            assert await sign_request(
+                'HMAC-SHA256', request, 'sk1',
+                access_key='ak1', signing_key_cache=cache,
+            ) == expected
+    assert len(cache) == 1
+
+    # A changed secret key is not served from the cache.
+    request = _make_sign_request(now, 'v5.20191215')
+    assert await sign_request(
+        'HMAC-SHA256', request, 'sk2',
+        access_key='ak1', signing_key_cache=cache,
+    ) == _expected_signature(request, 'sk2', 'v5.20191215')
+
+    # Only the latest two dates are kept.
+    for days in (1, 2):
+        request = _make_sign_request(now + timedelta(days=days), 'v5.20191215')
+        await sign_request('HMAC-SHA256', request, 'sk1', access_key='ak1', signing_key_cache=cache)
+    assert sorted(cache._data.keys()) == [
+        (now + timedelta(days=1)).strftime('%Y%m%d'),
+        (now + timedelta(days=2)).strftime('%Y%m%d'),
+    ]
+
+
+def test_auth_cache():
+    cache = AuthCache(maxsize=2, ttl=60.0)
+    gen = cache.generation
+    cache.put('ak1', {'v': 1}, gen)
+    cache.put('ak2', {'v': 2}, gen)
+    assert cache.get('ak1') == {'v': 1}
+    cache.put('ak3', {'v': 3}, gen)
+    # ak2 is the least recently used one.
+    assert cache.get('ak2') is None
+    assert len(cache) == 2
+
+    cache.invalidate(['ak1'])
+    assert cache.get('ak1') is None
+    assert cache.get('ak3') == {'v': 3}
+    # A row fetched before the invalidation must not be stored.
+    cache.put('ak1', {'v': 1}, gen)
+    assert cache.get('ak1') is None
+    cache.invalidate()
+    assert len(cache) == 0
+
+    cache = AuthCache(ttl=0.0)
+    cache.put('ak1', {'v': 1}, cache.generation)
+    assert cache.get('ak1') is None
+
+
+def test_keypair_usage_recorder():
+    recorder = KeypairUsageRecorder()
+    t1 = datetime(2020, 1, 1, tzinfo=tzutc())
+    t2 = t1 + timedelta(seconds=1)
+    recorder.record('ak1', t2)
+    recorder.record('ak1', t1)
+    recorder.record('ak2', t1)
+    assert recorder._usage == {'ak1': (t2, 2), 'ak2': (t1, 1)}
+    # A failed flush merges the usage back into the new records.
+    usage, recorder._usage = recorder._usage, {}
+    recorder.record('ak1', t1)
+    recorder._merge(usage)
+    assert recorder._usage == {'ak1': (t2, 3), 'ak2': (t1, 1)}
+
+
 @pytest.mark.asyncio
 async def test_authorize(etcd_fixture, database_fixture, create_app_and_client, get_headers):
     # The auth module requires config_server and database to be set up.
@@ -1,5 +1,6 @@
+import asyncio
 from pathlib import Path
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 
@@ -77,3 +78,81 @@ async def test_update_volumes_from_file(config_server, volumes):
 
     img_data = list(await config_server.etcd.get_prefix(f'volumes/{name}/mount'))
     assert 4 == len(img_data)
+
+
+@pytest.mark.asyncio
+async def test_image_catalog(mocker):
+    from ai.backend.common import etcd as common_etcd_mod
+    from ai.backend.gateway.etcd import ConfigServer
+    mocker.patch.object(common_etcd_mod, 'AsyncEtcd', MagicMock())
+    redis_image = MagicMock()
+    redis_image.pipeline.return_value.execute = AsyncMock(
+        side_effect=lambda: [['i-001'], []])
+    config_server = ConfigServer({'redis_image': redis_image}, None, None, None, 'test')
+    images = {
+        'index.docker.io': {
+            'lablup%2Fpython': {
+                '': '1',
+                '3.8': {'': 'sha256:1111', 'resource': {'cpu': {'min': '1'}}},
+                '3.9': {'': 'sha256:2222', 'resource': {}, 'labels': {'a': 'b'}},
+            },
+        },
+        '_aliases': {'python': 'index.docker.io/lablup/python:3.9'},
+    }
+
+    async def _get_prefix(key):
+        if key == 'config/docker/registry/':
+            return {'index.docker.io': 'https://registry-1.docker.io'}
+        if key == 'images/_aliases':
+            return images['_aliases']
+        if key == 'images':
+            return images
+        raise AssertionError(key)
+
+    watch_events: asyncio.Queue = asyncio.Queue()
+
+    async def _watch_prefix(prefix, *, ready_event):
+        ready_event.set()
+        while True:
+            yield await watch_events.get()
+
+    config_server.etcd.get_prefix = AsyncMock(side_effect=_get_prefix)
+    config_server.etcd.watch_prefix = _watch_prefix
+    config_server.etcd.put = AsyncMock()
+    config_server.etcd.close = AsyncMock()
+
+    def _num_builds():
+        return sum(1 for call in config_server.etcd.get_prefix.await_args_list
+                   if call.args == ('images',))
+
+    # Without the watcher, every call rebuilds the catalog.
+    items = await config_server.list_images()
+    await config_server.list_images()
+    assert _num_builds() == 2
+    assert [(item['tag'], item['installed'], item['aliases']) for item in items] == [
+        ('3.8', True, []),
+        ('3.9', False, ['python']),
+    ]
+    assert items[0]['installed_agents'] == ['i-001']
+    assert items[1]['labels'] == {'a': 'b'}
+
+    config_server.start_image_catalog_watcher()
+    await asyncio.sleep(0)
+    await asyncio.gather(*[config_server.list_images() for _ in range(3)])
+    assert _num_builds() == 3
+    # The installation status is still read for each call with a single pipelined call.
+    assert redis_image.pipeline.return_value.execute.await_count == 5
+    catalog = await config_server.get_image_catalog()
+
+    await watch_events.put(object())
+    await asyncio.sleep(0)
+    new_catalog = await config_server.get_image_catalog()
+    assert new_catalog.version > catalog.version
+    assert _num_builds() == 4
+
+    await config_server.alias('py', 'index.docker.io/lablup/python:3.8')
+    await config_server.get_image_catalog()
+    assert _num_builds() == 5
+
+    await config_server.close()
+    assert not config_server._image_catalog_watchers
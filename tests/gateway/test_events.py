@@ -1,8 +1,15 @@
 import asyncio
+import uuid
 
 from aiohttp import web
 import pytest
 
+from ai.backend.gateway.events import (
+    SessionEventQueue,
+    SessionEventRouter,
+    SessionEventSubscription,
+    sentinel,
+)
 from ai.backend.gateway.server import (
     config_server_ctx, event_dispatcher_ctx, background_task_ctx,
 )
@@ -49,6 +56,72 @@ async def test_dispatch(etcd_fixture, create_app_and_client):
     await dispatcher.close()
 
 
+@pytest.mark.asyncio
+async def test_dispatch_via_stream(etcd_fixture, test_config, create_app_and_client, monkeypatch):
+    monkeypatch.setitem(test_config['manager'], 'event-transport', 'redis-stream')
+    app, client = await create_app_and_client(
+        [config_server_ctx, event_dispatcher_ctx],
+        ['.events'],
+    )
+    dispatcher = app['event_dispatcher']
+
+    records = []
+    event_name = 'test-event-03'
+
+    async def consumer_cb(app_ctx: web.Application, agent_id: AgentId, event_name: str, idx: int):
+        records.append(('consumer', idx))
+
+    async def subscriber_cb(app_ctx: web.Application, agent_id: AgentId, event_name: str, idx: int):
+        records.append(('subscriber', idx))
+
+    dispatcher.consume(event_name, app, consumer_cb)
+    dispatcher.subscribe(event_name, app, subscriber_cb)
+    await asyncio.sleep(0.2)
+
+    # Concurrently produced events are written in batches.
+    await asyncio.gather(*[
+        dispatcher.produce_event(event_name, (idx, ), agent_id='i-test')
+        for idx in range(10)
+    ])
+    await asyncio.sleep(0.5)
+    assert sorted(idx for kind, idx in records if kind == 'consumer') == [*range(10)]
+    assert sorted(idx for kind, idx in records if kind == 'subscriber') == [*range(10)]
+    pending = await dispatcher.redis_producer.xpending('events.stream', 'manager')
+    assert pending[0] == 0
+
+    await dispatcher.redis_producer.flushdb()
+    await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_dispatch_waiters(etcd_fixture, create_app_and_client):
+    app, client = await create_app_and_client(
+        [config_server_ctx, event_dispatcher_ctx],
+        ['.events'],
+    )
+    dispatcher = app['event_dispatcher']
+
+    waiter = dispatcher.add_waiter('k-01', ('kernel_started', 'kernel_terminated'))
+    other_waiter = dispatcher.add_waiter('k-02', ('kernel_started', ))
+    try:
+        await dispatcher.produce_event('kernel_started', ('k-01', ), agent_id='i-test',
+                                       data={'status': 'RUNNING', 'service_ports': []})
+        event = await asyncio.wait_for(waiter.get(), timeout=1.0)
+        assert event.event_name == 'kernel_started'
+        assert event.agent_id == AgentId('i-test')
+        assert event.args == ('k-01', )
+        assert event.data == {'status': 'RUNNING', 'service_ports': []}
+        # Only the waiter of the matching key is woken up.
+        assert other_waiter.queue.empty()
+    finally:
+        dispatcher.remove_waiter(waiter)
+        dispatcher.remove_waiter(other_waiter)
+    assert not dispatcher.waiters
+
+    await dispatcher.redis_producer.flushdb()
+    await dispatcher.close()
+
+
 @pytest.mark.asyncio
 async def test_error_on_dispatch(etcd_fixture, create_app_and_client, event_loop):
 
@@ -178,3 +251,67 @@ async def test_background_task_fail(etcd_fixture, create_app_and_client):
     finally:
         await dispatcher.redis_producer.flushdb()
         await dispatcher.close()
+
+
+@pytest.mark.asyncio
+async def test_session_event_router():
+    router = SessionEventRouter()
+    user_uuid = uuid.uuid4()
+    group_id = uuid.uuid4()
+    session_id = uuid.uuid4()
+    row = {
+        'id': session_id,
+        'session_id': session_id,
+        'session_name': 'mysess',
+        'access_key': 'AKIA-01',
+        'domain_name': 'default',
+        'group_id': group_id,
+        'user_uuid': user_uuid,
+    }
+    user_sub = SessionEventSubscription(
+        SessionEventQueue(), domain_name='default', user_uuid=user_uuid,
+    )
+    other_user_sub = SessionEventSubscription(
+        SessionEventQueue(), domain_name='default', user_uuid=uuid.uuid4(),
+    )
+    session_sub = SessionEventSubscription(
+        SessionEventQueue(), scope='session', session_id=session_id,
+    )
+    named_sub = SessionEventSubscription(
+        SessionEventQueue(), access_key='AKIA-02', session_name='mysess',
+    )
+    admin_sub = SessionEventSubscription(SessionEventQueue(), domain_name='default')
+    for sub in (user_sub, other_user_sub, session_sub, named_sub, admin_sub):
+        router.add(sub)
+    assert len(router) == 5
+
+    router.route('kernel_started', row, None, coalesce_key=('kernel', session_id))
+    assert len(user_sub.queue) == 1
+    assert len(admin_sub.queue) == 1
+    assert len(other_user_sub.queue) == 0
+    assert len(session_sub.queue) == 0  # out of scope
+    assert len(named_sub.queue) == 0  # owned by another keypair
+    assert await user_sub.queue.get() == ('kernel_started', row, None)
+
+    router.route('session_started', row, None, coalesce_key=('session', session_id))
+    assert len(session_sub.queue) == 1
+
+    router.remove(user_sub)
+    router.remove(user_sub)
+    assert len(router) == 4
+    router.close()
+    assert await other_user_sub.queue.get() is sentinel
+
+
+@pytest.mark.asyncio
+async def test_session_event_queue_coalescing():
+    queue = SessionEventQueue(maxsize=2)
+    queue.put_nowait('k1-preparing', ('kernel', 'k1'))
+    queue.put_nowait('k2-preparing', ('kernel', 'k2'))
+    # The pending event of the same kernel is replaced.
+    queue.put_nowait('k1-started', ('kernel', 'k1'))
+    # The oldest pending event is dropped.
+    queue.put_nowait('k3-preparing', ('kernel', 'k3'))
+    assert queue.num_dropped == 2
+    queue.put_nowait(sentinel)
+    assert [await queue.get() for _ in range(3)] == ['k1-started', 'k3-preparing', sentinel]
@@ -1,3 +1,4 @@
+from collections import defaultdict
 import json
 
 import pytest
@@ -40,3 +41,49 @@ async def test_check_rlim_for_authorized_query(etcd_fixture, database_fixture,
     assert '30000' == ret.headers['X-RateLimit-Limit']
     assert '29999' == ret.headers['X-RateLimit-Remaining']
     assert str(rlim._rlim_window) == ret.headers['X-RateLimit-Window']
+
+
+def test_approximate_rate_limiter_counts():
+    limiter = rlim.ApproximateRateLimiter(None, window=900, sub_window=60)
+    assert limiter.check('ak1') == 1
+    assert limiter.check('ak1') == 2
+    assert limiter.check('ak2') == 1
+
+    # 15 full sub-windows plus the oldest one covered by the remaining 3/4 of it.
+    now = 60 * 100 + 15
+    keys = limiter._sub_window_keys('ak1', now)
+    assert len(keys) == 16
+    assert keys[0] == 'ak1:85' and keys[-1] == 'ak1:100'
+    assert limiter._rolling_count(['40', *([None] * 14), '2'], now) == 32
+
+    pending, limiter._pending = limiter._pending, defaultdict(int)
+    limiter._totals['ak3'] = 5
+    limiter._update_totals(
+        ['ak1', 'ak2', 'ak3'], pending,
+        [2, True, [None] * 15 + ['10'],
+         1, True, [None] * 15 + ['1'],
+         [None] * 16],
+        now,
+    )
+    assert limiter._totals == {'ak1': 10, 'ak2': 1}
+    assert limiter.check('ak1') == 11
+
+
+@pytest.mark.asyncio
+async def test_check_rlim_for_authorized_query_approximate(etcd_fixture, database_fixture,
+                                                           test_config, create_app_and_client,
+                                                           get_headers, monkeypatch):
+    monkeypatch.setitem(test_config['manager'], 'rate-limit-mode', 'approximate')
+    app, client = await create_app_and_client(
+        [config_server_ctx, redis_ctx, database_ctx, monitoring_ctx],
+        ['.auth', '.ratelimit'],
+    )
+    url = '/auth/test'
+    for remaining in ('29999', '29998'):
+        req_bytes = json.dumps({'echo': 'hello!'}).encode()
+        headers = get_headers('POST', url, req_bytes)
+        ret = await client.post(url, data=req_bytes, headers=headers)
+        assert ret.status == 200
+        assert '30000' == ret.headers['X-RateLimit-Limit']
+        assert remaining == ret.headers['X-RateLimit-Remaining']
+        assert str(rlim._rlim_window) == ret.headers['X-RateLimit-Window']
@@ -0,0 +1,89 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from ai.backend.manager.metadata_cache import (
+    MetadataCache,
+    handle_metadata_cache_invalidation,
+)
+
+
+def _create_cache(ttl=60.0):
+    config_server = MagicMock()
+    config_server.get = AsyncMock(side_effect=lambda key: f'value-of-{key}')
+    event_dispatcher = MagicMock()
+    event_dispatcher.produce_event = AsyncMock()
+    return MetadataCache(config_server, MagicMock(), event_dispatcher, ttl=ttl)
+
+
+@pytest.mark.asyncio
+async def test_metadata_cache_single_flight_and_ttl():
+    cache = _create_cache()
+    results = await asyncio.gather(*[cache.get_config('config/x') for _ in range(5)])
+    assert results == ['value-of-config/x'] * 5
+    assert await cache.get_config('config/y') == 'value-of-config/y'
+    # Concurrent lookups of the same key share a single query.
+    assert cache.config_server.get.await_count == 2
+
+    stats = cache.collect_stats()
+    assert stats['config.hits'] == 4
+    assert stats['config.misses'] == 2
+    assert stats['config.hit_rate'] == pytest.approx(4 / 6)
+    assert stats['config.entries'] == 2
+    assert stats['resource_policy.hits'] == 0
+    # The counters are reset after the collection.
+    assert cache.collect_stats()['config.hits'] == 0
+
+    await cache.get_config('config/x')
+    assert cache.config_server.get.await_count == 2
+    assert cache.collect_stats()['config.max_age'] >= 0
+
+    expiring_cache = _create_cache(ttl=0.0)
+    await expiring_cache.get_config('config/x')
+    await expiring_cache.get_config('config/x')
+    assert expiring_cache.config_server.get.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_metadata_cache_does_not_keep_failures():
+    cache = _create_cache()
+    cache.config_server.get = AsyncMock(side_effect=[RuntimeError('etcd failure'), 'recovered'])
+    with pytest.raises(RuntimeError):
+        await cache.get_config('config/x')
+    assert len(cache) == 0
+    assert await cache.get_config('config/x') == 'recovered'
+    assert await cache.get_config('config/x') == 'recovered'
+    assert cache.config_server.get.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_metadata_cache_invalidation():
+    cache = _create_cache()
+    await cache.get_config('config/x')
+    await cache.get_config('config/y')
+
+    cache.invalidate('config', ['config/x'])
+    assert len(cache) == 1
+    await cache.get_config('config/x')
+    await cache.get_config('config/y')
+    assert cache.config_server.get.await_count == 3
+
+    # Other processes are notified via an event.
+    await cache.broadcast_invalidation('config')
+    assert len(cache) == 0
+    cache.event_dispatcher.produce_event.assert_awaited_once_with(
+        'metadata_cache_invalidated', ('config',))
+
+    await cache.get_config('config/x')
+    await handle_metadata_cache_invalidation(cache, 'manager', 'metadata_cache_invalidated',
+                                             'config', ['config/x'])
+    assert len(cache) == 0
+    assert cache.collect_stats()['config.invalidations'] == 3
+
+    # Invalidating the images also clears the slot ranges and the image catalog
+    # cached by the config server.
+    await handle_metadata_cache_invalidation(cache, 'manager', 'metadata_cache_invalidated',
+                                             'image')
+    cache.config_server.get_image_slot_ranges.cache_clear.assert_called_once_with()
+    cache.config_server.invalidate_image_catalog.assert_called_once_with()
@@ -2,13 +2,18 @@ from typing import (
     Any,
     Mapping,
 )
+from decimal import Decimal
 from unittest.mock import MagicMock, AsyncMock
+import uuid
 
 import snappy
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.sql.dml import Insert, Update
 
-from ai.backend.manager.registry import AgentRegistry
-from ai.backend.manager.models import AgentStatus
+from ai.backend.manager.registry import AgentRegistry, ClusterSSHKeyPairPool
+from ai.backend.manager.models import AgentStatus, KernelStatus, kernels
+from ai.backend.manager.models.resource_usage import repair_resource_usage_drift
+from ai.backend.manager.models.utils import execute_bulk_update
 from ai.backend.common import msgpack
 from ai.backend.common.types import ResourceSlot
 from ai.backend.common.plugin.hook import HookPluginContext
@@ -97,6 +102,7 @@ async def test_handle_heartbeat(mocker):
         'scaling_group': 'sg-testing',
         'available_slots': ResourceSlot({'cpu': '1', 'mem': '1g'}),
         'clusterized': True,
+        'version': '19.12.0',
     })
     await registry.handle_heartbeat('i-001', {
         'scaling_group': 'sg-testing',
@@ -123,6 +129,7 @@ async def test_handle_heartbeat(mocker):
         'scaling_group': 'sg-testing',
         'available_slots': ResourceSlot({'cpu': '1', 'mem': '1g'}),
         'clusterized': True,
+        'version': '19.12.0',
     })
     await registry.handle_heartbeat('i-001', {
         'scaling_group': 'sg-testing2',
@@ -143,3 +150,263 @@ async def test_handle_heartbeat(mocker):
     assert q.parameters['scaling_group'] == 'sg-testing2'
     assert 'compute_plugins' in q.parameters
     assert 'version' in q.parameters
+
+
+async def test_bulk_update_kernels():
+    mock_dbconn = MagicMock()
+    mock_dbresult = MagicMock()
+    mock_dbresult.rowcount = 2
+    mock_dbconn.execute = AsyncMock(return_value=mock_dbresult)
+    kernel_ids = [uuid.uuid4() for _ in range(3)]
+    per_kernel_updates = {
+        kernel_ids[0]: {'status': KernelStatus.RUNNING, 'repl_in_port': 2000},
+        kernel_ids[1]: {'status': KernelStatus.RUNNING, 'repl_in_port': 2002},
+        kernel_ids[2]: {'last_stat': {'cpu_util': 1}},
+    }
+    await execute_bulk_update(mock_dbconn, kernels, kernels.c.id, per_kernel_updates)
+    # The kernels updating the same columns share a single query.
+    assert mock_dbconn.execute.await_count == 2
+
+    q = mock_dbconn.execute.await_args_list[0].args[0]
+    assert isinstance(q, Update)
+    compiled = q.compile(dialect=postgresql.dialect())
+    sql = str(compiled)
+    assert sql.count('UNION ALL') == 1
+    assert 'WHERE kernels.id = v.id' in sql
+    assert 'CAST(%(param_2)s AS kernelstatus)' in sql
+    assert set(compiled.params.values()) == {
+        kernel_ids[0], kernel_ids[1], KernelStatus.RUNNING, 2000, 2002,
+    }
+
+    # A single row falls back to an ordinary update.
+    q = mock_dbconn.execute.await_args_list[1].args[0]
+    assert isinstance(q, Update)
+    assert q.parameters['last_stat'] == {'cpu_util': 1}
+    assert 'UNION ALL' not in str(q.compile(dialect=postgresql.dialect()))
+
+
+async def test_sync_kernel_stats_in_one_round_trip():
+    mock_dbconn = MagicMock()
+    mock_dbconn_ctx = MagicMock()
+    mock_dbconn_ctx.__aenter__ = AsyncMock(return_value=mock_dbconn)
+    mock_dbconn_ctx.__aexit__ = AsyncMock()
+    mock_dbtxn_ctx = MagicMock()
+    mock_dbtxn_ctx.__aenter__ = AsyncMock()
+    mock_dbtxn_ctx.__aexit__ = AsyncMock()
+    mock_dbconn.begin = MagicMock(return_value=mock_dbtxn_ctx)
+    mock_dbconn.execute = AsyncMock(return_value=MagicMock(rowcount=1))
+    mock_dbpool = MagicMock()
+    mock_dbpool.acquire = MagicMock(return_value=mock_dbconn_ctx)
+    kernel_ids = [uuid.uuid4() for _ in range(3)]
+    mock_redis_stat = MagicMock()
+    mock_redis_stat.evalsha = AsyncMock(return_value=[
+        ['string', msgpack.packb({'cpu_util': {'current': '10'}}).hex()],
+        ['hash', [
+            'cpu_used', '12.5', 'mem_max_bytes', '1024',
+            'net_rx_bytes', '1', 'net_tx_bytes', '2',
+            'io_read_bytes', '3', 'io_write_bytes', '4',
+            'io_max_scratch_size', '5',
+        ]],
+        ['none'],
+    ])
+    registry = AgentRegistry(
+        config_server=MagicMock(),
+        dbpool=mock_dbpool,
+        redis_stat=mock_redis_stat,
+        redis_live=MagicMock(),
+        redis_image=MagicMock(),
+        event_dispatcher=MagicMock(),
+        storage_manager=None,
+        hook_plugin_ctx=None,
+    )
+    await registry.sync_kernel_stats(kernel_ids)
+
+    # The script is invoked by its digest instead of sending the whole script.
+    mock_redis_stat.evalsha.assert_awaited_once()
+    kwargs = mock_redis_stat.evalsha.await_args.kwargs
+    assert kwargs['keys'] == [str(kernel_id) for kernel_id in kernel_ids]
+    assert kwargs['args'] == []
+    # The string-typed and the hash-typed stats update different columns.
+    assert mock_dbconn.execute.await_count == 2
+    q = mock_dbconn.execute.await_args_list[0].args[0]
+    assert q.parameters['last_stat'] == {'cpu_util': {'current': '10'}}
+    q = mock_dbconn.execute.await_args_list[1].args[0]
+    assert q.parameters['cpu_used'] == 12
+    assert q.parameters['io_max_scratch_size'] == 5
+
+
+async def test_handle_heartbeat_skips_unchanged_updates(mocker):
+    mock_dbpool = MagicMock()
+    mock_dbconn = MagicMock()
+    mock_dbconn_ctx = MagicMock()
+    mock_dbtxn_ctx = MagicMock()
+    mock_dbresult = MagicMock()
+    mock_dbresult.rowcount = 1
+    mock_dbresult.first = AsyncMock(return_value=None)
+    mock_dbpool.acquire = MagicMock(return_value=mock_dbconn_ctx)
+    mock_dbconn_ctx.__aenter__ = AsyncMock(return_value=mock_dbconn)
+    mock_dbconn_ctx.__aexit__ = AsyncMock(return_value=None)
+    mock_dbconn.execute = AsyncMock(return_value=mock_dbresult)
+    mock_dbconn.begin = MagicMock(return_value=mock_dbtxn_ctx)
+    mock_dbtxn_ctx.__aenter__ = AsyncMock()
+    mock_dbtxn_ctx.__aexit__ = AsyncMock(return_value=None)
+    mock_config_server = MagicMock()
+    mock_config_server.update_resource_slots = AsyncMock()
+    mock_redis_live = MagicMock()
+    mock_redis_live.hset = AsyncMock()
+    mock_redis_image = MagicMock()
+    mock_get_known_registries = AsyncMock(return_value=[
+        {'index.docker.io': 'https://registry-1.docker.io'},
+    ])
+    mocker.patch('ai.backend.manager.registry.get_known_registries', mock_get_known_registries)
+    mock_redis_wrapper = MagicMock()
+    mock_redis_wrapper.execute_with_retries = AsyncMock()
+    mocker.patch('ai.backend.manager.registry.redis', mock_redis_wrapper)
+    mock_hook_plugin_ctx = MagicMock()
+    mock_hook_plugin_ctx.notify = AsyncMock()
+
+    registry = AgentRegistry(
+        config_server=mock_config_server,
+        dbpool=mock_dbpool,
+        redis_stat=MagicMock(),
+        redis_live=mock_redis_live,
+        redis_image=mock_redis_image,
+        event_dispatcher=MagicMock(),
+        storage_manager=None,
+        hook_plugin_ctx=mock_hook_plugin_ctx,
+    )
+    await registry.init()
+
+    def _make_agent_info(images):
+        return {
+            'scaling_group': 'sg-testing',
+            'resource_slots': {'cpu': ('count', '1'), 'mem': ('bytes', '1g')},
+            'region': 'ap-northeast-2',
+            'addr': '10.0.0.5',
+            'version': '19.12.0',
+            'compute_plugins': [],
+            'images': snappy.compress(msgpack.packb([(image, ) for image in images])),
+        }
+
+    # Join
+    await registry.handle_heartbeat('i-001', _make_agent_info(['lablup/python:3.6']))
+    assert mock_dbconn.execute.await_count == 2
+    assert mock_redis_wrapper.execute_with_retries.await_count == 1
+
+    # Unchanged heartbeats neither query the DB nor update the image index.
+    mock_dbconn.execute.reset_mock()
+    mock_redis_wrapper.execute_with_retries.reset_mock()
+    await registry.handle_heartbeat('i-001', _make_agent_info(['lablup/python:3.6']))
+    mock_dbconn.execute.assert_not_awaited()
+    mock_redis_wrapper.execute_with_retries.assert_not_awaited()
+    assert mock_redis_live.hset.await_count == 2
+    # The known registries are cached.
+    mock_get_known_registries.assert_awaited_once()
+
+    # The changed images are synchronized with the agent's reverse index.
+    await registry.handle_heartbeat('i-001', _make_agent_info(['lablup/python:3.7']))
+    mock_dbconn.execute.assert_not_awaited()
+    script_invoker = mock_redis_wrapper.execute_with_retries.await_args.args[0]
+    script_invoker()
+    assert mock_redis_image.eval.call_args.kwargs['keys'] == ['agent-images.i-001']
+    assert mock_redis_image.eval.call_args.kwargs['args'] == [
+        'i-001', 'index.docker.io/lablup/python:3.7',
+    ]
+
+
+class _MockResult:
+    # Mimics aiopg's execute() result, which can be either awaited or iterated.
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.rowcount = len(rows)
+
+    def __await__(self):
+        yield from []
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for row in self.rows:
+            yield row
+
+
+async def test_repair_resource_usage_drift():
+    group_id = uuid.uuid4()
+    mock_dbconn = MagicMock()
+    mock_dbconn.execute = MagicMock(side_effect=[
+        # keypairs to check
+        _MockResult([
+            {'access_key': 'AKIA-OK', 'concurrency_used': 1,
+             'occupied_slots': ResourceSlot({'cpu': Decimal(2)})},
+            {'access_key': 'AKIA-DRIFTED', 'concurrency_used': 2,
+             'occupied_slots': ResourceSlot({'cpu': Decimal(2)})},
+            {'access_key': 'AKIA-LEAKED', 'concurrency_used': 1,
+             'occupied_slots': ResourceSlot({'cpu': Decimal(1)})},
+        ]),
+        # groups to check
+        _MockResult([{'id': group_id, 'occupied_slots': ResourceSlot({'cpu': Decimal(3)})}]),
+        # domains to check
+        _MockResult([{'name': 'default', 'occupied_slots': ResourceSlot({'cpu': Decimal(5)})}]),
+        # agents to check
+        _MockResult([{'id': 'i-ok', 'occupied_slots': ResourceSlot({'cpu': Decimal(4)})}]),
+        # live kernels
+        _MockResult([
+            {'access_key': 'AKIA-OK', 'group_id': group_id, 'domain_name': 'default',
+             'agent': 'i-ok', 'cluster_role': 'main', 'status': KernelStatus.RUNNING,
+             'occupied_slots': {'cpu': Decimal(2)}},
+            {'access_key': 'AKIA-DRIFTED', 'group_id': group_id, 'domain_name': 'default',
+             'agent': 'i-ok', 'cluster_role': 'main', 'status': KernelStatus.RUNNING,
+             'occupied_slots': {'cpu': Decimal(1)}},
+            {'access_key': 'AKIA-DRIFTED', 'group_id': group_id, 'domain_name': 'default',
+             'agent': 'i-ok', 'cluster_role': 'sub', 'status': KernelStatus.TERMINATING,
+             'occupied_slots': {'cpu': Decimal(1)}},
+        ]),
+        # bulk update of keypairs
+        _MockResult([None, None]),
+        # update of domains
+        _MockResult([None]),
+    ])
+    num_repairs = await repair_resource_usage_drift(mock_dbconn)
+    assert num_repairs == {'keypairs': 2, 'groups': 0, 'domains': 1, 'agents': 0}
+    assert mock_dbconn.execute.call_count == 7
+
+    # Only the diverged rows are updated.
+    q = mock_dbconn.execute.call_args_list[5].args[0]
+    compiled = q.compile(dialect=postgresql.dialect())
+    params = [v for v in compiled.params.values() if isinstance(v, str)]
+    assert 'AKIA-DRIFTED' in params
+    assert 'AKIA-LEAKED' in params
+    assert 'AKIA-OK' not in params
+    q = mock_dbconn.execute.call_args_list[6].args[0]
+    assert q.parameters['occupied_slots'] == ResourceSlot({'cpu': Decimal(3)})
+
+
+async def test_cluster_ssh_keypair_pool():
+    pool = ClusterSSHKeyPairPool(2)
+    try:
+        pool.refill()
+        await pool._refill_task
+        assert len(pool) == 2
+        keypair = await pool.acquire()
+        assert keypair['public_key'].startswith('ssh-rsa ')
+        assert keypair['public_key'].endswith(' work@cluster.backend.ai.local')
+        assert 'PRIVATE KEY' in keypair['private_key']
+        # Taking a keypair starts refilling the pool.
+        await pool._refill_task
+        assert len(pool) == 2
+        keypairs = [await pool.acquire() for _ in range(3)]
+        # The last one is generated on demand as the pool has run dry.
+        assert len({kp['private_key'] for kp in keypairs}) == 3
+    finally:
+        await pool.close()
+    assert len(pool) == 0
+
+    pool = ClusterSSHKeyPairPool(0)
+    try:
+        assert (await pool.acquire())['public_key'].startswith('ssh-rsa ')
+        assert pool._refill_task is None
+    finally:
+        await pool.close()
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 from decimal import Decimal
 from typing import (
     Any,
@@ -11,6 +12,7 @@ from unittest.mock import AsyncMock, MagicMock
 from uuid import uuid4, UUID
 from pprint import pprint
 
+import aioredlock
 import attr
 from dateutil.parser import parse as dtparse
 import pytest
@@ -21,18 +23,37 @@ from ai.backend.common.types import (
     ResourceSlot, SessionTypes,
 )
 
+from ai.backend.gateway.exceptions import InstanceNotAvailable
 from ai.backend.manager.defs import DEFAULT_ROLE
 from ai.backend.manager.scheduler import (
     KernelInfo,
     PendingSession,
     ExistingSession,
     AgentContext,
+    PredicateSnapshot,
+    SchedulingContext,
+    SchedulingSnapshot,
+)
+from ai.backend.manager.scheduler.backfill import (
+    may_fit_into,
+    reserve_agents_for_blocked_session,
+)
+from ai.backend.manager.scheduler.capacity import AgentCapacityMatrix, AgentSelectionStrategy
+from ai.backend.manager.scheduler.dispatcher import (
+    load_scheduler,
+    ScheduledSession,
+    SchedulerDispatcher,
+    SessionQueueView,
 )
-from ai.backend.manager.scheduler.dispatcher import load_scheduler
 from ai.backend.manager.scheduler.fifo import FIFOSlotScheduler, LIFOSlotScheduler
 from ai.backend.manager.scheduler.drf import DRFScheduler
 from ai.backend.manager.scheduler.mof import MOFScheduler
-from ai.backend.manager.scheduler.predicates import check_reserved_batch_session
+from ai.backend.manager.scheduler.predicates import (
+    check_keypair_resource_limit,
+    check_reserved_batch_session,
+)
+from ai.backend.manager.scheduler.simulation import SimulationConfig, run_simulation
+from ai.backend.manager.scheduler.starter import SessionStartExecutor
 
 
 def test_load_intrinsic():
@@ -707,20 +728,22 @@ async def test_multiple_timezones_for_reserved_batch_session_predicate(mock_dt):
     mock_sched_ctx = MagicMock()
     mock_sess_ctx = MagicMock()
     mock_sess_ctx.session_type = SessionTypes.BATCH
-    mock_sess_ctx.kernel_id = 'fake-kernel-id'
+    mock_sess_ctx.session_id = 'fake-session-id'
+    session_starts_at = {}
+    mock_sched_ctx.predicate_snapshot.session_starts_at = session_starts_at
 
     now = '2020-06-29T00:00:00+00:00'
     mock_dt.now = MagicMock(return_value=dtparse(now))
 
     # Start time is not yet reached (now < start time)
     start_time = '2020-06-29T00:00:01+00:00'
-    mock_db_conn.scalar = AsyncMock(return_value=dtparse(start_time))
+    session_starts_at[mock_sess_ctx.session_id] = dtparse(start_time)
     result = await check_reserved_batch_session(mock_db_conn, mock_sched_ctx, mock_sess_ctx)
     assert not result.passed, (now, start_time)
 
     # Start time is reached (now > start time)
     start_time = '2020-06-28T23:59:59+00:00'
-    mock_db_conn.scalar = AsyncMock(return_value=dtparse(start_time))
+    session_starts_at[mock_sess_ctx.session_id] = dtparse(start_time)
     result = await check_reserved_batch_session(mock_db_conn, mock_sched_ctx, mock_sess_ctx)
     assert result.passed, (now, start_time)
 
@@ -728,7 +751,7 @@ async def test_multiple_timezones_for_reserved_batch_session_predicate(mock_dt):
     # Note that 6/29 00:00 (UTC) < 6/29 00:00 (-09:00) == 6/29 09:00 (UTC)
     for i in range(1, 12):
         start_time = f'2020-06-29T00:00:00-{i:02d}:00'
-        mock_db_conn.scalar = AsyncMock(return_value=dtparse(start_time))
+        session_starts_at[mock_sess_ctx.session_id] = dtparse(start_time)
         result = await check_reserved_batch_session(mock_db_conn, mock_sched_ctx, mock_sess_ctx)
         assert not result.passed, (now, start_time)
 
@@ -736,14 +759,451 @@ async def test_multiple_timezones_for_reserved_batch_session_predicate(mock_dt):
     # Note that 6/29 00:00 (UTC) > 6/29 00:00 (+09:00) == 6/28 15:00 (UTC)
     for i in range(1, 12):
         start_time = f'2020-06-29T00:00:00+{i:02d}:00'
-        mock_db_conn.scalar = AsyncMock(return_value=dtparse(start_time))
+        session_starts_at[mock_sess_ctx.session_id] = dtparse(start_time)
         result = await check_reserved_batch_session(mock_db_conn, mock_sched_ctx, mock_sess_ctx)
         assert result.passed, (now, start_time)
 
     # Should pass if start time is not specified (start immediately).
-    mock_db_conn.scalar = AsyncMock(return_value=None)
+    session_starts_at[mock_sess_ctx.session_id] = None
     result = await check_reserved_batch_session(mock_db_conn, mock_sched_ctx, mock_sess_ctx)
     assert result.passed
 
 
+@pytest.mark.asyncio
+async def test_scheduling_snapshot_reservation(example_agents):
+    snapshot = SchedulingSnapshot('sg01', example_agents)
+    assert snapshot.total_capacity == ResourceSlot({
+        'cpu': Decimal('7.0'),
+        'mem': Decimal('6656'),
+        'cuda.shares': Decimal('5.0'),
+        'rocm.devices': Decimal('10'),
+    })
+    requested_slots = ResourceSlot({'cpu': Decimal('1.0'), 'mem': Decimal('512')})
+
+    async with snapshot.begin():
+        alloc_ctx = snapshot.reserve(AgentId('i-001'), requested_slots)
+    assert alloc_ctx.agent_addr == '10.0.1.1:6001'
+    assert alloc_ctx.scaling_group == 'sg01'
+    agent = snapshot.get_agent(AgentId('i-001'))
+    assert agent is not None
+    assert agent.occupied_slots['cpu'] == Decimal('1.0')
+    assert snapshot.reserved_slots[AgentId('i-001')]['mem'] == Decimal('512')
+
+    # Reservations inside a failed block should be reverted.
+    with pytest.raises(ZeroDivisionError):
+        async with snapshot.begin():
+            snapshot.reserve(AgentId('i-001'), requested_slots)
+            snapshot.reserve(AgentId('i-101'), requested_slots)
+            1 / 0
+    assert agent.occupied_slots['cpu'] == Decimal('1.0')
+    assert snapshot.reserved_slots[AgentId('i-001')]['cpu'] == Decimal('1.0')
+    assert snapshot.reserved_slots[AgentId('i-101')]['cpu'] == Decimal('0')
+
+
+@pytest.mark.asyncio
+async def test_keypair_resource_limit_predicate_with_snapshot(example_pending_sessions):
+    pending_session = example_pending_sessions[1]
+    pending_session.resource_policy = 'default'
+    known_slot_types = {'cpu': 'count', 'mem': 'bytes', 'cuda.shares': 'count', 'rocm.devices': 'count'}
+    predicate_snapshot = PredicateSnapshot(
+        keypair_resource_policies={},
+        keypair_allowed_slots={
+            'default': ResourceSlot({
+                'cpu': Decimal('2.0'),
+                'mem': Decimal('3072'),
+                'cuda.shares': Decimal('1.0'),
+                'rocm.devices': Decimal('0'),
+            }),
+        },
+        group_allowed_slots={},
+        domain_allowed_slots={},
+        allowed_sgroups={},
+        session_starts_at={},
+        concurrency_used={},
+        keypair_occupancy={},
+        group_occupancy={},
+        domain_occupancy={},
+    )
+    sched_ctx = SchedulingContext(
+        registry=MagicMock(),
+        known_slot_types=known_slot_types,
+        predicate_snapshot=predicate_snapshot,
+    )
+    mock_db_conn = MagicMock()
+    mock_db_result = MagicMock()
+    mock_db_result.scalar = AsyncMock(return_value={})
+    mock_db_conn.execute = AsyncMock(return_value=mock_db_result)
+
+    # The check passed with the preloaded usage is confirmed with the locked DB row.
+    result = await check_keypair_resource_limit(mock_db_conn, sched_ctx, pending_session)
+    assert result.passed
+    mock_db_conn.execute.assert_awaited_once()
+    predicate_snapshot.add_occupancy(pending_session)
+    assert predicate_snapshot.keypair_occupancy[pending_session.access_key]['mem'] == Decimal('2048')
+    assert predicate_snapshot.domain_occupancy[pending_session.domain_name]['cpu'] == Decimal('1.0')
+
+    # The in-memory usage updated above makes the second request exceed the quota.
+    result = await check_keypair_resource_limit(mock_db_conn, sched_ctx, pending_session)
+    assert not result.passed
+    mock_db_conn.execute.assert_awaited_once()
+
+    # The sessions scheduled elsewhere since the preloading are seen in the DB row.
+    predicate_snapshot.keypair_occupancy.clear()
+    mock_db_result.scalar = AsyncMock(return_value={'cpu': '1.5', 'mem': '1024'})
+    result = await check_keypair_resource_limit(mock_db_conn, sched_ctx, pending_session)
+    assert not result.passed
+    assert predicate_snapshot.keypair_occupancy[pending_session.access_key]['cpu'] == Decimal('1.5')
+
+
+def _create_mock_dispatcher(lock_failures=()):
+    dispatcher = object.__new__(SchedulerDispatcher)
+    dispatcher.dbpool = MagicMock()
+    dispatcher.dbpool.acquire.return_value.__aenter__ = AsyncMock()
+    dispatcher.dbpool.acquire.return_value.__aexit__ = AsyncMock(return_value=None)
+    dispatcher.registry = MagicMock()
+    dispatcher.registry.redis_live.delete = AsyncMock(return_value=0)
+    dispatcher.registry.redis_live.set = AsyncMock()
+    dispatcher.session_view = None
+    dispatcher._running_sgroups = set()
+    dispatcher._rerun_sgroups = set()
+    dispatcher.locked_names = []
+
+    async def _lock(name):
+        if name in lock_failures:
+            raise aioredlock.LockError('already locked')
+        dispatcher.locked_names.append(name)
+        lock = MagicMock()
+        lock.__aenter__ = AsyncMock()
+        lock.__aexit__ = AsyncMock(return_value=None)
+        return lock
+
+    dispatcher.lock_manager = MagicMock()
+    dispatcher.lock_manager.lock = _lock
+    dispatcher.schedule_impl = AsyncMock()
+    return dispatcher
+
+
+@pytest.mark.asyncio
+async def test_schedule_per_scaling_group_locks():
+    dispatcher = _create_mock_dispatcher(lock_failures={'manager.scheduler.sg01'})
+    with mock.patch(
+        'ai.backend.manager.scheduler.dispatcher._resolve_target_sgroups',
+        AsyncMock(return_value={'sg01', 'sg02', 'sg03'}),
+    ):
+        await dispatcher.schedule(None, AgentId('i-001'), 'do_schedule')
+
+    # A locking failure of one scaling group should not block the others.
+    assert dispatcher.locked_names == ['manager.scheduler.sg02', 'manager.scheduler.sg03']
+    scheduled = sorted(call.args[0] for call in dispatcher.schedule_impl.await_args_list)
+    assert scheduled == ['sg02', 'sg03']
+    # The lock holder of sg01 is asked to run a follow-up pass.
+    dispatcher.registry.redis_live.set.assert_awaited_once_with(
+        'manager.scheduler.sg01.rerun', b'1', expire=60)
+
+
+@pytest.mark.asyncio
+async def test_schedule_coalesces_events_during_pass():
+    dispatcher = _create_mock_dispatcher()
+    pass_started = asyncio.Event()
+    pass_resumed = asyncio.Event()
+
+    async def _schedule_impl(sgroup_name):
+        if not pass_started.is_set():
+            pass_started.set()
+            await pass_resumed.wait()
+
+    dispatcher.schedule_impl = AsyncMock(side_effect=_schedule_impl)
+    first_pass = asyncio.create_task(dispatcher._schedule_sgroup('sg01'))
+    await pass_started.wait()
+    for _ in range(10):
+        await dispatcher._schedule_sgroup('sg01')
+    pass_resumed.set()
+    await first_pass
+    # The events during the first pass cause only one follow-up pass.
+    assert dispatcher.schedule_impl.await_count == 2
+
+    # A follow-up pass requested by other manager processes.
+    dispatcher.schedule_impl.reset_mock()
+    dispatcher.registry.redis_live.delete = AsyncMock(side_effect=[1, 0])
+    await dispatcher._schedule_sgroup('sg01')
+    assert dispatcher.schedule_impl.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_schedule_impl_starts_sessions_scheduled_before_no_instances():
+    dispatcher = _create_mock_dispatcher()
+    del dispatcher.schedule_impl
+    dispatcher.config_server = MagicMock()
+    dispatcher.config_server.get_resource_slots = AsyncMock(return_value={})
+    dispatcher._load_scheduler = AsyncMock(return_value=MagicMock())
+    db_conn = MagicMock()
+    db_conn.begin.return_value.__aenter__ = AsyncMock()
+    db_conn.begin.return_value.__aexit__ = AsyncMock(return_value=None)
+    dispatcher.dbpool.acquire.return_value.__aenter__ = AsyncMock(return_value=db_conn)
+    dispatcher.start_executor = MagicMock()
+
+    def _submit(start_fn, *, session_type, agent_ids):
+        fut = asyncio.get_running_loop().create_future()
+        fut.set_result(None)
+        return fut
+
+    dispatcher.start_executor.submit = MagicMock(side_effect=_submit)
+    scheduled = ScheduledSession(
+        sched_ctx=MagicMock(),
+        session_agent_binding=(MagicMock(session_type=SessionTypes.INTERACTIVE), []),
+        check_results=[],
+    )
+
+    async def _schedule_pending_sessions(*args, scheduled_sessions, touched_session_ids):
+        # The first session is scheduled and then the pass runs out of agents.
+        scheduled_sessions.append(scheduled)
+        raise InstanceNotAvailable
+
+    with mock.patch.multiple(
+        'ai.backend.manager.scheduler.dispatcher',
+        _list_pending_sessions=AsyncMock(return_value=[]),
+        _list_existing_sessions=AsyncMock(return_value=[]),
+        _list_agents_by_sgroup=AsyncMock(return_value=[]),
+        preload_predicate_snapshot=AsyncMock(return_value=None),
+        schedule_pending_sessions=_schedule_pending_sessions,
+    ):
+        await dispatcher.schedule_impl('sg01')
+    # The sessions already committed as PREPARING are still started.
+    dispatcher.start_executor.submit.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_session_queue_view_incremental_sync(example_pending_sessions, example_existing_sessions):
+    created_at = [dtparse(f'2020-10-01T00:00:0{idx}+00:00') for idx in range(3)]
+    pending_rows = list(zip(created_at, example_pending_sessions))
+    query_pending = AsyncMock(return_value=pending_rows)
+    query_existing = AsyncMock(return_value=example_existing_sessions)
+    view = SessionQueueView()
+    with mock.patch.multiple(
+        'ai.backend.manager.scheduler.dispatcher',
+        _query_pending_sessions=query_pending,
+        _query_existing_sessions=query_existing,
+    ):
+        await view.sync(MagicMock())
+        assert [s.session_id for s in view.list_pending_sessions('sg01')] == \
+               [s.session_id for s in example_pending_sessions]
+        assert len(view.list_existing_sessions('sg01')) == len(example_existing_sessions)
+
+        # Without any changes, the view does not touch the database.
+        query_pending.reset_mock()
+        await view.sync(MagicMock())
+        query_pending.assert_not_awaited()
+
+        # Only the changed sessions are reloaded.
+        scheduled_session = example_pending_sessions[0]
+        view.mark_dirty(scheduled_session.session_id)
+        query_pending.return_value = []
+        query_existing.return_value = []
+        await view.sync(MagicMock())
+        query_pending.assert_awaited_once()
+        assert scheduled_session.session_id not in {
+            s.session_id for s in view.list_pending_sessions('sg01')
+        }
+        assert len(view.list_pending_sessions('sg01')) == len(example_pending_sessions) - 1
+        assert len(view.list_existing_sessions('sg01')) == len(example_existing_sessions)
+
+
+def test_capacity_matrix_selection(example_agents):
+    matrix = AgentCapacityMatrix(example_agents)
+    indices = matrix.indices_of(example_agents)
+    assert indices == [0, 1]
+
+    requested_slots = ResourceSlot({
+        'cpu': Decimal('2.0'),
+        'mem': Decimal('1024'),
+        'cuda.shares': Decimal('0'),
+        'rocm.devices': Decimal('4'),
+    })
+    # Only i-101 has enough ROCm devices.
+    assert matrix.fits(requested_slots, indices) == [1]
+    assert matrix.fits(ResourceSlot({'tpu.devices': Decimal('1')}), indices) == []
+
+    requested_slots = ResourceSlot({'cpu': Decimal('1.0'), 'mem': Decimal('1024')})
+    candidates = matrix.fits(requested_slots, indices)
+    assert candidates == [0, 1]
+    assert matrix.select(candidates, requested_slots) == AgentId('i-001')
+    assert matrix.select(
+        candidates, requested_slots, AgentSelectionStrategy.WORST_FIT,
+    ) == AgentId('i-001')
+    assert matrix.select(
+        candidates, requested_slots, AgentSelectionStrategy.BEST_FIT,
+    ) == AgentId('i-101')
+
+
+def test_capacity_matrix_follows_reservations(example_agents):
+    snapshot = SchedulingSnapshot('sg01', example_agents)
+    scheduler = FIFOSlotScheduler({'agent-selection': 'worst-fit'})
+    scheduler.capacity_matrix = snapshot.capacity
+    requested_slots = ResourceSlot({'cpu': Decimal('3.0'), 'mem': Decimal('1024')})
+
+    agent_id = scheduler._assign_agent(snapshot.agents, requested_slots)
+    assert agent_id == AgentId('i-001')
+    snapshot.reserve(agent_id, requested_slots)
+    # The reservation is reflected to the capacity matrix in place.
+    agent_id = scheduler._assign_agent(snapshot.agents, requested_slots)
+    assert agent_id == AgentId('i-101')
+    snapshot.reserve(agent_id, requested_slots)
+    assert scheduler._assign_agent(snapshot.agents, requested_slots) is None
+
+
+def test_backfill_reservation(example_agents, example_pending_sessions):
+    example_agents[0].occupied_slots = ResourceSlot({'cpu': Decimal('3.0')})
+    example_agents[1].occupied_slots = ResourceSlot({'cpu': Decimal('2.0')})
+    scheduler = FIFOSlotScheduler({'backfill': 'true'})
+    assert scheduler.backfill
+    blocked_session = example_pending_sessions[0]
+    assert scheduler.assign_agent_for_session(example_agents, blocked_session) is None
+
+    # i-001 needs a smaller portion of its capacity to be freed.
+    reservation = reserve_agents_for_blocked_session(scheduler, example_agents, blocked_session)
+    assert reservation is not None
+    assert reservation.session_id == blocked_session.session_id
+    assert reservation.agent_ids == {AgentId('i-001')}
+    remaining_agents = reservation.exclude_from(example_agents)
+    assert [ag.agent_id for ag in remaining_agents] == [AgentId('i-101')]
+    assert not may_fit_into(scheduler, remaining_agents, blocked_session)
+
+    small_session = attr.evolve(
+        blocked_session,
+        requested_slots=ResourceSlot({'cpu': Decimal('1.0'), 'mem': Decimal('512')}),
+    )
+    assert may_fit_into(scheduler, remaining_agents, small_session)
+
+    # No reservation is made for a session that does not fit even into the empty agents.
+    huge_session = attr.evolve(
+        blocked_session,
+        requested_slots=ResourceSlot({'cpu': Decimal('8.0'), 'mem': Decimal('512')}),
+    )
+    assert reserve_agents_for_blocked_session(scheduler, example_agents, huge_session) is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('scheduler_name', ['fifo', 'drf'])
+async def test_scheduler_simulation_backfill(scheduler_name):
+    config = SimulationConfig(
+        num_agents=8,
+        num_sessions=60,
+        num_users=5,
+        multi_node_ratio=0.2,
+        accelerated_agent_ratio=0.5,
+        clusterized_agent_ratio=0.5,
+        max_concurrent_sessions=4,
+        max_ticks=50,
+    )
+    result = await run_simulation(scheduler_name, config, scheduler_config={'backfill': True})
+    assert result.num_started + result.num_remaining == config.num_sessions
+    assert result.num_started > 0
+    assert 0 < result.utilization <= 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('scheduler_name', ['fifo', 'lifo', 'drf'])
+async def test_scheduler_simulation(scheduler_name):
+    config = SimulationConfig(
+        num_agents=8,
+        num_sessions=60,
+        num_users=5,
+        multi_node_ratio=0.2,
+        # Let all pending sessions have capable agents to avoid head-of-line blocking.
+        accelerated_agent_ratio=1.0,
+        clusterized_agent_ratio=1.0,
+        max_concurrent_sessions=4,
+        max_ticks=50,
+    )
+    result = await run_simulation(scheduler_name, config)
+    assert result.num_started + result.num_remaining == config.num_sessions
+    assert result.num_started > 0
+    assert len(result.tick_latencies) == result.num_ticks
+    assert 0 <= result.fragmentation <= 1
+    assert 0 < result.utilization <= 1
+    assert 0 < result.fairness <= 1
+
+
+@pytest.mark.asyncio
+async def test_session_start_executor_order_and_limits():
+    executor = SessionStartExecutor(max_concurrency=2, max_concurrency_per_agent=1)
+    gate = asyncio.Event()
+    started = []
+    running = 0
+    max_running = 0
+
+    def _make_start(name):
+        async def _start():
+            nonlocal running, max_running
+            started.append(name)
+            running += 1
+            max_running = max(max_running, running)
+            await gate.wait()
+            running -= 1
+            if name == 'b2':
+                raise RuntimeError('start failure')
+        return _start
+
+    futures = [
+        executor.submit(_make_start('b1'), session_type=SessionTypes.BATCH,
+                        agent_ids=[AgentId('i-001')]),
+        executor.submit(_make_start('b2'), session_type=SessionTypes.BATCH,
+                        agent_ids=[AgentId('i-001')]),
+        executor.submit(_make_start('i1'), session_type=SessionTypes.INTERACTIVE,
+                        agent_ids=[AgentId('i-001')]),
+        executor.submit(_make_start('i2'), session_type=SessionTypes.INTERACTIVE,
+                        agent_ids=[AgentId('i-002')]),
+        executor.submit(_make_start('b3'), session_type=SessionTypes.BATCH,
+                        agent_ids=[AgentId('i-003')]),
+    ]
+    await asyncio.sleep(0)
+    # The first batch start took i-001 before the interactive ones were submitted.
+    assert started == ['b1', 'i2']
+    assert executor.queue_depth == 3
+    assert executor.num_running == 2
+    gate.set()
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    # Interactive sessions go first, skipping the starts blocked by busy agents.
+    assert started == ['b1', 'i2', 'i1', 'b3', 'b2']
+    assert max_running == 2
+    assert isinstance(results[1], RuntimeError)
+    assert [r for idx, r in enumerate(results) if idx != 1] == [None] * 4
+
+    metrics = executor.collect_metrics()
+    assert metrics['queue_depth'] == 0
+    assert metrics['running'] == 0
+    assert metrics['started'] == 5
+    assert metrics['finished'] == 5
+    assert metrics['failed'] == 1
+    assert metrics['max_wait_time'] >= metrics['avg_wait_time'] > 0
+    assert executor.collect_metrics()['started'] == 0
+
+
+@pytest.mark.asyncio
+async def test_session_start_executor_close():
+    executor = SessionStartExecutor(max_concurrency=1, max_concurrency_per_agent=1)
+    gate = asyncio.Event()
+
+    async def _start():
+        await gate.wait()
+
+    running = executor.submit(_start, session_type=SessionTypes.BATCH, agent_ids=[AgentId('i-001')])
+    queued = executor.submit(_start, session_type=SessionTypes.BATCH, agent_ids=[AgentId('i-002')])
+    await asyncio.sleep(0)
+    close_task = asyncio.create_task(executor.close())
+    await asyncio.sleep(0)
+    # New starts are rejected while the submitted ones are drained.
+    with pytest.raises(RuntimeError):
+        executor.submit(_start, session_type=SessionTypes.BATCH, agent_ids=[AgentId('i-001')])
+    assert not close_task.done()
+    gate.set()
+    await close_task
+    # The submitted starts run to completion instead of being cancelled
+    # as their sessions have already reserved the resources.
+    assert running.done() and not running.cancelled()
+    assert queued.done() and not queued.cancelled()
+    assert executor.queue_depth == 0
+    assert executor.num_running == 0
+
+
 # TODO: write tests for multiple agents and scaling groups
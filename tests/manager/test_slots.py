@@ -0,0 +1,82 @@
+from decimal import Decimal, ROUND_FLOOR
+
+import pytest
+
+from ai.backend.common.types import ResourceSlot
+
+from ai.backend.manager.slots import SlotLayout, sum_resource_slots
+
+
+def test_slot_layout_is_interned():
+    layout = SlotLayout.of(['mem', 'cpu', 'cuda.shares'])
+    assert layout is SlotLayout.of({'cpu': 'count', 'mem': 'bytes', 'cuda.shares': 'count'})
+    assert layout.names == ('cpu', 'cuda.shares', 'mem')
+    assert layout is not SlotLayout.of(['cpu', 'mem'])
+
+
+def test_slot_vector_arithmetic():
+    layout = SlotLayout.of(['cpu', 'mem', 'cuda.shares'])
+    available = layout.vectorize(ResourceSlot({
+        'cpu': Decimal('4.0'),
+        'mem': Decimal('4294967296'),
+        'cuda.shares': Decimal('2.5'),
+    }), ROUND_FLOOR)
+    # The missing slot types are zero and the unknown slot types are ignored.
+    occupied = layout.vectorize(ResourceSlot({
+        'cpu': Decimal('1.5'),
+        'mem': Decimal('1073741824'),
+        'tpu.devices': Decimal('1'),
+    }))
+    remaining = available - occupied
+    assert remaining.to_slots() == ResourceSlot({
+        'cpu': Decimal('2.5'),
+        'mem': Decimal('3221225472'),
+        'cuda.shares': Decimal('2.5'),
+    })
+    assert remaining['cpu'] == Decimal('2.5')
+    assert dict(remaining.items()) == dict(zip(remaining.keys(), remaining.values()))
+    assert dict(remaining.to_json()) == {
+        'cpu': '2.5',
+        'mem': '3221225472',
+        'cuda.shares': '2.5',
+    }
+    assert available >= occupied
+    assert not (occupied >= available)
+    assert occupied + remaining == available
+
+    remaining -= occupied
+    assert remaining['cpu'] == Decimal('1')
+    remaining += occupied
+    assert remaining['cpu'] == Decimal('2.5')
+    assert occupied.to_slots(drop_zeros=True) == ResourceSlot({
+        'cpu': Decimal('1.5'),
+        'mem': Decimal('1073741824'),
+    })
+    assert 'cuda.shares' not in occupied.to_slots(drop_zeros=True)
+
+    # Unlimited amounts survive the arithmetic.
+    unlimited = layout.vectorize({k: Decimal('Infinity') for k in layout.names})
+    assert (unlimited - occupied)['mem'] == Decimal('Infinity')
+    assert unlimited.minimum(available, occupied) == layout.vectorize({
+        'cpu': Decimal('1.5'),
+        'mem': Decimal('1073741824'),
+    })
+
+    with pytest.raises(ValueError):
+        available + SlotLayout.of(['cpu', 'mem']).zeros()
+    with pytest.raises(ValueError):
+        layout.vectorize({'cpu': Decimal('NaN')})
+
+
+def test_sum_resource_slots():
+    total = sum_resource_slots([
+        ResourceSlot({'cpu': Decimal('1'), 'mem': Decimal('1024')}),
+        ResourceSlot({'cpu': Decimal('0.5'), 'cuda.shares': Decimal('0.2')}),
+    ])
+    assert isinstance(total, ResourceSlot)
+    assert total == ResourceSlot({
+        'cpu': Decimal('1.5'),
+        'mem': Decimal('1024'),
+        'cuda.shares': Decimal('0.2'),
+    })
+    assert sum_resource_slots([]) == ResourceSlot()
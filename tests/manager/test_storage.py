@@ -0,0 +1,33 @@
+from contextlib import asynccontextmanager as actxmgr
+import uuid
+
+from ai.backend.manager.models.storage import StorageSessionManager
+
+
+async def test_get_mount_paths_resolves_and_caches(mocker):
+    storage_manager = StorageSessionManager({'proxies': {}})
+    requested = []
+
+    @actxmgr
+    async def mocked_request(vfolder_host, method, request_relpath, **kwargs):
+        requested.append((vfolder_host, kwargs['json']['vfid']))
+        resp = mocker.MagicMock()
+        resp.json = mocker.AsyncMock(return_value={
+            'path': f"/mnt/{kwargs['json']['volume']}/{kwargs['json']['vfid']}",
+        })
+        yield None, resp
+
+    mocker.patch.object(storage_manager, 'request', mocked_request)
+    vfids = [uuid.uuid4() for _ in range(3)]
+    keys = [('local:volume1', vfid) for vfid in vfids]
+    mount_paths = await storage_manager.get_mount_paths([*keys, keys[0]])
+    assert mount_paths == {key: f'/mnt/volume1/{key[1]}' for key in keys}
+    assert sorted(requested) == sorted((host, str(vfid)) for host, vfid in keys)
+
+    # The resolved mount paths are served from the cache.
+    requested.clear()
+    assert await storage_manager.get_mount_path(*keys[1]) == f'/mnt/volume1/{vfids[1]}'
+    mount_paths = await storage_manager.get_mount_paths(keys)
+    assert len(mount_paths) == 3
+    assert requested == []
+    await storage_manager.aclose()